@@ -0,0 +1,112 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import random
+import bisect
+
+class ZipfSampler:
+	"""
+	Draws ranks 0 .. n-1 such that the probability of rank r is proportional to 1 / (r + 1) ** s
+	"""
+
+	def __init__(self, n, s=1.0, rng=random):
+		"""
+		ZipfSampler(n, s, rng) -> instance of class ZipfSampler
+
+		@param n: Number of ranks
+		@type n: int
+
+		@param s: Exponent of the distribution. 0 gives a uniform distribution
+		@type s: float
+
+		@param rng: Source of random numbers
+		@type rng: random.Random
+		"""
+
+		self.rng = rng
+		self.cumulative = []
+		total = 0.0
+		for rank in range(n):
+			total = total + 1.0 / (rank + 1) ** s
+			self.cumulative.append(total)
+		self.total = total
+
+	def sample(self):
+		"""
+		Z.sample() -> Draw a rank
+
+		@rtype: int
+		"""
+
+		return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+def tagName(rank):
+	"""
+	tagName(rank) -> Name of the tag with the given popularity rank, 0 being the most popular
+
+	@rtype: str
+	"""
+
+	return 'tag%d' % rank
+
+def generateCorpus(elements, tagsPerElement, tags, s=1.0, seed=0):
+	"""
+	generateCorpus(elements, tagsPerElement, tags, s, seed) -> Generate a synthetic tag corpus
+
+	The popularity of tags follows a Zipf distribution with exponent s.
+
+	@param elements: Number of elements
+	@type elements: int
+
+	@param tagsPerElement: Number of distinct tags associated with each element
+	@type tagsPerElement: int
+
+	@param tags: Number of tags in the vocabulary
+	@type tags: int
+
+	@param s: Exponent of the Zipf distribution of tag popularity
+	@type s: float
+
+	@param seed: Seed for the random numbers, the same seed generates the same corpus
+	@type seed: int
+
+	@return: List of tuples (element number, list of tags)
+	@rtype: List of (int, List of str)
+	"""
+
+	rng = random.Random(seed)
+	sampler = ZipfSampler(tags, s, rng)
+	tagsPerElement = min(tagsPerElement, tags)
+
+	corpus = []
+	for element in range(elements):
+		ranks = set()
+		while len(ranks) < tagsPerElement:
+			ranks.add(sampler.sample())
+		corpus.append((element, [tagName(x) for x in ranks]))
+
+	return corpus
@@ -0,0 +1,73 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Stand-in for the fuse module, for driving Dhtfs without the kernel
+
+Only the parts of the python-fuse API used by dhtfs are provided. install has to be
+called before dhtfs.Dhtfs is imported.
+"""
+
+import sys
+
+__version__ = 'fakefuse'
+fuse_python_api = (0, 2)
+
+def feature_assert(*features):
+	return True
+
+def install():
+	"""
+	install() -> Make this module be imported as fuse
+	"""
+
+	sys.modules['fuse'] = sys.modules[__name__]
+
+class Direntry(object):
+
+	def __init__(self, name, **kw):
+		self.name = name
+		self.type = 0
+		self.ino = 0
+		self.offset = 0
+		self.__dict__.update(kw)
+
+class FuseArgs(object):
+
+	def mount_expected(self):
+		return True
+
+class Fuse(object):
+
+	fusage = ''
+
+	def __init__(self, *args, **kw):
+		self.fuse_args = FuseArgs()
+
+	def main(self, *args, **kw):
+		# Requests are made by calling the methods of the file system directly
+		return None
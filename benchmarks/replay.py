@@ -0,0 +1,237 @@
+#!/usr/bin/python
+
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Replays a trace recorded by mount.dhtfs with the 'trace' option, without mounting
+
+The operations are made directly on an instance of Dhtfs over a scratch copy of a
+file system, with fakefuse standing in for the fuse module. Latencies of each
+operation are reported along with those recorded in the trace.
+"""
+
+import sys
+import os
+import csv
+import shutil
+import tempfile
+import logging
+import timeit
+from optparse import OptionParser
+
+import fakefuse
+fakefuse.install()
+
+from dhtfs.Dhtfs import Dhtfs
+from dhtfs.Trace import readTrace, getErrno
+
+COLUMNS = ['operation', 'count', 'errors', 'mismatches', 'total_s', 'mean_ms', 'median_ms',
+		'p95_ms', 'max_ms', 'recorded_mean_ms', 'recorded_p95_ms']
+
+class Replayer(object):
+	"""
+	Makes the operations of a trace on a Dhtfs instance and collects their latencies
+	"""
+
+	def __init__(self, server):
+		self.server = server
+		self.handles = {}
+
+		# operation -> list of latencies
+		self.latencies = {}
+		self.recorded = {}
+
+		# operation -> number of failed calls
+		self.errors = {}
+
+		# operation -> number of calls whose outcome differs from the trace
+		self.mismatches = {}
+
+	def __call(self, op, handle, args):
+		server = self.server
+
+		if op == 'open':
+			self.handles[handle] = server.file_class(*args)
+			return 0
+
+		if handle is not None:
+			fileObject = self.handles.get(handle)
+			if fileObject is None:
+				# File could not be opened
+				raise IOError(9, 'Bad file descriptor')
+			if op == 'write':
+				args = ('x' * args[0],) + tuple(args[1:])
+			result = getattr(fileObject, op)(*args)
+			if op == 'release':
+				del self.handles[handle]
+			return result
+
+		result = getattr(server, op)(*args)
+		if op == 'readdir':
+			result = list(result)
+		return result
+
+	def run(self, records):
+		"""
+		R.run(records) -> Make the operations in records, as read by readTrace
+		"""
+
+		timer = timeit.default_timer
+		for op, handle, args, start, elapsed, err in records:
+			begin = timer()
+			try:
+				result = getErrno(self.__call(op, handle, args))
+			except (OSError, IOError), e:
+				result = e.errno
+			except:
+				self.server.logger.exception("Replay of %s %s failed" % (op, args))
+				result = -1
+			taken = timer() - begin
+
+			self.latencies.setdefault(op, []).append(taken)
+			self.recorded.setdefault(op, []).append(elapsed)
+			if result:
+				self.errors[op] = self.errors.get(op, 0) + 1
+			if result != err:
+				self.mismatches[op] = self.mismatches.get(op, 0) + 1
+
+	def getResults(self):
+		"""
+		R.getResults() -> List of rows of results, one row for each operation
+		"""
+
+		rows = []
+		for op in sorted(self.latencies.keys()):
+			times = self.latencies[op]
+			recorded = sorted(self.recorded[op])
+			times.sort()
+			rows.append([op, len(times), self.errors.get(op, 0), self.mismatches.get(op, 0),
+					'%.6f' % sum(times),
+					'%.3f' % (1000 * sum(times) / len(times)),
+					'%.3f' % (1000 * percentile(times, 50)),
+					'%.3f' % (1000 * percentile(times, 95)),
+					'%.3f' % (1000 * times[-1]),
+					'%.3f' % (1000 * sum(recorded) / len(recorded)),
+					'%.3f' % (1000 * percentile(recorded, 95))])
+
+		return rows
+
+def percentile(values, p):
+	return values[min(len(values) - 1, len(values) * p / 100)]
+
+def prepareRoot(scratch, source):
+	root = os.path.join(scratch, 'root')
+	if source:
+		# Do not copy the socket of a file system that is mounted
+		shutil.copytree(source, root, symlinks=True, ignore=shutil.ignore_patterns(Dhtfs.CTL_FILE))
+	else:
+		os.mkdir(root)
+		Dhtfs.setup(root, forceInit=True)
+
+	return root
+
+def parseCommandLine():
+	usage = """usage: %prog [options] TRACE
+		Replay a trace of dhtfs operations against a scratch file system and report the latencies
+		"""
+
+	parser = OptionParser(usage=usage)
+	parser.add_option("-f", "--from", dest="source", default=None, metavar="DIR",
+			help="Start from a copy of the unmounted file system in DIR [default: empty file system]")
+	parser.add_option("-d", "--dedup", dest="dedup", default="off", metavar="on|off",
+			help="Replay with dedup set to on or off [default: %default]")
+	parser.add_option("-c", "--getcover", dest="getCover", default="Dont Care",
+			help="Value of the getcover mount option [default: %default]")
+	parser.add_option("-q", "--quiet", dest="quiet", default=False, action="store_true",
+			help="Do not write debug messages to the log during the replay")
+	parser.add_option("-p", "--profile", dest="profile", default=None, metavar="FILE",
+			help="Run the replay under cProfile and save the statistics to FILE")
+	parser.add_option("-o", "--output", dest="output", default="-",
+			help="File to write the results to, '-' for standard output [default: %default]")
+	parser.add_option("-k", "--keep", dest="keep", default=False, action="store_true",
+			help="Do not remove the scratch file system after the replay")
+
+	(options, args) = parser.parse_args()
+
+	if len(args) != 1:
+		parser.error("A trace file needs to be specified")
+
+	if options.source and not Dhtfs.checkSetup(options.source):
+		parser.error("%s does not seem to be formatted for dhtfs" % options.source)
+
+	return options, args[0]
+
+def main():
+	options, tracePath = parseCommandLine()
+
+	records = list(readTrace(tracePath))
+
+	scratch = tempfile.mkdtemp(prefix='dhtfs-replay-')
+	try:
+		server = Dhtfs()
+		server.root = prepareRoot(scratch, options.source)
+		server.dedup = options.dedup
+		server.getCover = options.getCover
+		server.main()
+		if options.quiet:
+			server.logger.setLevel(logging.WARNING)
+		server.fsinit()
+
+		replayer = Replayer(server)
+		try:
+			if options.profile:
+				import cProfile
+				import pstats
+
+				profiler = cProfile.Profile()
+				profiler.runcall(replayer.run, records)
+				profiler.dump_stats(options.profile)
+				pstats.Stats(options.profile, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+			else:
+				replayer.run(records)
+		finally:
+			server.fsdestroy()
+	finally:
+		if options.keep:
+			print >> sys.stderr, "Scratch file system left in %s" % scratch
+		else:
+			shutil.rmtree(scratch)
+
+	if options.output == '-':
+		output = sys.stdout
+	else:
+		output = file(options.output, 'wb')
+
+	writer = csv.writer(output)
+	writer.writerow(COLUMNS)
+	writer.writerows(replayer.getResults())
+	if output is not sys.stdout:
+		output.close()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmarks of the storage and query layers of dhtfs against synthetic corpora
+
+Results are written as CSV, one row for each benchmark and corpus size, so that
+results of different versions can be compared.
+"""
+
+import sys
+import os
+import csv
+import shutil
+import tempfile
+import timeit
+from optparse import OptionParser
+
+import corpus
+from dhtfs.GPStor import GPStor
+from dhtfs.Tagging import Tagging
+from dhtfs.TagHelper import TagDir, TagFile
+
+DB_FILE = '.bench.db'
+
+COLUMNS = ['benchmark', 'elements', 'tags_per_element', 'tags', 'zipf', 'repeat',
+		'min_s', 'median_s', 'mean_s']
+
+def makeFile(number):
+	return TagFile('f_' + ('%x' % number).rjust(32, '0'), 'file%d.dat' % number)
+
+def measure(fn, repeat):
+	"""
+	measure(fn, repeat) -> Call fn repeat times and get the time taken by each call
+
+	@rtype: List of float
+	"""
+
+	times = []
+	for i in range(repeat):
+		start = timeit.default_timer()
+		fn()
+		times.append(timeit.default_timer() - start)
+
+	return times
+
+def summarize(times):
+	times = sorted(times)
+	median = times[len(times) / 2]
+	mean = sum(times) / len(times)
+	return times[0], median, mean
+
+def loadCorpus(tagdir, elements):
+	# Load all the elements, with a size spread over 0 to 100000, in a single update of the database
+	tagdir.setWriteCaching()
+	for number, tags in elements:
+		Tagging.addTags(tagdir, [makeFile(number)], tags)
+	Tagging.setAttributes(tagdir, dict([(makeFile(number), { 'size' : number * 7919 % 100000 })
+				for number, tags in elements]))
+	tagdir.doneWriteCaching()
+
+def getCases(path, tagdir, elements, options):
+	"""
+	getCases(path, tagdir, elements, options) -> List of tuples (name, function, repeat) to be measured
+	"""
+
+	popular = corpus.tagName(0)
+	second = corpus.tagName(1)
+	third = corpus.tagName(2)
+	middle = corpus.tagName(options.tags / 2)
+
+	# A file with the most popular tag, to be looked up by name
+	target = [makeFile(n) for n, tags in elements if popular in tags][:1]
+	nextNumber = [len(elements)]
+
+	def gpstorLoad():
+		GPStor(db_path=path, db_file=DB_FILE, caching=False).getDataRO()
+
+	def gpstorWrite():
+		store = GPStor(db_path=path, db_file=DB_FILE, caching=False)
+		err, data = store.getDataRW()
+		store.writeData(data)
+
+	def addTags():
+		tagdir.addTags([makeFile(nextNumber[0])], [popular, middle])
+		nextNumber[0] = nextNumber[0] + 1
+
+	def getActualLocation():
+		if target:
+			tagdir.getActualLocation([popular], target[0].name)
+
+	def getElements3Tags():
+		# Results of queries are cached, the elements are counted from the query every time
+		tagdir.queryCache = {}
+		tagdir.getElements([popular, second, third])
+
+	def restrictive2Tags(approximate):
+		# Listings are worked out from samples of the elements of any size for the measure
+		tagdir.approximate = approximate
+		tagdir.APPROXIMATE_THRESHOLD = 0
+		try:
+			tagdir.getTagsAndElementsForTags([popular, '-' + second], beRestrictive=True)
+		finally:
+			tagdir.approximate = True
+			del tagdir.APPROXIMATE_THRESHOLD
+
+	repeat = options.repeat
+	return [
+		('gpstor_load', gpstorLoad, repeat),
+		('gpstor_write', gpstorWrite, repeat),
+		('addTags', addTags, repeat),
+		('getElements_1tag', lambda: tagdir.getElements([popular]), repeat),
+		('getElements_2tags', lambda: tagdir.getElements([popular, second]), repeat),
+		('getElements_rare', lambda: tagdir.getElements([middle]), repeat),
+		('getElements_3tags', getElements3Tags, repeat),
+		('estimateElements_3tags', lambda: tagdir.estimateElements([popular, second, third]), repeat),
+		('getElements_or', lambda: tagdir.getElements([second + '|' + middle]), repeat),
+		('getElements_not', lambda: tagdir.getElements([popular, '-' + second]), repeat),
+		('getElements_prefix', lambda: tagdir.getElements([middle[:-1] + '*']), repeat),
+		('getTagsWithPrefix', lambda: tagdir.getTagsWithPrefix(middle[:-1]), repeat),
+		('searchElements', lambda: tagdir.searchElements(target[0].name[:-1]), repeat),
+		('getElements_size', lambda: tagdir.getElements(['//size>90000']), repeat),
+		('getElements_size_tag', lambda: tagdir.getElements([popular, '//size>90000']), repeat),
+		('tagsAndElements_root', lambda: tagdir.getTagsAndElementsForTags([]), repeat),
+		('tagsAndElements_plain', lambda: tagdir.getTagsAndElementsForTags([popular]), repeat),
+		('tagsAndElements_restrictive',
+			lambda: tagdir.getTagsAndElementsForTags([popular], beRestrictive=True), repeat),
+		('tagsAndElements_cover',
+			lambda: tagdir.getTagsAndElementsForTags([popular], getCover=True), repeat),
+		('tagsAndElements_restrictive_2tags', lambda: restrictive2Tags(False), repeat),
+		('tagsAndElements_restrictive_2tags_approximate', lambda: restrictive2Tags(True), repeat),
+		('getRelatedTags', lambda: tagdir.getRelatedTags([popular]), repeat),
+		('tagsAndElements_root_restrictive',
+			lambda: tagdir.getTagsAndElementsForTags([], beRestrictive=True), repeat),
+		('rankedTagsAndElements_root',
+			lambda: tagdir.getRankedTagsAndElementsForTags([], 105), repeat),
+		('rankedTagsAndElements_1tag',
+			lambda: tagdir.getRankedTagsAndElementsForTags([popular], 105), repeat),
+		('rankedTagsAndElements_2tags',
+			lambda: tagdir.getRankedTagsAndElementsForTags([popular, second], 105), repeat),
+		('getActualLocation', getActualLocation, repeat),
+		('saveQuery', lambda: tagdir.saveQuery('bench', [popular, second]), repeat),
+		('getElements_saved', lambda: tagdir.getElements([Tagging.SAVED_TERM_PREFIX + 'bench']), repeat),
+		('addTags_saved', addTags, repeat),
+		('setImpliedTags', lambda: tagdir.setImpliedTags(middle, ['bench']), repeat),
+		('getElements_implied', lambda: tagdir.getElements(['bench']), repeat),
+		('rankedTagsAndElements_implied',
+			lambda: tagdir.getRankedTagsAndElementsForTags(['bench'], 105), repeat),
+		('addTags_implied', addTags, repeat),
+	]
+
+def run(options, writer):
+	for size in options.sizes:
+		elements = corpus.generateCorpus(size, options.tagsPerElement, options.tags,
+						options.zipf, options.seed)
+
+		path = tempfile.mkdtemp(prefix='dhtfs-bench-')
+		try:
+			tagdir = TagDir(db_path=path, db_file=DB_FILE)
+			tagdir.initDB(forceInit=True)
+
+			cases = [('load_corpus', lambda: loadCorpus(tagdir, elements), 1)]
+			cases.extend(getCases(path, tagdir, elements, options))
+
+			for name, fn, repeat in cases:
+				if options.only and name not in options.only:
+					# The corpus is needed by all other benchmarks
+					if name == 'load_corpus':
+						fn()
+					continue
+
+				low, median, mean = summarize(measure(fn, repeat))
+				writer.writerow([name, size, options.tagsPerElement, options.tags, options.zipf,
+						repeat, '%.6f' % low, '%.6f' % median, '%.6f' % mean])
+				sys.stdout.flush()
+		finally:
+			shutil.rmtree(path)
+
+def parseCommandLine():
+	usage = """usage: %prog [options]
+		Run the dhtfs benchmarks and write the results as CSV
+		"""
+
+	parser = OptionParser(usage=usage)
+	parser.add_option("-s", "--sizes", dest="sizes", default="1000,10000",
+			help="Comma seperated numbers of elements in the corpora [default: %default]")
+	parser.add_option("-p", "--tags-per-element", dest="tagsPerElement", default=4, type="int",
+			help="Number of tags of each element [default: %default]")
+	parser.add_option("-t", "--tags", dest="tags", default=1000, type="int",
+			help="Number of tags in the vocabulary [default: %default]")
+	parser.add_option("-z", "--zipf", dest="zipf", default=1.0, type="float",
+			help="Exponent of the Zipf distribution of tag popularity [default: %default]")
+	parser.add_option("-r", "--repeat", dest="repeat", default=5, type="int",
+			help="Number of times each benchmark is run [default: %default]")
+	parser.add_option("--seed", dest="seed", default=0, type="int",
+			help="Seed for generating the corpora [default: %default]")
+	parser.add_option("-b", "--benchmarks", dest="only", default="",
+			help="Comma seperated names of the benchmarks to run [default: all]")
+	parser.add_option("-o", "--output", dest="output", default="-",
+			help="File to write the results to, '-' for standard output [default: %default]")
+
+	(options, args) = parser.parse_args()
+
+	try:
+		options.sizes = [int(x) for x in options.sizes.split(',') if x != '']
+	except ValueError:
+		parser.error("Invalid sizes '%s'" % options.sizes)
+
+	options.only = [x for x in options.only.split(',') if x != '']
+
+	if options.repeat < 1:
+		parser.error("Benchmarks need to be run atleast once")
+
+	return options
+
+def main():
+	options = parseCommandLine()
+
+	if options.output == '-':
+		output = sys.stdout
+	else:
+		output = file(options.output, 'wb')
+
+	writer = csv.writer(output)
+	writer.writerow(COLUMNS)
+	try:
+		run(options, writer)
+	finally:
+		if output is not sys.stdout:
+			output.close()
+
+if __name__ == '__main__':
+	main()
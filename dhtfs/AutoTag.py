@@ -0,0 +1,228 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+import struct
+import mimetypes
+
+# Number of bytes read from the start of a file to find its type and embedded date
+HEADER_SIZE = 65536
+
+# Signatures at the start of files of common types, as (offset, bytes, type)
+SIGNATURES = [
+	(0, '\xff\xd8\xff', 'image/jpeg'),
+	(0, '\x89PNG\r\n\x1a\n', 'image/png'),
+	(0, 'GIF87a', 'image/gif'),
+	(0, 'GIF89a', 'image/gif'),
+	(0, 'II*\x00', 'image/tiff'),
+	(0, 'MM\x00*', 'image/tiff'),
+	(0, '%PDF-', 'application/pdf'),
+	(0, 'PK\x03\x04', 'application/zip'),
+	(0, '\x1f\x8b', 'application/x-gzip'),
+	(0, '\x7fELF', 'application/x-executable'),
+	(0, 'ID3', 'audio/mpeg'),
+	(0, '\xff\xfb', 'audio/mpeg'),
+	(0, 'OggS', 'audio/ogg'),
+	(0, 'fLaC', 'audio/flac'),
+	(8, 'WAVE', 'audio/x-wav'),
+	(8, 'AVI ', 'video/x-msvideo'),
+	(4, 'ftyp', 'video/mp4'),
+]
+
+# Size classes, as (upper limit, class). Larger files are 'large'
+SIZE_CLASSES = [(16 << 10, 'tiny'), (1 << 20, 'small'), (100 << 20, 'medium')]
+
+# EXIF tags holding dates, and the one pointing to the EXIF directory
+EXIF_IFD = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+DATE_TIME = 0x0132
+
+EXIF_DATE = re.compile(r'^(\d{4}):(\d{2}):(\d{2})')
+
+def getType(name, header):
+	"""
+	getType(name, header) -> Get the MIME type of a file, from its contents or else its name
+
+	@param name: Name of the file
+	@type name: str
+
+	@param header: Bytes at the start of the file
+	@type header: str
+
+	@return: MIME type, None if it is not known
+	@rtype: str
+	"""
+
+	for offset, signature, type in SIGNATURES:
+		if header[offset:offset + len(signature)] == signature:
+			return type
+
+	type = mimetypes.guess_type(name)[0]
+	if type is None and len(header) > 0 and '\x00' not in header:
+		type = 'text/plain'
+
+	return type
+
+def getSizeClass(size):
+	"""
+	getSizeClass(size) -> Get the class of a size, one of 'tiny', 'small', 'medium' and 'large'
+
+	@param size: Size in bytes
+	@type size: int
+
+	@rtype: str
+	"""
+
+	for limit, sizeClass in SIZE_CLASSES:
+		if size < limit:
+			return sizeClass
+
+	return 'large'
+
+def getEmbeddedDate(header):
+	"""
+	getEmbeddedDate(header) -> Get the date kept in the EXIF data of a JPEG or TIFF file
+
+	The date the picture was taken is preferred to the date it was last changed.
+
+	@param header: Bytes at the start of the file
+	@type header: str
+
+	@return: Date as YYYY-MM-DD, None if there is none
+	@rtype: str
+	"""
+
+	tiff = None
+	if header.startswith('\xff\xd8'):
+		# JPEG files keep the EXIF data, which is laid out like a TIFF file, in an APP1 segment
+		pos = 2
+		while pos + 4 <= len(header) and header[pos] == '\xff':
+			marker = ord(header[pos + 1])
+			length = struct.unpack('>H', header[pos + 2:pos + 4])[0]
+			if marker == 0xe1 and header[pos + 4:pos + 10] == 'Exif\x00\x00':
+				tiff = header[pos + 10:pos + 2 + length]
+				break
+			elif marker == 0xda:
+				# Start of the image data, there are no segments after it
+				break
+			pos = pos + 2 + length
+	elif header[:4] in ('II*\x00', 'MM\x00*'):
+		tiff = header
+
+	if not tiff:
+		return None
+
+	try:
+		order = { 'II' : '<', 'MM' : '>' }[tiff[:2]]
+		entries = readDirectory(tiff, order, struct.unpack(order + 'I', tiff[4:8])[0])
+		if EXIF_IFD in entries:
+			entries.update(readDirectory(tiff, order, entries[EXIF_IFD]))
+	except (KeyError, struct.error):
+		return None
+
+	for tag in (DATE_TIME_ORIGINAL, DATE_TIME):
+		match = EXIF_DATE.match(str(entries.get(tag, '')))
+		if match and match.group(1) != '0000':
+			return '-'.join(match.groups())
+
+	return None
+
+def readDirectory(tiff, order, offset):
+	"""
+	readDirectory(tiff, order, offset) -> Read the text and number entries of a directory of TIFF data
+
+	@param tiff: TIFF data
+	@type tiff: str
+
+	@param order: Byte order of the data, '<' or '>'
+	@type order: str
+
+	@param offset: Offset of the directory in the data
+	@type offset: int
+
+	@return: Dictionary mapping tags to their values
+	@rtype: C{dict}
+	"""
+
+	entries = {}
+	count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+	for i in range(count):
+		entry = tiff[offset + 2 + i * 12:offset + 14 + i * 12]
+		tag, type, length = struct.unpack(order + 'HHI', entry[:8])
+		if type == 2:
+			# Text, kept in the entry if it fits
+			if length > 4:
+				start = struct.unpack(order + 'I', entry[8:12])[0]
+				entries[tag] = tiff[start:start + length].rstrip('\x00')
+			else:
+				entries[tag] = entry[8:8 + length].rstrip('\x00')
+		elif type == 4 and length == 1:
+			entries[tag] = struct.unpack(order + 'I', entry[8:12])[0]
+
+	return entries
+
+def deriveTags(name, path):
+	"""
+	deriveTags(name, path) -> Get the tags describing a file, derived from its name and contents
+
+	The tags are value tags, see L{Tagging.Tagging} ::
+		ext:jpg		Extension of the name, in lower case
+		type:image	Major part of the MIME type, sniffed from the contents
+		size:small	Class of the size, see L{getSizeClass}
+		date:2003-05-01	Date kept in the EXIF data, see L{getEmbeddedDate}
+
+	@param name: Name of the file
+	@type name: str
+
+	@param path: Path of the file holding the contents
+	@type path: str
+
+	@rtype: List of str
+	"""
+
+	f = open(path, 'rb')
+	try:
+		header = f.read(HEADER_SIZE)
+	finally:
+		f.close()
+
+	tags = ['size:' + getSizeClass(os.path.getsize(path))]
+
+	ext = os.path.splitext(name)[1][1:].lower()
+	if ext:
+		tags.append('ext:' + ext)
+
+	type = getType(name, header)
+	if type:
+		tags.append('type:' + type.split('/')[0])
+
+	date = getEmbeddedDate(header)
+	if date:
+		tags.append('date:' + date)
+
+	return tags
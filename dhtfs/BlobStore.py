@@ -0,0 +1,254 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from dhtfs.GPStor import GPStor
+import os
+
+class BlobStore:
+	"""
+	Class for keeping track of files whose contents are shared
+
+	Files with identical contents can share a single copy of the contents, a blob.
+	The store maps digests of contents to the location of the blob having the
+	contents and counts the references to each blob.
+
+	The class uses persistent store provided by L{GPStor}
+
+	The format of the dictionary is as follows ::
+		dict = {
+			'h2l' : {
+					'digest1': 'location1',
+					'digest2': 'location2',
+				},
+			'l2h' : {
+					'location1': 'digest1',
+					'location2': 'digest2',
+				},
+			'refs' : {
+					'location1': 3,
+				},
+		}
+
+	A location which is not present in 'refs' is referenced once.
+	"""
+
+	DB_FILE = '.blob.db'
+
+	def __init__(self, db_path=os.getcwd(), db_file=DB_FILE):
+		"""
+		BlobStore() -> object of class BlobStore
+
+		@param db_path: Path to database.
+		@type db_path: string
+
+		@param db_file: The name of the file which is used to store the database
+		@type db_file: string
+		"""
+
+		self.db_path = db_path
+		self.db_file = db_file
+		self.blobDB = GPStor(db_path=self.db_path, db_file=self.db_file)
+
+		# Initialize a new database
+		err, blobDict = self.blobDB.getDataRW()
+		if err != 0 or not isinstance(blobDict, dict):
+			blobDict = { 'h2l' : {}, 'l2h' : {}, 'refs' : {} }
+		self.blobDB.writeData(blobDict)
+
+	def __str__(self):
+		return 'Blob store with %s' % str(self.blobDB)
+
+	def lookup(self, digest):
+		"""
+		B.lookup(digest) -> Get the location of the blob with the given digest
+
+		@param digest: Digest of the contents
+		@type digest: str
+
+		@return: Location of the blob, None if there is no blob with the digest
+		@rtype: str
+		"""
+
+		err, blobDict = self.blobDB.getDataRO()
+		if err != 0:
+			return None
+
+		return blobDict['h2l'].get(digest)
+
+	def register(self, location, digest):
+		"""
+		B.register(location, digest) -> Register the file at location as the blob for digest
+
+		@param location: Location of the file
+		@type location: str
+
+		@param digest: Digest of the contents of the file
+		@type digest: str
+		"""
+
+		err, blobDict = self.blobDB.getDataRW()
+		if err != 0:
+			self.blobDB.releaseData()
+			return
+
+		if digest not in blobDict['h2l']:
+			blobDict['h2l'][digest] = location
+		blobDict['l2h'][location] = digest
+
+		self.blobDB.writeData(blobDict)
+
+	def forget(self, location):
+		"""
+		B.forget(location) -> Forget the digest of the blob at location, since its contents are going to change
+
+		The references to the blob are retained
+
+		@param location: Location of the blob
+		@type location: str
+		"""
+
+		err, blobDict = self.blobDB.getDataRO()
+		if err != 0 or location not in blobDict['l2h']:
+			return
+
+		err, blobDict = self.blobDB.getDataRW()
+		if err != 0:
+			self.blobDB.releaseData()
+			return
+
+		self.__forget(blobDict, location)
+
+		self.blobDB.writeData(blobDict)
+
+	def addReference(self, location):
+		"""
+		B.addReference(location) -> Add a reference to the blob at location
+
+		@param location: Location of the blob
+		@type location: str
+		"""
+
+		err, blobDict = self.blobDB.getDataRW()
+		if err != 0:
+			self.blobDB.releaseData()
+			return
+
+		blobDict['refs'][location] = blobDict['refs'].get(location, 1) + 1
+
+		self.blobDB.writeData(blobDict)
+
+	def dropReference(self, location):
+		"""
+		B.dropReference(location) -> Drop a reference to the blob at location
+
+		@param location: Location of the blob
+		@type location: str
+
+		@return: True if the last reference was dropped and the blob can be deleted, False otherwise
+		@rtype: bool
+		"""
+
+		err, blobDict = self.blobDB.getDataRO()
+		if err != 0:
+			return True
+
+		# Avoid a write for files which were never shared
+		if location not in blobDict['refs'] and location not in blobDict['l2h']:
+			return True
+
+		err, blobDict = self.blobDB.getDataRW()
+		if err != 0:
+			self.blobDB.releaseData()
+			return True
+
+		refs = blobDict['refs'].get(location, 1) - 1
+		if refs > 1:
+			blobDict['refs'][location] = refs
+		else:
+			try:
+				del blobDict['refs'][location]
+			except KeyError:
+				pass
+
+		if refs <= 0:
+			self.__forget(blobDict, location)
+
+		self.blobDB.writeData(blobDict)
+		return refs <= 0
+
+	def isShared(self, location):
+		"""
+		B.isShared(location) -> Check whether the blob at location is referenced more than once
+
+		@param location: Location of the blob
+		@type location: str
+
+		@return: True if the blob is shared, False otherwise
+		@rtype: bool
+		"""
+
+		err, blobDict = self.blobDB.getDataRO()
+		if err != 0:
+			return False
+
+		return blobDict['refs'].get(location, 1) > 1
+
+	def relocate(self, locationMap):
+		"""
+		B.relocate(locationMap) -> Change the locations of blobs
+
+		@param locationMap: Dictionary mapping old locations to new locations
+		@type locationMap: C{dict}
+		"""
+
+		if len(locationMap) == 0:
+			return
+
+		err, blobDict = self.blobDB.getDataRW()
+		if err != 0:
+			self.blobDB.releaseData()
+			return
+
+		for oldLocation, newLocation in locationMap.items():
+			if oldLocation in blobDict['refs']:
+				blobDict['refs'][newLocation] = blobDict['refs'].pop(oldLocation)
+			if oldLocation in blobDict['l2h']:
+				digest = blobDict['l2h'].pop(oldLocation)
+				blobDict['l2h'][newLocation] = digest
+				if blobDict['h2l'].get(digest) == oldLocation:
+					blobDict['h2l'][digest] = newLocation
+
+		self.blobDB.writeData(blobDict)
+
+	def __forget(self, blobDict, location):
+		try:
+			digest = blobDict['l2h'].pop(location)
+		except KeyError:
+			return
+
+		if blobDict['h2l'].get(digest) == location:
+			del blobDict['h2l'][digest]
@@ -0,0 +1,253 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import errno
+import socket
+import SocketServer
+import threading
+import cPickle
+
+# Error Codes
+CTL_ERR_SUCCESS =	0x00000000	# Success
+CTL_ERR_UNKNOWN_OP =	0x00000001	# Operation not supported by the server
+CTL_ERR_FAILED =	0x00000002	# Operation raised an exception
+CTL_ERR_PROTOCOL =	0x00000004	# Malformed request or response
+
+class ControlRequestHandler(SocketServer.StreamRequestHandler):
+	"""
+	Handles a single request on a control connection
+
+	A request is a pickled tuple (operation, arguments). The reply is a pickled tuple
+	(errorcode, result), where result is the value returned by the handler of the
+	operation on success and a message describing the error otherwise.
+	"""
+
+	def handle(self):
+		try:
+			op, args = cPickle.load(self.rfile)
+		except EOFError:
+			# Client only checked whether the server is alive
+			return
+		except:
+			self.__reply(CTL_ERR_PROTOCOL, 'Malformed request')
+			return
+
+		handler = self.server.handlers.get(op)
+		if handler is None:
+			self.__reply(CTL_ERR_UNKNOWN_OP, 'Unknown operation %s' % op)
+			return
+
+		try:
+			result = handler(*args)
+		except ValueError, e:
+			# Arguments were refused
+			self.__reply(CTL_ERR_FAILED, 'Operation %s failed: %s' % (op, e))
+			return
+		except:
+			if self.server.logger:
+				self.server.logger.exception("Control operation %s failed" % op)
+			self.__reply(CTL_ERR_FAILED, 'Operation %s failed' % op)
+			return
+
+		self.__reply(CTL_ERR_SUCCESS, result)
+
+	def __reply(self, err, result):
+		cPickle.dump((err, result), self.wfile, cPickle.HIGHEST_PROTOCOL)
+
+class ControlServer(SocketServer.ThreadingUnixStreamServer):
+	"""
+	Serves requests from other processes on a unix socket.
+
+	The socket is only accessible by the owner of the process.
+	Requests are handled in separate threads.
+
+	Typical usage of this class would be as follows:
+
+	Example
+	=======
+	from Control import ControlServer
+
+	server = ControlServer('/tmp/ctl', {'echo' : lambda x: x})
+	server.start()
+	...
+	server.stop()
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, path, handlers, logger=None):
+		"""
+		ControlServer(path, handlers, logger) -> instance of class ControlServer
+
+		@param path: Path of the unix socket
+		@type path: str
+
+		@param handlers: Dictionary mapping names of operations to the functions handling them
+		@type handlers: C{dict}
+
+		@param logger: Logger for errors raised by the handlers
+		@type logger: logging.Logger
+		"""
+
+		self.path = path
+		self.handlers = handlers
+		self.logger = logger
+
+		if os.path.exists(path):
+			if ControlClient(path).isAlive():
+				raise socket.error(errno.EADDRINUSE, 'Control socket %s is in use' % path)
+
+			# Remove a socket left behind by a server which was not stopped
+			os.unlink(path)
+
+		oldUmask = os.umask(0077)
+		try:
+			SocketServer.ThreadingUnixStreamServer.__init__(self, path, ControlRequestHandler)
+		finally:
+			os.umask(oldUmask)
+
+		self.thread = threading.Thread(target=self.serve_forever, name='control')
+		self.thread.setDaemon(True)
+
+	def handle_error(self, request, client_address):
+		if self.logger:
+			self.logger.exception("Error while handling control request")
+
+	def start(self):
+		"""
+		C.start() -> Start serving requests in the background
+		"""
+
+		self.thread.start()
+
+	def stop(self):
+		"""
+		C.stop() -> Stop accepting requests and remove the socket
+		"""
+
+		# The socket is closed only after the serving thread has stopped using it
+		if self.thread.isAlive():
+			self.shutdown()
+		self.server_close()
+		if self.thread.isAlive():
+			self.thread.join()
+
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+
+class ControlClient:
+	"""
+	Sends requests to a L{ControlServer}
+	"""
+
+	def __init__(self, path):
+		"""
+		ControlClient(path) -> instance of class ControlClient
+
+		@param path: Path of the unix socket of the server
+		@type path: str
+		"""
+
+		self.path = path
+
+	def isAlive(self):
+		"""
+		C.isAlive() -> Check whether a server is accepting requests on the socket
+
+		@return: True if a server is running, False otherwise
+		@rtype: bool
+		"""
+
+		try:
+			s = self.__connect()
+		except socket.error:
+			return False
+
+		s.close()
+		return True
+
+	def call(self, op, *args):
+		"""
+		C.call(op, args, ...) -> (errorcode, result)
+
+		Request the server to carry out an operation
+
+		@param op: Name of the operation
+		@type op: str
+
+		@rtype:	C{(int, object)}
+		@return: (errorcode, result)
+			1. errorcode = 	L{CTL_ERR_SUCCESS} on success,
+					L{CTL_ERR_UNKNOWN_OP} if the operation is not supported
+					L{CTL_ERR_FAILED} if the operation failed
+					L{CTL_ERR_PROTOCOL} if the reply could not be understood
+			2. result = Value returned by the operation on success, error message otherwise
+		"""
+
+		s = self.__connect()
+		f = s.makefile('rwb')
+		try:
+			cPickle.dump((op, args), f, cPickle.HIGHEST_PROTOCOL)
+			f.flush()
+			try:
+				err, result = cPickle.load(f)
+			except:
+				err, result = CTL_ERR_PROTOCOL, 'Malformed reply'
+		finally:
+			f.close()
+			s.close()
+
+		return err, result
+
+	def __connect(self):
+		s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			s.connect(self.path)
+		except socket.error:
+			s.close()
+			raise
+		return s
+
+def getClient(path):
+	"""
+	getClient(path) -> Get a client for the server listening at path
+
+	@param path: Path of the unix socket
+	@type path: str
+
+	@return: A L{ControlClient} if a server is running, None otherwise
+	@rtype: L{ControlClient}
+	"""
+
+	client = ControlClient(path)
+	if client.isAlive():
+		return client
+	else:
+		return None
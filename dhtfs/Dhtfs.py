@@ -26,6 +26,11 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os, sys
+import time
+import itertools
+import shutil
+import threading
+import Queue
 from errno import *
 from stat import *
 import fuse
@@ -34,6 +39,12 @@ import TagHelper
 from TagHelper import TagDir, TagFile
 from Tagging import Tagging
 from GPStor import GPStor
+from BlobStore import BlobStore
+from Worker import Worker
+import AutoTag
+from Control import ControlServer
+from Trace import Tracer
+from Profiler import Profiler
 
 fuse.feature_assert('stateful_files')
 
@@ -46,6 +57,26 @@ def flag2mode(flags):
 
 	return m
 
+class DirHandle(object):
+	"""
+	Handle of an open directory, returned by opendir and passed to readdir and releasedir
+
+	The entries of the directory are kept in the handle from the start of a listing,
+	so that each open directory has its own snapshot which goes away with the handle.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.listing = None
+
+	def __getstate__(self):
+		# Only the path is recorded in traces, not the snapshot
+		return {'path' : self.path}
+
+	def __setstate__(self, state):
+		self.path = state['path']
+		self.listing = None
+
 class Dhtfs(Fuse):
 
 	MAX_DIR_ENTRIES = 210
@@ -53,6 +84,41 @@ class Dhtfs(Fuse):
 
 	DB_FILE = '.dhtfs.db'
 	SEQ_FILE = '.dhtfs.seq'
+	CONF_FILE = '.dhtfs.conf'
+	BLOB_FILE = '.dhtfs.blobs'
+	CTL_FILE = '.dhtfs.ctl'
+
+	# Commands written to this file in the root of the mounted file system control the profiler
+	PROFILE_FILE = '.dhtfs.profile'
+
+	# Extended attribute holding the comma seperated tags of a file
+	TAGS_XATTR = 'user.dhtfs.tags'
+
+	# Extended attribute of a directory holding the comma seperated directories it implies
+	IMPLIES_XATTR = 'user.dhtfs.implies'
+
+	# Extended attribute of a directory holding the comma seperated directories with files most
+	# like those of the directories in its path
+	RELATED_XATTR = 'user.dhtfs.related'
+
+	# Statistics of the background workers are extended attributes of the root directory
+	# named with this prefix, like user.dhtfs.stats.autotag.queued
+	STATS_XATTR_PREFIX = 'user.dhtfs.stats.'
+
+	# Number of workers deriving tags of files which have been written
+	AUTOTAG_WORKERS = 2
+
+	# Backing files are spread over directories under FANOUT_DIR when a fan-out layout is used
+	FANOUT_DIR = 'f'
+
+	# Filesystem operations implemented by Dhtfs and by its file class
+	OPERATIONS = ['getattr', 'readdir', 'opendir', 'releasedir', 'rmdir', 'rename', 'link',
+			'getxattr', 'listxattr', 'setxattr', 'removexattr', 'chmod', 'chown', 'truncate',
+			'mkdir', 'utime', 'access', 'statfs', 'unlink']
+	FILE_OPERATIONS = ['read', 'write', 'release', 'fsync', 'flush', 'fgetattr', 'ftruncate']
+
+	# Internal methods which can be profiled, besides the filesystem operations
+	PROFILED_METHODS = ['getActualPath', 'getDirectoryEntries']
 
 	def checkSetup(cls, path):
 		"""
@@ -74,15 +140,19 @@ class Dhtfs(Fuse):
 		
 	checkSetup = classmethod(checkSetup)
 
-	def setup(cls, path, forceInit=False):
+	def setup(cls, path, forceInit=False, fanout=None):
 		"""
-		D.setup(path, forceInitFlag) -> Do the necessary setup to mount the specified path as a dhtfs file system
+		D.setup(path, forceInitFlag, fanout) -> Do the necessary setup to mount the specified path as a dhtfs file system
 
 		@param path: Path for which to setup
 		@type path: str
 
 		@param forceInit: If forceInit is True, do a new setup regardless of whether an older setup is present.
 		@type forceInit: bool
+
+		@param fanout: Layout for new backing files, see L{getBackingLocation}.
+			If None, the layout of an older setup is retained.
+		@type fanout: List of int
 		"""
 
 		# If forceInit flag is true, clean up the directory
@@ -108,26 +178,240 @@ class Dhtfs(Fuse):
 			currentSeqNumber = long(0)
 			seqStore.writeData(currentSeqNumber)
 
+		# Initialize configuration
+		confStore = GPStor(db_path=path, db_file=cls.CONF_FILE)
+
+		ret, conf = confStore.getDataRW()
+
+		if (ret != 0) or (not isinstance(conf, dict)) or forceInit:
+			conf = {'fanout' : []}
+		if fanout is not None:
+			conf['fanout'] = list(fanout)
+
+		confStore.writeData(conf)
+
 	setup = classmethod(setup)
 
+	def getConfig(cls, path):
+		"""
+		D.getConfig(path) -> Get the configuration of the dhtfs file system setup at path
+
+		@param path: Path where dhtfs is setup
+		@type path: str
+
+		@return: Dictionary of configuration values. File systems setup before the
+			configuration was introduced get the default configuration.
+		@rtype: dict
+		"""
+
+		conf = {'fanout' : []}
+
+		if GPStor.checkSetup(db_path=path, db_file=cls.CONF_FILE):
+			ret, data = GPStor(db_path=path, db_file=cls.CONF_FILE).getDataRO()
+			if ret == 0 and isinstance(data, dict):
+				conf.update(data)
+
+		return conf
+
+	getConfig = classmethod(getConfig)
+
+	def getBackingLocation(cls, number, fanout=[]):
+		"""
+		D.getBackingLocation(number, fanout) -> Location of the backing file for the given sequence number
+
+		The name of a backing file is 'f_' followed by the sequence number as 32 hex digits.
+		With an empty fanout all backing files are stored in the root. Otherwise the file is
+		stored in nested directories under L{FANOUT_DIR}, one level for each width in fanout.
+		The directories are named after the trailing digits of the sequence number, so that
+		consecutive files are spread evenly, e.g. with fanout [2, 2] file number 0x1234 is
+		stored as 'f/34/12/f_00000000000000000000000000001234'
+
+		@param number: Sequence number of the file
+		@type number: long
+
+		@param fanout: Width, in hex digits, of the directory names at each level
+		@type fanout: List of int
+
+		@return: Location of the file relative to the root
+		@rtype: str
+		"""
+
+		digits = ('%x' % number).rjust(32, '0')
+		filename = 'f_' + digits
+
+		if len(fanout) == 0:
+			return filename
+
+		components = [cls.FANOUT_DIR]
+		end = len(digits)
+		for width in fanout:
+			components.append(digits[end - width:end])
+			end = end - width
+		components.append(filename)
+
+		return os.path.join(*components)
+
+	getBackingLocation = classmethod(getBackingLocation)
+
+	def migrateLayout(cls, path, fanout, logger=None):
+		"""
+		D.migrateLayout(path, fanout) -> Move the backing files of the file system to a new layout
+
+		The file system must not be mounted while it is migrated. The files are moved first and
+		the locations of all of them are then rewritten in the tag database in a single update.
+		A migration that was interrupted can be completed by running it again.
+
+		@param path: Path where dhtfs is setup
+		@type path: str
+
+		@param fanout: New layout, see L{getBackingLocation}
+		@type fanout: List of int
+
+		@return: Number of files whose location was changed
+		@rtype: int
+		"""
+
+		tagdir = TagDir(db_path=path, db_file=cls.DB_FILE, logger=logger)
+
+		relocated = {}
+		moved = {}
+		for f in tagdir.getAllFiles():
+			filename = os.path.basename(f.location)
+
+			# Only backing files are moved. Skip placeholders of empty directories and
+			# files, like '.mount.info', which are not stored under generated names
+			if not filename.startswith('f_') or os.path.isabs(f.location):
+				continue
+
+			newLocation = cls.getBackingLocation(long(filename[2:], 16), fanout)
+			if newLocation == f.location:
+				continue
+
+			if f.location not in moved:
+				oldPath = os.path.join(path, f.location)
+				newPath = os.path.join(path, newLocation)
+
+				# The file may already have been moved by an interrupted migration
+				if os.path.exists(oldPath):
+					if not os.path.isdir(os.path.dirname(newPath)):
+						os.makedirs(os.path.dirname(newPath))
+					os.rename(oldPath, newPath)
+
+					# Remove the directories of the old layout as they get empty
+					if os.path.dirname(f.location) != '':
+						try:
+							os.removedirs(os.path.dirname(oldPath))
+						except OSError:
+							pass
+
+				moved[f.location] = newLocation
+
+			relocated[f] = TagFile(newLocation, f.name)
+
+		tagdir.replaceElements(relocated)
+		if GPStor.checkSetup(db_path=path, db_file=cls.BLOB_FILE):
+			BlobStore(db_path=path, db_file=cls.BLOB_FILE).relocate(moved)
+		cls.setup(path, fanout=fanout)
+
+		return len(relocated)
+
+	migrateLayout = classmethod(migrateLayout)
+
+	def allocateSeqNumbers(cls, path, count):
+		"""
+		D.allocateSeqNumbers(path, count) -> Reserve a block of sequence numbers for new files
+
+		Used by tools which create many files in a file system. The numbers are reserved in the
+		store shared with a mounted file system, so the numbers are not used by it.
+
+		@param path: Path where dhtfs is setup
+		@type path: str
+
+		@param count: Number of sequence numbers to reserve
+		@type count: int
+
+		@return: The first of the reserved numbers. The numbers are consecutive
+		@rtype: long
+		"""
+
+		seqStore = GPStor(db_path=path, db_file=cls.SEQ_FILE)
+		ret, num = seqStore.getDataRW()
+		seqStore.writeData(num + count)
+
+		return num + 1
+
+	allocateSeqNumbers = classmethod(allocateSeqNumbers)
+
 	def __init__(self, *args, **kw):
 
 		Fuse.__init__(self, *args, **kw)
 		self.fileCache = {}
 
+		# Number of handles open for writing, for each backing file. Changed under dedupLock
+		self.filesOpenForWrite = {}
+		self.dedupWorker = None
+		self.dedupLock = threading.RLock()
+
+		# Attributes of files kept in the database are refreshed by a worker after the
+		# files change. Number of refreshes queued, for each backing file
+		self.attributeWorker = None
+		self.attributesPending = {}
+		self.attributeLock = threading.Lock()
+
+		self.autotagWorkers = []
+		self.controlServer = None
+		self.tracer = None
+		self.profiler = None
+
 	def __initialize(self):
 		try:
 			X = self.getCover
 		except:
 			self.getCover = "Dont Care"
 
+		try:
+			X = self.dedup
+		except:
+			self.dedup = "off"
+
+		try:
+			X = self.autotag
+		except:
+			self.autotag = "off"
+
+		try:
+			X = self.approximate
+		except:
+			self.approximate = "on"
+
+		try:
+			X = self.trace
+		except:
+			self.trace = None
+
+		try:
+			X = self.profileDir
+		except:
+			self.profileDir = '/tmp'
+
 		self.logger = TagHelper.getLogger('DHTFS')
 		self.tagdir = TagDir(db_path=self.root, db_file=self.DB_FILE, logger=self.logger)
+		self.tagdir.approximate = self.approximate != 'off'
 		self.__initSequenceNumberGenerator()
+		self.fanout = self.getConfig(self.root)['fanout']
+
+		# References to shared backing files are honoured even if dedup is off
+		self.blobs = BlobStore(db_path=self.root, db_file=self.BLOB_FILE)
 
 		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
 		self.logger.info("Tagging and TagDir instances created for path %s" % self.root)
 		self.logger.info("self.getCover = %s" % self.getCover)
+		self.logger.info("self.fanout = %s" % self.fanout)
+		self.logger.info("self.dedup = %s" % self.dedup)
+		self.logger.info("self.autotag = %s" % self.autotag)
+		self.logger.info("self.approximate = %s" % self.approximate)
+		self.logger.info("self.trace = %s" % self.trace)
+		self.logger.info("self.profileDir = %s" % self.profileDir)
 
 	def __initSequenceNumberGenerator(self):
 		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
@@ -147,9 +431,563 @@ class Dhtfs(Fuse):
 		self.seqStore.writeData(self.currentSeqNumber)
 		return self.currentSeqNumber
 
+	def fsinit(self):
+		# Threads are started here since the process may have been forked
+		# into the background after it was initialized
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		if self.dedup == 'on':
+			self.dedupWorker = Worker('dedup', self.dedupFile, self.logger)
+			self.dedupWorker.start()
+			self.logger.info("Started dedup worker")
+
+		self.attributeWorker = Worker('attributes', self.updateAttributes, self.logger, batch=True)
+		self.attributeWorker.start()
+		self.logger.info("Started attribute worker")
+
+		if self.autotag == 'on':
+			queue = Queue.Queue()
+			self.autotagWorkers = [Worker('autotag-%d' % i, self.autotagFiles, self.logger, queue, batch=True)
+						for i in range(self.AUTOTAG_WORKERS)]
+			for worker in self.autotagWorkers:
+				worker.start()
+			self.logger.info("Started %s autotag workers" % len(self.autotagWorkers))
+
+		# Commands to the profiler are written to the profile control file
+		try:
+			self.writeProfileStatus()
+		except:
+			self.logger.exception("Could not create profile control file")
+
+		# Serve requests from the command line tools
+		handlers = {
+			'addTags' : self.addTagsToPaths,
+			'delTags' : self.delTagsFromPaths,
+			'getTags' : self.getTagsForPaths,
+			'tagPaths' : self.tagPaths,
+		}
+		try:
+			self.controlServer = ControlServer(os.path.join(self.root, self.CTL_FILE), handlers, self.logger)
+			self.controlServer.start()
+			self.logger.info("Started control server")
+		except:
+			self.logger.exception("Could not start control server")
+
+	def fsdestroy(self):
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		if self.controlServer:
+			self.controlServer.stop()
+
+		if self.dedupWorker:
+			self.dedupWorker.stop()
+			self.dedupWorker.join()
+
+		# Attributes and tags of the files changed last are written before the file system goes away
+		if self.attributeWorker:
+			self.attributeWorker.stop()
+			self.attributeWorker.join()
+
+		for worker in self.autotagWorkers:
+			worker.stop()
+		for worker in self.autotagWorkers:
+			worker.join()
+
+		if self.tracer:
+			self.tracer.close()
+
+		if self.profiler and self.profiler.isRunning():
+			self.profiler.stop()
+
+	def addTagsToPaths(self, paths, tags):
+		"""
+		D.addTagsToPaths(paths, tags) -> Associate tags with the files at the given paths
+
+		@param paths: Paths of the files relative to the mount point
+		@type paths: List of str
+
+		@param tags: Tags to be associated with the files
+		@type tags: List of str
+
+		@return: Paths for which no file was found
+		@rtype: List of str
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		if len(paths) == 0:
+			self.tagdir.createDirs(tags)
+			return []
+
+		return self.tagPaths([(x, tags) for x in paths])
+
+	def delTagsFromPaths(self, paths, tags):
+		"""
+		D.delTagsFromPaths(paths, tags) -> Remove tags from the files at the given paths
+
+		@param paths: Paths of the files relative to the mount point
+		@type paths: List of str
+
+		@param tags: Tags to be removed from the files
+		@type tags: List of str
+
+		@return: Paths for which no file was found
+		@rtype: List of str
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		return self.tagPaths([(x, tags) for x in paths], delete=True)
+
+	def tagPaths(self, records, delete=False):
+		"""
+		D.tagPaths(records, delete) -> Add or remove tags of many files in a single update
+
+		@param records: List of tuples (path, tags). path is the path of a file relative to
+			the mount point and tags is the list of tags to be added to or removed from it
+		@type records: List of (str, List of str)
+
+		@param delete: Remove the tags if True, add them otherwise
+		@type delete: bool
+
+		@return: Paths for which no file was found
+		@rtype: List of str
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		unresolved = self.tagdir.updatePaths(records, delete)
+
+		self.logger.info("CACHE: Clearing cache")
+		self.fileCache.clear()
+
+		return unresolved
+
+	def getTagsForPaths(self, paths):
+		"""
+		D.getTagsForPaths(paths) -> Get the tags of the files at the given paths
+
+		@param paths: Paths of the files relative to the mount point
+		@type paths: List of str
+
+		@return: Dictionary mapping each path to the list of tags of its file, None if no file was found
+		@rtype: C{dict}
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		tags = {}
+		for path in paths:
+			files, unresolved = self.tagdir.getFilesForPaths([path])
+			if len(files) > 0:
+				tags[path] = self.tagdir.getDirsForFiles(files)
+			else:
+				tags[path] = None
+
+		return tags
+
+	def dedupFile(self, fi):
+		"""
+		D.dedupFile(fi) -> Share the backing file of another file with identical contents
+
+		If the contents of the file are not found in any other backing file, the file is
+		registered so that files created later can share its contents.
+		This is called by the dedup worker for files that have been written to.
+
+		@param fi: File to be deduplicated
+		@type fi: L{TagFile}
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		actualPath = os.path.join(self.root, fi.location)
+
+		if self.filesOpenForWrite.get(fi.location, 0) > 0 or not os.path.isfile(actualPath) or \
+				os.path.getsize(actualPath) == 0:
+			self.logger.info("Skipping dedup of %s" % fi)
+			return
+
+		# Compute the digest without holding the lock, it reads the whole file
+		digest = TagHelper.getDigest(actualPath)
+
+		self.dedupLock.acquire()
+		try:
+			# The file may have changed while the digest was being computed
+			if self.filesOpenForWrite.get(fi.location, 0) > 0 or not self.tagdir.elementExists(fi):
+				self.logger.info("File %s changed, skipping dedup" % fi)
+				return
+
+			location = self.blobs.lookup(digest)
+
+			if location is None or location == fi.location or \
+					not os.path.isfile(os.path.join(self.root, location)):
+				self.logger.info("Registering %s with digest %s" % (fi, digest))
+				self.blobs.register(fi.location, digest)
+				return
+
+			# Point the file to the blob with the same contents. If a file with the same
+			# name already uses the blob, the two files are merged and get the tags of both
+			sharedFile = TagFile(location, fi.name)
+			if not self.tagdir.elementExists(sharedFile):
+				self.blobs.addReference(location)
+
+			self.logger.info("Replacing %s by %s" % (fi, sharedFile))
+			self.tagdir.replaceElements({fi : sharedFile})
+			self.refreshAttributes(sharedFile)
+
+			if self.blobs.dropReference(fi.location):
+				self.logger.info("Deleting duplicate file %s" % actualPath)
+				os.unlink(actualPath)
+
+			self.logger.info("CACHE: Clearing cache")
+			self.fileCache.clear()
+		finally:
+			self.dedupLock.release()
+
+	def unshareFile(self, fi):
+		"""
+		D.unshareFile(fi) -> Give a file a backing file of its own, before its contents are changed
+
+		@param fi: File whose backing file is shared
+		@type fi: L{TagFile}
+
+		@return: The file with its new location
+		@rtype: L{TagFile}
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		location = self.generateNewFileName()
+
+		actualDir = os.path.dirname(os.path.join(self.root, location))
+		if not os.path.isdir(actualDir):
+			os.makedirs(actualDir)
+
+		shutil.copy2(os.path.join(self.root, fi.location), os.path.join(self.root, location))
+
+		newFile = TagFile(location, fi.name)
+		self.tagdir.replaceElements({fi : newFile})
+		self.refreshAttributes(newFile)
+		self.blobs.dropReference(fi.location)
+
+		self.logger.info("CACHE: Clearing cache")
+		self.fileCache.clear()
+
+		return newFile
+
+	def prepareForChange(self, fi, forWrite=False):
+		"""
+		D.prepareForChange(fi, forWrite) -> Make sure that changing the backing file of a file changes no other file
+
+		A backing file shared with other files is copied, and the file is moved to the copy.
+		Otherwise the digest of the backing file is forgotten, so that no file is made to
+		share it while it changes.
+
+		@param fi: File which is going to be changed
+		@type fi: L{TagFile}
+
+		@param forWrite: If True a handle open for writing is counted for the backing file,
+			see L{openedForWrite}. It is counted before the file can be deduplicated again
+		@type forWrite: bool
+
+		@return: The file, with its new location if it was moved
+		@rtype: L{TagFile}
+		"""
+
+		self.dedupLock.acquire()
+		try:
+			if self.blobs.isShared(fi.location):
+				self.logger.info("Backing file of %s is shared, copying it" % fi)
+				fi = self.unshareFile(fi)
+			else:
+				# Contents will change, do not let other files share them
+				self.blobs.forget(fi.location)
+
+			if forWrite:
+				self.openedForWrite(fi.location)
+		finally:
+			self.dedupLock.release()
+
+		return fi
+
+	def openedForWrite(self, location):
+		"""
+		D.openedForWrite(location) -> Count a handle open for writing a backing file
+
+		Backing files with handles open for writing are not deduplicated, see L{dedupFile}.
+
+		@param location: Location of the backing file
+		@type location: str
+		"""
+
+		self.dedupLock.acquire()
+		try:
+			self.filesOpenForWrite[location] = self.filesOpenForWrite.get(location, 0) + 1
+		finally:
+			self.dedupLock.release()
+
+	def closedForWrite(self, location):
+		"""
+		D.closedForWrite(location) -> Stop counting a handle open for writing a backing file
+
+		@param location: Location of the backing file
+		@type location: str
+		"""
+
+		self.dedupLock.acquire()
+		try:
+			self.filesOpenForWrite[location] = self.filesOpenForWrite[location] - 1
+			if self.filesOpenForWrite[location] == 0:
+				del self.filesOpenForWrite[location]
+		finally:
+			self.dedupLock.release()
+
+	def getActualPathForChange(self, path):
+		"""
+		D.getActualPathForChange(path) -> Path in the underlying file system to be changed for a path
+
+		@param path: Path in our file system
+		@type path: str
+
+		@return: Path of the backing file, of a copy if the backing file was shared
+		@rtype: str
+		"""
+
+		filename = os.path.basename(path)
+		location = self.tagdir.getActualLocation(self.tagdir.getDirsInPath(os.path.dirname(path)), filename)
+		if not location or location == Dhtfs.MISSING_FILE:
+			return self.getActualPath(path)
+
+		fi = self.prepareForChange(TagFile(location, filename))
+		return os.path.join(self.root, fi.location)
+
+	def refreshAttributes(self, fi):
+		"""
+		D.refreshAttributes(fi) -> Have the attributes of a file refreshed in the background
+
+		The attributes kept in the database are not used till they have been refreshed.
+
+		@param fi: File whose attributes are to be refreshed
+		@type fi: L{TagFile}
+		"""
+
+		if not self.attributeWorker:
+			return
+
+		self.attributeLock.acquire()
+		try:
+			self.attributesPending[fi.location] = self.attributesPending.get(fi.location, 0) + 1
+		finally:
+			self.attributeLock.release()
+
+		self.attributeWorker.put(fi)
+
+	def refreshAttributesOfPath(self, path):
+		"""
+		D.refreshAttributesOfPath(path) -> Have the attributes of the file at a path refreshed
+
+		@param path: Path of the file in the file system
+		@type path: str
+		"""
+
+		actualPath = self.getActualPath(path)
+		if actualPath.startswith(self.root + os.path.sep):
+			self.refreshAttributes(TagFile(actualPath[len(self.root) + 1:], os.path.basename(path)))
+
+	def updateAttributes(self, files):
+		"""
+		D.updateAttributes(files) -> Keep the attributes of files in the database
+
+		This is called by the attribute worker with the files queued for refreshing
+		their attributes. The database is updated once for all of them.
+
+		@param files: Files whose attributes are to be refreshed
+		@type files: C{list} of L{TagFile}
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		attributeMap = {}
+		try:
+			# Attributes of files still being written are not used, the files are
+			# refreshed again when they are closed
+			for fi in files:
+				try:
+					st = os.lstat(os.path.join(self.root, fi.location))
+				except OSError:
+					continue
+
+				attributeMap[fi] = TagHelper.getFileAttributes(fi.name, st)
+
+			self.logger.info("Refreshing attributes of %s files" % len(attributeMap))
+			self.tagdir.setAttributes(attributeMap)
+		finally:
+			self.attributeLock.acquire()
+			try:
+				for fi in files:
+					self.attributesPending[fi.location] = self.attributesPending[fi.location] - 1
+					if self.attributesPending[fi.location] == 0:
+						del self.attributesPending[fi.location]
+			finally:
+				self.attributeLock.release()
+
+	def autotagFiles(self, files):
+		"""
+		D.autotagFiles(files) -> Tag files with the tags derived from their names and contents
+
+		This is called by the autotag workers with the files which have been written.
+		The tags of all the files are added in a single update of the database. Derived
+		tags replace the value tags of the files with the same names, see L{AutoTag.deriveTags}.
+
+		@param files: Files to be tagged
+		@type files: C{list} of L{TagFile}
+		"""
+
+		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
+
+		dirMap = {}
+		for fi in set(files):
+			# Files being written are queued again when they are closed
+			if self.filesOpenForWrite.get(fi.location, 0) > 0:
+				continue
+
+			try:
+				dirs = AutoTag.deriveTags(fi.name, os.path.join(self.root, fi.location))
+				dirMap[fi] = [x for x in dirs if self.tagdir.isValidDirName(x)]
+			except (IOError, OSError):
+				self.logger.info("Could not read %s, not tagging it" % fi)
+
+		if len(dirMap) == 0:
+			return
+
+		self.logger.info("Adding derived tags to %s files" % len(dirMap))
+		self.tagdir.addDirsToExistingFiles(dirMap, replaceValues=True)
+
+		self.logger.info("CACHE: Clearing cache")
+		self.fileCache.clear()
+
+	def getWorkerStatistics(self):
+		"""
+		D.getWorkerStatistics() -> Get the statistics of the background workers
+
+		For each kind of worker, the number of items queued, processed and failed, and
+		the number of items processed per second since the workers were started.
+
+		@return: Dictionary mapping names, like 'autotag.queued', to values
+		@rtype: C{dict}
+		"""
+
+		stats = {}
+		for name, workers in [('dedup', [self.dedupWorker]), ('attributes', [self.attributeWorker]),
+					('autotag', self.autotagWorkers)]:
+			workers = [x for x in workers if x and x.started]
+			if len(workers) == 0:
+				continue
+
+			processed = sum([x.processed for x in workers])
+			elapsed = time.time() - min([x.started for x in workers])
+			stats[name + '.queued'] = workers[0].queue.qsize()
+			stats[name + '.processed'] = processed
+			stats[name + '.failed'] = sum([x.failed for x in workers])
+			stats[name + '.rate'] = '%.2f' % (processed / max(elapsed, 0.001))
+
+		return stats
+
+	def getStoredStat(self, path, actualPath):
+		"""
+		D.getStoredStat(path, actualPath) -> Get the result of stat of a file kept in the database
+
+		@param path: Path of the file in the file system
+		@type path: str
+
+		@param actualPath: Path of the backing file
+		@type actualPath: str
+
+		@return: Result of stat, None if it is not kept or may be out of date
+		@rtype: posix.stat_result
+		"""
+
+		if not actualPath.startswith(self.root + os.path.sep):
+			return None
+
+		location = actualPath[len(self.root) + 1:]
+		if self.filesOpenForWrite.get(location, 0) > 0 or location in self.attributesPending:
+			return None
+
+		return TagHelper.getStat(self.tagdir.getAttributes(TagFile(location, os.path.basename(path))))
+
+	def wrapOperations(self, wrap, wrapFileOp=None, ops=None):
+		"""
+		D.wrapOperations(wrap, wrapFileOp, ops) -> Replace the filesystem operations by wrappers
+
+		To be called after main has set up the file class and before the file system
+		starts serving requests.
+
+		@param wrap: Called as wrap(operation, method) for each operation in OPERATIONS,
+			returns the function to be used instead of the bound method
+		@type wrap: callable
+
+		@param wrapFileOp: Called as wrapFileOp(operation, function) for the constructor of
+			the file class, as operation 'open', and for each operation in FILE_OPERATIONS.
+			The function takes the file object as the first argument. File operations
+			are not wrapped if not specified.
+		@type wrapFileOp: callable
+
+		@param ops: Names of the methods to be wrapped instead of OPERATIONS. May include
+			methods from PROFILED_METHODS
+		@type ops: List of str
+		"""
+
+		if ops is None:
+			ops = self.OPERATIONS
+
+		for op in ops:
+			setattr(self, op, wrap(op, getattr(self, op)))
+
+		if wrapFileOp:
+			fileClass = self.file_class
+			attrs = {'__init__' : wrapFileOp('open', fileClass.__init__.im_func)}
+			for op in self.FILE_OPERATIONS:
+				attrs[op] = wrapFileOp(op, getattr(fileClass, op).im_func)
+
+			self.file_class = type(fileClass.__name__, (fileClass,), attrs)
+
+	def writeProfileStatus(self, status=None):
+		"""
+		D.writeProfileStatus(status) -> Write the state of the profiler to the profile control file
+		"""
+
+		if status is None:
+			status = self.profiler.getStatus()
+
+		f = open(os.path.join(self.root, self.PROFILE_FILE), 'w')
+		f.write('# profiler %s\n' % status)
+		f.close()
+
+	def runProfileCommand(self):
+		"""
+		D.runProfileCommand() -> Run the last command written to the profile control file
+		"""
+
+		f = open(os.path.join(self.root, self.PROFILE_FILE), 'r')
+		commands = [x.strip() for x in f.readlines() if x.strip() != '' and not x.startswith('#')]
+		f.close()
+
+		if commands:
+			status = self.profiler.command(commands[-1])
+		else:
+			status = self.profiler.getStatus()
+
+		self.logger.info("Profile command %s: %s" % (commands[-1:], status))
+		self.writeProfileStatus(status)
+
 	def getActualPath(self, path):
 		self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
 
+		if path == os.path.sep + self.PROFILE_FILE:
+			# Reserved file, not tagged
+			return os.path.join(self.root, self.PROFILE_FILE)
+
 		if path in self.fileCache:
 			self.logger.info("CACHE: Path %s found in cache" % path)
 			self.logger.info("CACHE: ActualPath = %s" % self.fileCache[path])
@@ -159,6 +997,32 @@ class Dhtfs(Fuse):
 			self.logger.info("Path is root directory")
 			actualPath = self.root
 
+		elif self.tagdir.getPageNumber(os.path.basename(path)):
+			fileInstances, dirs = self.getDirectoryEntries(os.path.dirname(path))
+			if os.path.basename(path) in dirs:
+				self.logger.info("Path is page directory")
+				actualPath = self.root
+			else:
+				self.logger.info("Page directory not found here")
+				actualPath = os.path.join(self.root, Dhtfs.MISSING_FILE)
+
+		elif self.tagdir.isQueryParent(os.path.basename(path)):
+			self.logger.info("Path is prefix, search or attribute directory")
+			actualPath = self.root
+
+		elif self.tagdir.isQueryParent(os.path.basename(os.path.dirname(path))):
+			# The last directory in the path is the query given by the name
+			if self.tagdir.isQueryDir(self.tagdir.getDirsInPath(path)[-1]):
+				self.logger.info("Path is prefix, search or attribute query directory")
+				actualPath = self.root
+			else:
+				self.logger.info("No directory or file matching query found")
+				actualPath = os.path.join(self.root, Dhtfs.MISSING_FILE)
+
+		elif self.tagdir.isQueryDir(os.path.basename(path)):
+			self.logger.info("Path is query directory")
+			actualPath = self.root
+
 		elif self.tagdir.isDir(os.path.basename(path)):
 			dirpath = os.path.dirname(path)
 			dirname = os.path.basename(path)
@@ -172,7 +1036,7 @@ class Dhtfs(Fuse):
 				actualPath = os.path.join(self.root, Dhtfs.MISSING_FILE)
 		else:
 			self.logger.info("get actual path from TagHelper")
-			dirs = [x for x in os.path.dirname(path).split(os.path.sep) if x != '']
+			dirs = self.tagdir.getDirsInPath(os.path.dirname(path))
 			filename = os.path.basename(path)
 			actualLocation = self.tagdir.getActualLocation(dirs, filename)
 			if actualLocation:
@@ -192,69 +1056,174 @@ class Dhtfs(Fuse):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
 		self.logger.info("path = %s" % path)
 
-	def releasedir(self, path):
+		return DirHandle(path)
+
+	def releasedir(self, path, dh=None):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
 		self.logger.info("path = %s" % path)
 
+		# Drop the snapshot of a listing which has not been read to the end
+		if dh is not None:
+			dh.listing = None
+
 	def getattr(self, path):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
 		self.logger.info("path = %s" % path)
-		return os.lstat(self.getActualPath(path))
 
-	def readdir(self, path, offset):
+		actualPath = self.getActualPath(path)
+
+		# Files which are not being changed are not looked up in the underlying file system
+		st = self.getStoredStat(path, actualPath)
+		if st is not None:
+			return st
+
+		return os.lstat(actualPath)
+
+	def readdir(self, path, offset, dh=None):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
-		self.logger.info("path = %s" % path)
+		self.logger.info("path = %s, offset = %s" % (path, offset))
+
+		# The entries of a directory are computed once, when the listing is started,
+		# and kept in the handle of the open directory till it is released. This lets
+		# the kernel resume the listing at any offset without the query being run again.
+		if offset == 0 or dh is None or dh.listing is None:
+			fileInstances, dirs = self.getDirectoryEntries(path)
+			if dh is not None:
+				dh.listing = (fileInstances, dirs)
+
+			self.logger.info("CACHE: Clearing cache")
+			self.fileCache.clear()
+		else:
+			self.logger.info("Resuming listing of %s at offset %s" % (path, offset))
+			fileInstances, dirs = dh.listing
 
-		fileInstances, dirs = self.getDirectoryEntries(path)
+		# Pairs of 'location in our file system' -> 'location in the underlying file system'
+		entries = itertools.chain(
+				((f.name, os.path.join(self.root, f.location)) for f in fileInstances),
+				((dir, self.getDirActualPath(os.path.join(path, dir))) for dir in dirs))
+
+		# Offset of an entry is one more than its index in the listing, so that
+		# offset 0 always means the start of the listing
+		for index, (name, actualPath) in enumerate(itertools.islice(entries, offset, None)):
+			# Cache the mapping as the entries are handed out
+			self.fileCache[os.path.join(path, name)] = actualPath
+			yield fuse.Direntry(name, offset=offset + index + 1)
 
-		# Cache the mapping between 'location in our file system' -> 'location in the underlying file system'
-		self.logger.info("CACHE: Clearing cache")
-		self.fileCache.clear()
-		self.fileCache.update([(os.path.join(path, f.name), os.path.join(self.root, f.location)) for f in fileInstances])
-		self.fileCache.update([(os.path.join(path, dir), os.path.join(self.root, 't_' + dir)) for dir in dirs])
 		self.logger.info("CACHE: Added info for dir %s to cache" % path)
 
-		# Get file names from the file object
-		filenames = [f.name for f in fileInstances] 
+	def isWritablePath(self, path):
+		"""
+		D.isWritablePath(path) -> Check whether files and directories can be made at a path
 
-		# Create a generator for the directory entries
-		for e in filenames + dirs:
-			yield fuse.Direntry(e)
+		Paths with queries, like /music/-live, or virtual directories, like /.search/beat,
+		only select files. Their components cannot be made into directories.
+
+		@param path: Path in our file system
+		@type path: str
+
+		@rtype: bool
+		"""
+
+		return len(self.tagdir.getInvalidDirs([x for x in path.split(os.path.sep) if x != ''])) == 0
+
+	def getDirActualPath(self, path):
+		# Page directories and saved queries only exist in listings, they are backed by the root directory
+		dir = os.path.basename(path)
+		if self.tagdir.getPageNumber(dir) or os.path.basename(os.path.dirname(path)) == TagDir.SAVED_DIR:
+			return self.root
+
+		return os.path.join(self.root, 't_' + dir)
 
 	def getDirectoryEntries(self, path):
 		# Get the directories in the specified path
 		# The directories in the path will be treated as tags
-		dirsInPath = [x for x in path.split(os.path.sep) if x != '']
+		dirsInPath = self.tagdir.getDirsInPath(path)
+		page = self.tagdir.getPageNumber(os.path.basename(path))
+
+		# Saved queries are listed in the directory of saved queries
+		if os.path.basename(path) == TagDir.SAVED_DIR:
+			return [], sorted(self.tagdir.getSavedQueries().keys())
+
+		# Prefixes, searches and attribute values are given below the prefix, search and
+		# attribute directories, which have no entries of their own
+		if self.tagdir.isQueryParent(os.path.basename(path)):
+			return [], []
+
+		# Name of the directory holding the listed one, a page is part of the listing above it
+		if page:
+			parent = os.path.basename(os.path.dirname(os.path.dirname(path)))
+		else:
+			parent = os.path.basename(os.path.dirname(path))
+
+		# The files of a saved query are kept up to date, they are listed without
+		# working out any directories
+		if parent == TagDir.SAVED_DIR:
+			dirs, files = [], self.tagdir.getFilesForDirs(dirsInPath)
 
 		# get files and directories associated with the given tags
-		if self.getCover != 'Always':
-			dirs, files = self.tagdir.getDirsAndFilesForDirs(dirsInPath, beRestrictive=True)
-			self.logger.info("After getDirsAndFilesForDirs beRestrictive=True, \
+		elif self.getCover == 'Always':
+			dirs, files = self.tagdir.getDirsAndFilesForDirs(dirsInPath, getCover=True)
+			self.logger.info("After getDirsAndFilesForDirs getCover=True, \
 					dirs = %s, files = %s" %(dirs, files))
 
 		# Too many directory entries cause problems
 		#	It takes too long to display all entries
 		#	Too cumbersome to go through all the entries
 		#
-		# If we get too many directory entries just get tags which cover
-		# all the files + the remaining files
-		if (self.getCover == 'Always') or len(files) < 2 or \
-				(	len(dirs) > 0 and 
-					len(dirs) + len(files) > Dhtfs.MAX_DIR_ENTRIES and
-					self.getCover != 'Never'
-				):
-			dirs, files = self.tagdir.getDirsAndFilesForDirs(dirsInPath, getCover=True)
-			self.logger.info("After getDirsAndFilesForDirs getCover=True, \
+		# So only the directories which best divide the files are listed, and
+		# the files not in any of them are split into pages when they are too many
+		elif self.getCover == 'Never':
+			dirs, files = self.tagdir.getRankedDirsAndFilesForDirs(dirsInPath)
+			self.logger.info("After getRankedDirsAndFilesForDirs, \
 					dirs = %s, files = %s" %(dirs, files))
-				
+
+		# Ranking the directories goes through all the files. The number of files is estimated
+		# first, and when there are very many only the directories restricting a sample of
+		# them are listed. The root and single directories are listed from the views
+		elif self.tagdir.approximate and len(dirsInPath) > 0 and \
+				not (len(dirsInPath) == 1 and self.tagdir.isDir(dirsInPath[0])) and \
+				self.tagdir.estimateFiles(dirsInPath) > self.tagdir.APPROXIMATE_THRESHOLD:
+			dirs, files = self.tagdir.getDirsAndFilesForDirs(dirsInPath, beRestrictive=True)
+			self.logger.info("After getDirsAndFilesForDirs beRestrictive=True, \
+					dirs = %s, files = %s" %(dirs, files))
+
+		else:
+			dirs, files = self.tagdir.getRankedDirsAndFilesForDirs(dirsInPath, Dhtfs.MAX_DIR_ENTRIES / 2)
+			self.logger.info("After getRankedDirsAndFilesForDirs maxDirs=%s, \
+					dirs = %s, files = %s" %(Dhtfs.MAX_DIR_ENTRIES / 2, dirs, files))
+
+		# All the files found by a search or by their attributes are listed, not only
+		# those outside the directories
+		if parent == TagDir.SEARCH_DIR or parent in TagDir.ATTRIBUTE_DIRS:
+			files = self.tagdir.getFilesForDirs(dirsInPath)
+
 		files = [f for f in files if f.location != Dhtfs.MISSING_FILE]
 
+		if self.getCover != 'Never' and len(dirs) + len(files) > Dhtfs.MAX_DIR_ENTRIES:
+			files.sort(key=lambda f: (f.name, f.location))
+			pages = (len(files) + Dhtfs.MAX_DIR_ENTRIES - 1) / Dhtfs.MAX_DIR_ENTRIES
+
+			if page:
+				dirs = []
+				files = files[(page - 1) * Dhtfs.MAX_DIR_ENTRIES : page * Dhtfs.MAX_DIR_ENTRIES]
+			else:
+				dirs = dirs + [TagDir.PAGE_DIR_PREFIX + str(x) for x in range(1, pages + 1)]
+				files = []
+
+		elif page:
+			dirs, files = [], []
+
 		self.logger.info("Returning Dir entries = %s, %s" % (files, dirs))
 		return files, dirs
 
 	def rmdir(self, path):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
-		self.tagdir.delDirs([os.path.basename(path)])
+
+		if os.path.basename(os.path.dirname(path)) == TagDir.SAVED_DIR:
+			self.logger.info("Deleting saved query %s" % os.path.basename(path))
+			self.tagdir.deleteQuery(os.path.basename(path))
+		else:
+			self.tagdir.delDirs([os.path.basename(path)])
 
 		# Clear cache
 		self.logger.info("CACHE: Clearing cache")
@@ -265,19 +1234,25 @@ class Dhtfs(Fuse):
 
 		self.logger.info("rename %s to %s" %(path, path1))
 		if self.tagdir.isDir(os.path.basename(path)): # Path is a directory
+			if not self.isWritablePath(path1):
+				return -EINVAL
+
 			self.logger.info("Renaming dir %s to %s" % (path, path1))
-			dirs = [x for x in path.split(os.path.sep) if x != '']
-			dirs1 = [x for x in path1.split(os.path.sep) if x != '']
+			dirs = self.tagdir.getDirsInPath(path)
+			dirs1 = self.tagdir.getDirsInPath(path1)
 			self.logger.info("Renaming dir %s to %s" % (dirs, dirs1))
 			self.tagdir.renameDir(dirs, dirs1)
 
 		else: # Path is a file
-			dirs = [x for x in os.path.dirname(path).split(os.path.sep) if x != '']
+			dirs = self.tagdir.getDirsInPath(os.path.dirname(path))
 
 			# create an instance of class TagFile
 			filename = os.path.basename(path)
 			location = self.tagdir.getActualLocation(dirs, filename)
 
+			if not self.isWritablePath(os.path.dirname(path1)):
+				return -EINVAL
+
 			fi = TagFile(location, filename)
 
 			# Remove the directories asociated with the file
@@ -289,31 +1264,216 @@ class Dhtfs(Fuse):
 			fi = TagFile(location, newfilename)
 
 			# Associate directories to the file
-			dirs = [x for x in os.path.dirname(path1).split(os.path.sep) if x != '']
+			dirs = self.tagdir.getDirsInPath(os.path.dirname(path1))
 			self.tagdir.addDirsToFiles([fi], dirs)
+			self.refreshAttributes(fi)
+
+		# Clear cache
+		self.logger.info("CACHE: Clearing cache")
+		self.fileCache.clear()
+
+	def link(self, path, path1):
+		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
+		self.logger.info("link %s to %s" %(path1, path))
+
+		# Links only change tags, the contents of the file are never copied
+		dirs = self.tagdir.getDirsInPath(os.path.dirname(path))
+		filename = os.path.basename(path)
+		location = self.tagdir.getActualLocation(dirs, filename)
+
+		if not location or self.tagdir.isDir(filename):
+			return -ENOENT
+
+		dirs1 = self.tagdir.getDirsInPath(os.path.dirname(path1))
+		newfilename = os.path.basename(path1)
+
+		if self.tagdir.getActualLocation(dirs1, newfilename):
+			return -EEXIST
+
+		if not self.isWritablePath(os.path.dirname(path1)):
+			return -EINVAL
+
+		self.dedupLock.acquire()
+		try:
+			if newfilename == filename:
+				# Same file, associate the directories of the link with it
+				self.logger.info("Adding dirs %s to %s" % (dirs1, path))
+				self.tagdir.addDirsToFiles([TagFile(location, filename)], dirs1)
+			else:
+				# The name is part of a file, so the link is a new file sharing the
+				# backing file of the original one
+				self.logger.info("Sharing backing file of %s with %s" % (path, path1))
+				self.blobs.addReference(location)
+				self.tagdir.addDirsToFiles([TagFile(location, newfilename)], dirs1)
+				self.refreshAttributes(TagFile(location, newfilename))
+		finally:
+			self.dedupLock.release()
+
+		# Clear cache
+		self.logger.info("CACHE: Clearing cache")
+		self.fileCache.clear()
+
+	def getxattr(self, path, name, size):
+		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
+		self.logger.info("path = %s, name = %s" % (path, name))
+
+		if path == '/' and name.startswith(Dhtfs.STATS_XATTR_PREFIX):
+			value = self.getWorkerStatistics().get(name[len(Dhtfs.STATS_XATTR_PREFIX):])
+			if value is None:
+				return -ENODATA
+			value = str(value)
+
+		elif self.tagdir.isDir(os.path.basename(path)):
+			if name == Dhtfs.IMPLIES_XATTR:
+				dirs = self.tagdir.getImpliedDirs(os.path.basename(path))
+			elif name == Dhtfs.RELATED_XATTR:
+				dirs = self.tagdir.getRelatedDirs(self.tagdir.getDirsInPath(path))
+			else:
+				dirs = []
+
+			if len(dirs) == 0:
+				return -ENODATA
+
+			value = ','.join(dirs)
+
+		elif name != Dhtfs.TAGS_XATTR or path == '/':
+			return -ENODATA
+
+		else:
+			tags = self.getTagsForPaths([path])[path]
+			if tags is None:
+				# Only files have tags, other directories have no value for the attribute
+				if os.path.isdir(self.getActualPath(path)):
+					return -ENODATA
+				return -ENOENT
+
+			tags.sort()
+			value = ','.join(tags)
+
+		# Size of the value is requested when size is 0
+		if size == 0:
+			return len(value)
+
+		return value
+
+	def listxattr(self, path, size):
+		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
+		self.logger.info("path = %s" % path)
+
+		if path == '/':
+			names = [Dhtfs.STATS_XATTR_PREFIX + x for x in sorted(self.getWorkerStatistics().keys())]
+		elif self.tagdir.isDir(os.path.basename(path)):
+			names = []
+			if len(self.tagdir.getImpliedDirs(os.path.basename(path))) > 0:
+				names.append(Dhtfs.IMPLIES_XATTR)
+			if len(self.tagdir.getRelatedDirs(self.tagdir.getDirsInPath(path))) > 0:
+				names.append(Dhtfs.RELATED_XATTR)
+		else:
+			names = [Dhtfs.TAGS_XATTR]
+
+		# Size of the list of null terminated names is requested when size is 0
+		if size == 0:
+			return sum([len(x) + 1 for x in names])
+
+		return names
+
+	def setxattr(self, path, name, val, flags):
+		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
+		self.logger.info("path = %s, name = %s, val = %s" % (path, name, val))
+
+		if self.tagdir.isDir(os.path.basename(path)):
+			if name != Dhtfs.IMPLIES_XATTR:
+				return -EOPNOTSUPP
+
+			# Replace the directories implied by the directory. Implications making a
+			# directory imply itself are refused
+			impliedDirs = [x.strip() for x in val.split(',')]
+			impliedDirs = [x for x in impliedDirs if x != '']
+			if len(self.tagdir.getInvalidDirs(impliedDirs)) > 0:
+				return -EINVAL
+			if not self.tagdir.setImpliedDirs(os.path.basename(path), impliedDirs):
+				return -ELOOP
+
+			self.logger.info("CACHE: Clearing cache")
+			self.fileCache.clear()
+			return
+
+		if name != Dhtfs.TAGS_XATTR:
+			return -EOPNOTSUPP
+
+		files, unresolved = self.tagdir.getFilesForPaths([path])
+		if len(files) == 0:
+			return -ENOENT
+
+		# Replace the tags of the file by the given ones
+		tags = set([x.strip() for x in val.split(',')])
+		tags.discard('')
+		oldTags = set(self.tagdir.getDirsForFiles(files))
+
+		newDirs = list(tags - oldTags)
+		if len(self.tagdir.getInvalidDirs(newDirs)) > 0:
+			return -EINVAL
+		if len(newDirs) > 0:
+			self.tagdir.addDirsToFiles(files, newDirs)
+
+		oldDirs = list(oldTags - tags)
+		if len(oldDirs) > 0:
+			self.tagdir.delFilesFromDirs(files, oldDirs)
 
 		# Clear cache
 		self.logger.info("CACHE: Clearing cache")
 		self.fileCache.clear()
 
+	def removexattr(self, path, name):
+		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
+		self.logger.info("path = %s, name = %s" % (path, name))
+
+		if self.tagdir.isDir(os.path.basename(path)):
+			if name != Dhtfs.IMPLIES_XATTR:
+				return -ENODATA
+		elif name != Dhtfs.TAGS_XATTR:
+			return -ENODATA
+
+		# Removing the attribute removes all the tags of the file, or the implications of the directory
+		return self.setxattr(path, name, '', 0)
+
 	def chmod(self, path, mode):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
-		os.chmod(self.getActualPath(path), mode)
+		os.chmod(self.getActualPathForChange(path), mode)
+		self.refreshAttributesOfPath(path)
 
 	def chown(self, path, user, group):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
-		os.chown(self.getActualPath(path), user, group)
+		os.chown(self.getActualPathForChange(path), user, group)
+		self.refreshAttributesOfPath(path)
 
 	def truncate(self, path, len):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
-		f = open(self.getActualPath(path), "a")
+		f = open(self.getActualPathForChange(path), "a")
 		f.truncate(len)
 		f.close()
+		self.refreshAttributesOfPath(path)
 
 	def mkdir(self, path, mode):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
-		dirs = [x for x in path.split(os.path.sep) if x != '']
-		nf = TagFile(Dhtfs.MISSING_FILE, self.generateNewFileName())
+
+		# A directory made below the directory of saved queries saves the query of the
+		# path above it, e.g. /music/-live/.saved/studio
+		if os.path.basename(os.path.dirname(path)) == TagDir.SAVED_DIR:
+			dirs = self.tagdir.getDirsInPath(os.path.dirname(os.path.dirname(path)))
+			self.logger.info("Saving query %s as %s" % (dirs, os.path.basename(path)))
+			if not self.tagdir.saveQuery(os.path.basename(path), dirs):
+				return -EINVAL
+
+			self.logger.info("CACHE: Clearing cache")
+			self.fileCache.clear()
+			return
+
+		if not self.isWritablePath(path):
+			return -EINVAL
+
+		dirs = self.tagdir.getDirsInPath(path)
+		nf = TagFile(Dhtfs.MISSING_FILE, os.path.basename(self.generateNewFileName()))
 		self.tagdir.addDirsToFiles([nf], dirs, mode)
 
 		if path in self.fileCache:
@@ -322,7 +1482,8 @@ class Dhtfs(Fuse):
 
 	def utime(self, path, times):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
-		os.utime(self.getActualPath(path), times)
+		os.utime(self.getActualPathForChange(path), times)
+		self.refreshAttributesOfPath(path)
 
 	def access(self, path, mode):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
@@ -355,7 +1516,7 @@ class Dhtfs(Fuse):
 		self.logger.info("###### In function : %s" % sys._getframe().f_code.co_name)
 
 		# Get dirs in path
-		dirs = [x for x in os.path.dirname(path).split(os.path.sep) if x != '']
+		dirs = self.tagdir.getDirsInPath(os.path.dirname(path))
 
 		# create an instance of class TagFile
 		filename = os.path.basename(path)
@@ -369,12 +1530,22 @@ class Dhtfs(Fuse):
 
 		# If all directories asociated with the file are removed remove the file
 		if len( self.tagdir.getDirsForFiles([fi]) ) == 0:
-			actualPath = self.getActualPath(path)
+			actualPath = os.path.join(self.root, fi.location)
 			self.logger.info("Deleting actual file since last reference is being deleted")	
 			self.logger.info("Calling delFiles with fileList = %s" % [fi])
-			self.tagdir.delFiles([fi])
-			self.logger.info("Deleting actual file %s" % actualPath)
-			os.unlink(actualPath)
+
+			self.dedupLock.acquire()
+			try:
+				self.tagdir.delFiles([fi])
+
+				# Other files may share the backing file
+				if self.blobs.dropReference(fi.location):
+					self.logger.info("Deleting actual file %s" % actualPath)
+					os.unlink(actualPath)
+				else:
+					self.logger.info("Actual file %s is still referenced" % actualPath)
+			finally:
+				self.dedupLock.release()
 
 		# Clear cache
 		self.logger.info("CACHE: Clearing cache")
@@ -382,7 +1553,7 @@ class Dhtfs(Fuse):
 
 	def generateNewFileName(self):
 		number = self.__getNextSeqNumber()
-		newfilename = 'f_' + ('%x' % number).rjust(32, '0')
+		newfilename = self.getBackingLocation(number, self.fanout)
 		self.logger.info("newfilename = %s" % newfilename)
 		actualPath = newfilename
 
@@ -406,32 +1577,77 @@ class Dhtfs(Fuse):
 				self.logger.info("###### Initiating file object In function : %s" % sys._getframe().f_code.co_name)
 
 				# set the dirs which are associated with this file
-				self.dirs = [x for x in os.path.dirname(path).split(os.path.sep) if x != '']
+				self.dirs = server.tagdir.getDirsInPath(os.path.dirname(path))
+
+				# Writes to the profile control file are commands to the profiler
+				self.control = (path == os.path.sep + Dhtfs.PROFILE_FILE)
 
 				# Get actual path for the specified path
 				actualPath = server.getActualPath(path)
 
 				newCreated = False
 				if os.path.basename(actualPath) == Dhtfs.MISSING_FILE:
+					# Files are only made in directories, not in queries
+					if not server.isWritablePath(os.path.dirname(path)):
+						raise OSError(EINVAL, "Files can not be made in %s" % os.path.dirname(path))
+
 					# File is not yet created. Create file
 					self.logger.info("Actual path missing")
 					actualPath = server.generateNewFileName()
 					newCreated = True
+
+					# Create the fan-out directories for the file if required
+					actualDir = os.path.dirname(os.path.join(server.root, actualPath))
+					if not os.path.isdir(actualDir):
+						os.makedirs(actualDir)
 					if path in server.fileCache:
 						self.logger.info("CACHE: Remove entry for path %s" % path)
 						del server.fileCache[path]
 
-				self.file = os.fdopen(os.open(os.path.join(server.root, actualPath), flags, *mode),
-										flag2mode(flags))
-				self.fd = self.file.fileno()
-
 				filename = os.path.basename(path)
-				self.fi = TagFile(actualPath, filename)
 
-				if newCreated:
-					self.logger.info("Adding tags %s, to file %s" %(self.dirs, self.fi))
-					# Add tag information for the newly created file
-					server.tagdir.addDirsToFiles([self.fi], self.dirs)
+				# Keep track of changes to existing files, their backing files may be shared
+				self.writable = (flags & (os.O_WRONLY | os.O_RDWR)) != 0
+
+				# Truncating an existing file changes it even if nothing is written to it
+				self.written = newCreated or ((flags & os.O_TRUNC) != 0 and not self.control)
+				location = None
+				if self.writable and not newCreated:
+					location = server.tagdir.getActualLocation(self.dirs, filename)
+
+				if location:
+					# The handle is counted as open for writing along with the preparation
+					self.fi = TagFile(location, filename)
+					actualPath = self.__prepareForWrite()
+				else:
+					self.fi = TagFile(actualPath, filename)
+					if self.writable:
+						server.openedForWrite(self.fi.location)
+
+				try:
+					self.file = os.fdopen(os.open(os.path.join(server.root, actualPath), flags, *mode),
+											flag2mode(flags))
+					self.fd = self.file.fileno()
+
+					if newCreated:
+						self.logger.info("Adding tags %s, to file %s" %(self.dirs, self.fi))
+						# Add tag information for the newly created file
+						server.tagdir.addDirsToFiles([self.fi], self.dirs)
+				except:
+					# Leave no backing file which is not in the database, nor a count of a handle
+					# which was never opened
+					self.logger.exception("Could not open %s" % path)
+					if hasattr(self, 'file'):
+						self.file.close()
+					if newCreated and os.path.isfile(os.path.join(server.root, actualPath)):
+						os.unlink(os.path.join(server.root, actualPath))
+					if self.writable:
+						server.closedForWrite(self.fi.location)
+					raise
+
+			def __prepareForWrite(self):
+				self.fi = server.prepareForChange(self.fi, forWrite=True)
+				return self.fi.location
 
 			def read(self, length, offset):
 				self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
@@ -442,12 +1658,34 @@ class Dhtfs(Fuse):
 				self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
 				self.file.seek(offset)
 				self.file.write(buf)
+				self.written = True
 				return len(buf)
 
 			def release(self, flags):
 				self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
 				self.file.close()
 
+				# Queued before the file is no longer counted as open, so that attributes
+				# which are out of date are never used
+				if self.written and not self.control:
+					server.refreshAttributes(self.fi)
+
+				if self.writable:
+					server.closedForWrite(self.fi.location)
+
+				if self.control:
+					if self.written:
+						server.runProfileCommand()
+					return
+
+				# Look for files with the same contents in the background
+				if self.written and server.dedupWorker:
+					server.dedupWorker.put(self.fi)
+
+				# Tags are derived in the background too, closing the file never waits for them
+				if self.written and server.autotagWorkers:
+					server.autotagWorkers[0].put(self.fi)
+
 			def fsync(self, isfsyncfile):
 				self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
 				if isfsyncfile and hasattr(os, 'fdatasync'):
@@ -469,9 +1707,21 @@ class Dhtfs(Fuse):
 			def ftruncate(self, len):
 				self.logger.info("In function : %s" % sys._getframe().f_code.co_name)
 				self.file.truncate(len)
+				self.written = True
 
 		self.file_class = DhtfsFile
 
+		if server.fuse_args.mount_expected():
+			# Operations can be profiled at any time, through the profile control file
+			self.profiler = Profiler(self.profileDir, self.logger)
+			self.wrapOperations(self.profiler.wrap, self.profiler.wrapFileOp,
+						self.OPERATIONS + self.PROFILED_METHODS)
+
+		if server.fuse_args.mount_expected() and self.trace:
+			self.tracer = Tracer(self.trace, self.logger)
+			self.wrapOperations(self.tracer.wrap, self.tracer.wrapFileOp)
+			self.logger.info("Recording operations to %s" % self.trace)
+
 		return Fuse.main(self, *a, **kw)
 
 
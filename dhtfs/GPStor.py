@@ -28,6 +28,7 @@
 import fcntl
 import os
 import cPickle
+import threading
 
 class GPStor:
 	"""
@@ -73,6 +74,11 @@ class GPStor:
 	# default file for the persistent store
 	STORE = '.GPStor_file'
 
+	# The file locks only keep other processes out. Threads of a process
+	# accessing the same store are serialized by these locks
+	__threadLocks = {}
+	__threadLocksGuard = threading.Lock()
+
 	def checkSetup(cls, db_path=None, db_file=None):
 		"""
 		GPStor.checkSetup(db_path, db_file) -> True if GPStor files present, otherwise false
@@ -150,6 +156,14 @@ class GPStor:
 		self.__lastupdate = 0
 		self.__caching = caching
 
+		GPStor.__threadLocksGuard.acquire()
+		try:
+			if self.__storeFile not in GPStor.__threadLocks:
+				GPStor.__threadLocks[self.__storeFile] = threading.RLock()
+			self.__threadLock = GPStor.__threadLocks[self.__storeFile]
+		finally:
+			GPStor.__threadLocksGuard.release()
+
 	######## Public functions
 
 	def getDataRO(self):
@@ -168,13 +182,21 @@ class GPStor:
 			2. object = object stored in the database
 		"""
 
-		ret = self.__lockSH() # Acquire a shared lock
-		if ret != GPStor.GPS_ERR_SUCCESS:
-			return ret, {}
+		self.__threadLock.acquire()
+		try:
+			# This thread has already got the database for writing
+			if self.__lockAcquired:
+				return self.__getData()
 
-		ret, data = self.__getData()
+			ret = self.__lockSH() # Acquire a shared lock
+			if ret != GPStor.GPS_ERR_SUCCESS:
+				return ret, {}
+
+			ret, data = self.__getData()
 
-		self.__unlock() # release the lock
+			self.__unlock() # release the lock
+		finally:
+			self.__threadLock.release()
 
 		return (ret, data)
 
@@ -186,6 +208,9 @@ class GPStor:
 		The information got via this function can be changed. This function will wait if some other process
 		has obtained the database for reading or writing.
 
+		The database stays locked even if an error is returned, so that it can be initialized.
+		It is unlocked by L{writeData}, or by L{releaseData} if nothing is to be written.
+
 		@rtype:	C{(int, object)}
 		@return: (errorcode, object)
 			1. errorcode = 	L{GPS_ERR_SUCCESS} on success,
@@ -194,8 +219,12 @@ class GPStor:
 			2. object = object stored in the database
 		"""
 
+		# The lock for threads is held till the data is written
+		self.__threadLock.acquire()
+
 		ret = self.__lockEX() # Acquire an exclusive lock
 		if ret != GPStor.GPS_ERR_SUCCESS:
+			self.__threadLock.release()
 			return ret, {}
 
 		self.__lockAcquired = True
@@ -224,14 +253,32 @@ class GPStor:
 		if not self.__lockAcquired:
 			return GPStor.GPS_ERR_NO_LOCK
 			
-		ret = self.__writeDataToStore(data)
-		self.__updateCache(data)
+		# The locks are given up even if the data could not be written
+		try:
+			ret = self.__writeDataToStore(data)
+			self.__updateCache(data)
+		finally:
+			self.__unlock()
+			self.__lockAcquired = False
+			self.__threadLock.release()
+		return self.GPS_ERR_SUCCESS
+
+	def releaseData(self):
+		"""
+		T.releaseData() -> Unlock the database got for writing, without writing to it
+
+		@return: 
+			1. L{GPS_ERR_SUCCESS} on success.
+			2. L{GPS_ERR_NO_LOCK} if function was called without acquiring the necesary lock
+		"""
+		if not self.__lockAcquired:
+			return GPStor.GPS_ERR_NO_LOCK
 
 		self.__unlock()
 		self.__lockAcquired = False
+		self.__threadLock.release()
 		return self.GPS_ERR_SUCCESS
 
-
 	################################### Helper functions
 
 	def __storeExists(self):
@@ -0,0 +1,300 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import threading
+import Queue
+from dhtfs.Dhtfs import Dhtfs
+from dhtfs import TagHelper
+from dhtfs import Control
+from dhtfs.TagHelper import TagDir, TagFile
+from dhtfs.Worker import Worker
+
+class Importer:
+	"""
+	Imports a directory tree into an unmounted dhtfs file system
+
+	Files are copied into the backing layout of the file system by a pool of workers.
+	The directories containing a file become its tags, as selected by the rules of the importer.
+	Directories whose names cannot be tags, like '-live' or '.search', are left out, see
+	L{TagDir.isValidDirName}. Files with the same name and the same tags are renamed, e.g. to
+	'x (2).mp3'. The tag database is written once, after all the files have been copied.
+
+	Typical usage of this class would be as follows:
+
+	Example
+	=======
+	from dhtfs.Importer import Importer
+
+	importer = Importer('/home/user/newfs', workers=8, skip=1, lower=True)
+	imported, failed = importer.importTree('/home/user/archive')
+	"""
+
+	# Ways of getting the contents of a file into the file system
+	METHODS = ('copy', 'reflink', 'link')
+
+	def __init__(self, db_path, workers=4, method='copy', skip=0, ignore=[], lower=False,
+			extraTags=[], blockSize=1024, logger=None):
+		"""
+		Importer(db_path, ...) -> instance of class Importer
+
+		@param db_path: Path where dhtfs is setup
+		@type db_path: str
+
+		@param workers: Number of files copied in parallel
+		@type workers: int
+
+		@param method: 'copy' to copy files, 'reflink' to make copy on write clones of files
+			where the file system supports it, 'link' to make hard links to files
+		@type method: str
+
+		@param skip: Number of leading directories in the path of a file which are not used as tags
+		@type skip: int
+
+		@param ignore: Directory names which are not used as tags
+		@type ignore: List of str
+
+		@param lower: Convert tags to lower case
+		@type lower: bool
+
+		@param extraTags: Tags associated with all imported files
+		@type extraTags: List of str
+
+		@param blockSize: Number of sequence numbers reserved at a time
+		@type blockSize: int
+
+		@param logger: Logger to log errors
+		@type logger: logging.Logger
+
+		@raise ValueError: The method is not known, some of extraTags cannot be tags, or the
+			file system is mounted
+		"""
+
+		if method not in Importer.METHODS:
+			raise ValueError("Unknown import method %s" % method)
+
+		self.db_path = db_path
+		self.__checkUnmounted()
+
+		self.tagdir = TagDir(db_path=db_path, db_file=Dhtfs.DB_FILE, logger=logger)
+
+		invalid = self.tagdir.getInvalidDirs(extraTags)
+		if len(invalid) > 0:
+			raise ValueError("Not valid names of tags: %s" % ', '.join(invalid))
+
+		self.workers = workers
+		self.method = method
+		self.skip = skip
+		self.ignore = set(ignore)
+		self.lower = lower
+		self.extraTags = extraTags
+		self.blockSize = blockSize
+		self.logger = logger
+
+		self.fanout = Dhtfs.getConfig(db_path)['fanout']
+
+		self.__nextSeqNumber = 0
+		self.__lastSeqNumber = -1
+
+		self.__imported = []
+		self.__failed = []
+		self.__rejected = set()
+		self.__renamed = []
+		self.__dirsLock = threading.Lock()
+
+	def deriveTags(self, dirs):
+		"""
+		I.deriveTags(dirs) -> Get the tags for a file from the directories containing it
+
+		Directories whose names cannot be tags are left out, see L{getRejectedTags}.
+
+		@param dirs: Directories in the path of the file, relative to the imported tree
+		@type dirs: List of str
+
+		@return: List of tags
+		@rtype: List of str
+		"""
+
+		tags = []
+		for dir in dirs[self.skip:]:
+			if dir in self.ignore:
+				continue
+			if self.lower:
+				dir = dir.lower()
+			if dir in tags or dir in self.__rejected:
+				continue
+			if self.tagdir.isValidDirName(dir):
+				tags.append(dir)
+			else:
+				if self.logger:
+					self.logger.warning("%s can not be a tag, not using it" % dir)
+				self.__rejected.add(dir)
+
+		for tag in self.extraTags:
+			if tag not in tags:
+				tags.append(tag)
+
+		return tags
+
+	def importTree(self, source):
+		"""
+		I.importTree(source) -> Import all the files in a directory tree
+
+		@param source: Root of the directory tree
+		@type source: str
+
+		@return: A tuple of number of files imported and list of paths of files which could not be imported
+		@rtype: (int, List of str)
+
+		@raise ValueError: The file system is mounted
+		"""
+
+		self.__checkUnmounted()
+
+		queue = Queue.Queue(self.workers * 64)
+		pool = [Worker('import-%d' % i, self.__importFile, self.logger, queue) for i in range(self.workers)]
+		for worker in pool:
+			worker.start()
+
+		# Names of the files with each set of tags, the imported ones and those already there
+		names = {}
+
+		source = os.path.abspath(source)
+		for root, dirs, files in os.walk(source):
+			relativeRoot = root[len(source):]
+			tags = self.deriveTags([x for x in relativeRoot.split(os.path.sep) if x != ''])
+
+			key = frozenset(tags)
+			if key not in names:
+				names[key] = set()
+				if len(tags) > 0:
+					names[key].update([x.name for x in self.tagdir.getElements(tags)])
+
+			for name in files:
+				newName = self.__getFreeName(name, names[key])
+				if newName != name:
+					if self.logger:
+						self.logger.info("Importing %s as %s" % (os.path.join(root, name), newName))
+					self.__renamed.append((os.path.join(root, name), newName))
+				names[key].add(newName)
+
+				queue.put((os.path.join(root, name), self.__getNextLocation(), newName, tags))
+
+		for worker in pool:
+			worker.stop()
+		for worker in pool:
+			worker.join()
+
+		# Add all the files to the tag database in one go, grouped by their tags
+		groups = {}
+		attributeMap = {}
+		for f, tags, attributes in self.__imported:
+			attributeMap[f] = attributes
+			try:
+				groups[tuple(tags)].append(f)
+			except KeyError:
+				groups[tuple(tags)] = [f]
+
+		self.tagdir.bulkUpdate(addList=[(files, list(tags)) for tags, files in groups.items()],
+				attributeMap=attributeMap)
+
+		return len(self.__imported), self.__failed
+
+	def getRejectedTags(self):
+		"""
+		I.getRejectedTags() -> Get the names of directories which were not used as tags as they cannot be tags
+
+		@rtype: List of str
+		"""
+
+		return sorted(self.__rejected)
+
+	def getRenamedFiles(self):
+		"""
+		I.getRenamedFiles() -> Get the files which were imported under another name, as another file had their name and tags
+
+		@return: List of tuples (path of the file, name it was imported as)
+		@rtype: List of (str, str)
+		"""
+
+		return list(self.__renamed)
+
+	def __checkUnmounted(self):
+		# A mounted file system answers on its control socket. Its caches and sequence
+		# numbers would not know of the imported files
+		if Control.getClient(os.path.join(self.db_path, Dhtfs.CTL_FILE)):
+			raise ValueError("The file system at %s is mounted, unmount it before importing" % self.db_path)
+
+	def __getFreeName(self, name, names):
+		base, ext = os.path.splitext(name)
+		number = 1
+		while name in names:
+			number = number + 1
+			name = '%s (%d)%s' % (base, number, ext)
+
+		return name
+
+	def __getNextLocation(self):
+		if self.__nextSeqNumber > self.__lastSeqNumber:
+			self.__nextSeqNumber = Dhtfs.allocateSeqNumbers(self.db_path, self.blockSize)
+			self.__lastSeqNumber = self.__nextSeqNumber + self.blockSize - 1
+
+		location = Dhtfs.getBackingLocation(self.__nextSeqNumber, self.fanout)
+		self.__nextSeqNumber = self.__nextSeqNumber + 1
+
+		return location
+
+	def __importFile(self, item):
+		sourcePath, location, name, tags = item
+		actualPath = os.path.join(self.db_path, location)
+
+		try:
+			actualDir = os.path.dirname(actualPath)
+			self.__dirsLock.acquire()
+			try:
+				if not os.path.isdir(actualDir):
+					os.makedirs(actualDir)
+			finally:
+				self.__dirsLock.release()
+
+			if self.method == 'link':
+				os.link(sourcePath, actualPath)
+			elif self.method == 'reflink':
+				ret = os.spawnlp(os.P_WAIT, 'cp', 'cp', '--reflink=always', '--preserve=all', sourcePath, actualPath)
+				if ret != 0:
+					raise OSError("cp --reflink failed for %s" % sourcePath)
+			else:
+				shutil.copy2(sourcePath, actualPath)
+
+			# Attributes of the file are kept in the database along with its tags
+			attributes = TagHelper.getFileAttributes(name, os.lstat(actualPath))
+		except:
+			self.__failed.append(sourcePath)
+			raise
+
+		self.__imported.append((TagFile(location, name), tags, attributes))
@@ -0,0 +1,247 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import threading
+
+try:
+	import cProfile as profile
+except ImportError:
+	import profile
+
+class Profiler(object):
+	"""
+	Profiles the filesystem operations of a running file system on demand
+
+	The profiler provides wrappers for the operations of Dhtfs, which cost next to
+	nothing while the profiler is not running. Once started, the selected operations,
+	or all of them, are run under the profiler till it is stopped. The statistics are
+	then saved to a file which can be read with the pstats module.
+
+	Profiled operations are run one at a time, other operations are not affected.
+
+	Typical usage of this class would be as follows:
+
+	Example
+	=======
+	from Profiler import Profiler
+
+	profiler = Profiler('/tmp')
+	server.wrapOperations(profiler.wrap, profiler.wrapFileOp)
+	profiler.start(['readdir'])
+	...
+	print profiler.stop()
+	"""
+
+	def __init__(self, directory, logger=None):
+		"""
+		Profiler(directory, logger) -> instance of class Profiler
+
+		@param directory: Directory in which the statistics are saved
+		@type directory: str
+
+		@param logger: Logger to log starting and stopping of the profiler
+		@type logger: logging.Logger
+		"""
+
+		self.directory = directory
+		self.logger = logger
+		self.lock = threading.RLock()
+		self.local = threading.local()
+		self.profile = None
+		self.ops = None
+		self.started = None
+		self.calls = 0
+
+	def isRunning(self):
+		"""
+		P.isRunning() -> True if the profiler is running
+		"""
+
+		return self.profile is not None
+
+	def start(self, ops=None):
+		"""
+		P.start(ops) -> Start profiling the operations
+
+		@param ops: Names of the operations to profile, all operations if None or empty
+		@type ops: List of str
+
+		@return: False if the profiler was already running, True otherwise
+		@rtype: bool
+		"""
+
+		self.lock.acquire()
+		try:
+			if self.profile is not None:
+				return False
+
+			self.ops = None
+			if ops:
+				self.ops = set(ops)
+			self.calls = 0
+			self.started = time.time()
+			self.profile = profile.Profile()
+			if self.logger:
+				self.logger.info("Profiler started for operations %s" % (ops or 'all'))
+			return True
+		finally:
+			self.lock.release()
+
+	def stop(self):
+		"""
+		P.stop() -> Stop profiling and save the statistics
+
+		@return: Path of the file containing the statistics, None if the profiler was not running
+		@rtype: str
+		"""
+
+		self.lock.acquire()
+		try:
+			if self.profile is None:
+				return None
+
+			path = os.path.join(self.directory, 'dhtfs-%d-%s.prof' %
+					(os.getpid(), time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))))
+			prof = self.profile
+			self.profile = None
+			prof.dump_stats(path)
+			if self.logger:
+				self.logger.info("Profiler stopped after %d calls, statistics saved to %s" % (self.calls, path))
+			return path
+		finally:
+			self.lock.release()
+
+	def getStatus(self):
+		"""
+		P.getStatus() -> Line describing the state of the profiler
+		"""
+
+		self.lock.acquire()
+		try:
+			if self.profile is None:
+				return 'stopped'
+
+			return 'running since %s, %d calls of %s profiled' % \
+					(time.ctime(self.started), self.calls, ' '.join(sorted(self.ops or ['all operations'])))
+		finally:
+			self.lock.release()
+
+	def command(self, line):
+		"""
+		P.command(line) -> Run a command given as text
+
+		The commands are 'start [operation ...]', 'stop' and 'status'.
+
+		@param line: Command to be run
+		@type line: str
+
+		@return: Line describing the outcome of the command
+		@rtype: str
+		"""
+
+		words = line.split()
+		if not words or words[0] == 'status':
+			return self.getStatus()
+
+		if words[0] == 'start':
+			if not self.start(words[1:]):
+				return 'already ' + self.getStatus()
+			return self.getStatus()
+
+		if words[0] == 'stop':
+			path = self.stop()
+			if path is None:
+				return 'not running'
+			return 'stopped, statistics saved to %s' % path
+
+		return "unknown command '%s', use start [operation ...], stop or status" % words[0]
+
+	def __isSelected(self, op):
+		return self.profile is not None and (self.ops is None or op in self.ops) and \
+				not getattr(self.local, 'active', False)
+
+	def __call(self, op, fn, args):
+		self.lock.acquire()
+		try:
+			prof = self.profile
+			if prof is None:
+				return fn(*args)
+
+			# Operations called while an operation is being profiled are part of its profile
+			self.local.active = True
+			try:
+				self.calls = self.calls + 1
+				if op == 'readdir':
+					# The listing is produced lazily, profile all of it
+					return prof.runcall(lambda *a: list(fn(*a)), *args)
+				return prof.runcall(fn, *args)
+			finally:
+				self.local.active = False
+		finally:
+			self.lock.release()
+
+	def wrap(self, op, fn):
+		"""
+		P.wrap(op, fn) -> Function profiling calls of the operation fn while the profiler is running
+
+		@param op: Name of the operation
+		@type op: str
+
+		@param fn: Bound method implementing the operation
+		@type fn: callable
+
+		@rtype: function
+		"""
+
+		def profiled(*args):
+			if not self.__isSelected(op):
+				return fn(*args)
+			return self.__call(op, fn, args)
+
+		return profiled
+
+	def wrapFileOp(self, op, fn):
+		"""
+		P.wrapFileOp(op, fn) -> Function profiling calls of the file operation fn while the profiler is running
+
+		@param op: Name of the operation, 'open' for the constructor of the file class
+		@type op: str
+
+		@param fn: Function implementing the operation, taking the file object as first argument
+		@type fn: function
+
+		@rtype: function
+		"""
+
+		def profiled(fileObject, *args):
+			if not self.__isSelected(op):
+				return fn(fileObject, *args)
+			return self.__call(op, fn, (fileObject,) + args)
+
+		return profiled
@@ -0,0 +1,105 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+NOT = '-'
+OR = '|'
+
+def parseComponent(component, isTag):
+	"""
+	parseComponent(component, isTag) -> Parse a component of a path into an alternative of tags
+
+	A component is a list of tags separated by '|', and selects the elements having any of
+	the tags. A component starting with '-' selects the elements having none of the tags.
+	e.g. 'jpg|png', '-live', '-live|demo'
+
+	A component which is the name of a tag is always taken as the tag, even if it has
+	these characters.
+
+	@param component: Component of a path
+	@type component: str
+
+	@param isTag: Function telling whether a name is the name of a tag
+	@type isTag: Function
+
+	@return: Tuple (negated, atoms). atoms are the names making up the alternative, each of
+		them either a tag or a term understood by L{Tagging}
+	@rtype: C{(bool, List of str)}
+	"""
+
+	if isTag(component):
+		return False, [component]
+
+	negated = False
+	if component.startswith(NOT) and len(component) > len(NOT):
+		negated = True
+		component = component[len(NOT):]
+		if isTag(component):
+			return True, [component]
+
+	atoms = [x for x in component.split(OR) if x != '']
+	if len(atoms) == 0:
+		atoms = [component]
+
+	return negated, atoms
+
+def compileQuery(components, isTag):
+	"""
+	compileQuery(components, isTag) -> Compile the components of a path into a normalized query
+
+	The elements selected by a path are those selected by all of its components. The query
+	is normalized, so that paths which differ only in the order of their components or of the
+	tags in an alternative compile to the same query, and can share cached results.
+
+	Negations are pushed after the intersection of the positive components. A negated
+	alternative is a negation of each of its tags, so all the negations are merged into a
+	single set of tags whose elements are removed at the end.
+
+	@param components: Components of a path
+	@type components: List of str
+
+	@param isTag: Function telling whether a name is the name of a tag
+	@type isTag: Function
+
+	@return: Tuple (positives, negatives). positives is a sorted tuple of alternatives, each of
+		them a sorted tuple of atoms. negatives is a sorted tuple of atoms
+	@rtype: C{(tuple, tuple)}
+	"""
+
+	positives = set([])
+	negatives = set([])
+	for component in components:
+		negated, atoms = parseComponent(component, isTag)
+		if negated:
+			negatives.update(atoms)
+		else:
+			positives.add(tuple(sorted(set(atoms))))
+
+	# An alternative containing a tag which is also required adds nothing
+	required = set([x[0] for x in positives if len(x) == 1])
+	positives = [x for x in positives if len(x) == 1 or required.isdisjoint(x)]
+
+	return tuple(sorted(positives)), tuple(sorted(negatives))
@@ -27,9 +27,17 @@
 
 import md5	
 import os
+import re
+import time
+import itertools
 import logging
 import stat
+import mimetypes
 from dhtfs.Tagging import Tagging
+from dhtfs.Query import parseComponent, NOT, OR
+
+# Fields of results of stat which are not in their tuple, kept along with it by getFileAttributes
+STAT_FIELDS = ('st_atime', 'st_mtime', 'st_ctime', 'st_blksize', 'st_blocks', 'st_rdev')
 
 class TagFile:
 	"""
@@ -75,6 +83,39 @@ class TagDir(Tagging):
 
 	DEFAULT_DIR_MODE = (stat.S_IRWXO | stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP | stat.S_IWRITE)
 
+	# Paths are resolved through an index of all files when more than these many are resolved together
+	PATH_INDEX_THRESHOLD = 16
+
+	# Files of a directory with too many entries are listed in virtual directories named
+	# PAGE_DIR_PREFIX followed by the page number, starting from 1
+	PAGE_DIR_PREFIX = '.page-'
+
+	# A directory below this one selects the files of the directories starting with its name,
+	# /.prefix/mu/ is the same as /mu*/
+	PREFIX_DIR = '.prefix'
+
+	# A directory below this one selects the files whose names contain its name,
+	# /.search/beat/ has the files with 'beat' in their names
+	SEARCH_DIR = '.search'
+
+	# A directory below one of these selects the files by an attribute, e.g. /.size/>100M/
+	# or /.modified/last-7d/
+	ATTRIBUTE_DIRS = { '.size' : 'size', '.modified' : 'mtime' }
+
+	# Saved queries are the directories below this one, /.saved/name/ has the files selected
+	# by the query saved as name
+	SAVED_DIR = '.saved'
+
+	# Sizes are given in bytes or with one of these units
+	SIZE_UNITS = { '' : 1, 'K' : 1 << 10, 'M' : 1 << 20, 'G' : 1 << 30, 'T' : 1 << 40 }
+	SIZE_VALUE = re.compile(r'^(>=|<=|>|<|=)?(\d+(\.\d+)?)([KMGT]?)B?$', re.I)
+
+	# Times are given as dates, seconds since the epoch, or relative to the current time
+	# like last-7d, in seconds, minutes, hours, days or weeks
+	TIME_UNITS = { 's' : 1, 'm' : 60, 'h' : 3600, 'd' : 86400, 'w' : 7 * 86400 }
+	TIME_VALUE = re.compile(r'^(>=|<=|>|<|=)(\d{4}-\d{2}-\d{2}|\d+(\.\d+)?)$')
+	RECENT_TIME_VALUE = re.compile(r'^last-(\d+)([smhdw])$')
+
 	def __str__(self):
 		return 'Directory helper for ' + Tagging.__str__(self)
 
@@ -87,8 +128,6 @@ class TagDir(Tagging):
 				os.mkdir(dirname, mode)
 
 	def __delActualDirs(self, dirs):
-		allDirs = self.getAllDirs()
-		dirs = [x for x in dirs if x in allDirs]
 		for dir in dirs:
 			dirname = os.path.join(self.db_path, 't_' + dir)
 			if os.path.isdir(dirname):
@@ -99,16 +138,35 @@ class TagDir(Tagging):
 		actualDirname2 = os.path.join(self.db_path, 't_' + dir2)
 		os.rename(actualDirname1, actualDirname2)
 	
+	def __checkDirNames(self, dirs):
+		invalid = self.getInvalidDirs(dirs)
+		if len(invalid) > 0:
+			raise ValueError("Not valid names of directories: %s" % ', '.join(invalid))
+
 	def renameDir(self, dirs1, dirs2):
 		"""
 		Rename directories
 		"""
 		
-		fileList = Tagging.getElements(self, tagList=dirs1)
-		Tagging.delTagsFromElements(self, dirs1, elementList=fileList)
-		Tagging.addTags(self, elementList=fileList, newTagList=dirs2)
+		self.__checkDirNames(dirs2)
+
+		if len(dirs1) == 1 and len(dirs2) == 1:
+			# All the files with the tag are moved, only the name of the tag changes
+			Tagging.renameTag(self, dirs1[0], dirs2[0])
+		else:
+			fileList = Tagging.getElements(self, tagList=dirs1)
+			Tagging.delTagsFromElements(self, dirs1, elementList=fileList)
+			Tagging.addTags(self, elementList=fileList, newTagList=dirs2)
+
+		if dirs1[-1] == dirs2[-1]:
+			return
 
-		if [dirs1[-1] != dirs2[-1]]:
+		if self.tagExists(dirs1[-1]):
+			# Some files not under the renamed directory still have the tag
+			dirname = os.path.join(self.db_path, 't_' + dirs2[-1])
+			if not os.path.isdir(dirname):
+				os.mkdir(dirname, self.DEFAULT_DIR_MODE)
+		else:
 			self.__renameActualDir(dirs1[-1], dirs2[-1])
 
 	def addDirsToFiles(self, fileList, dirList, mode=DEFAULT_DIR_MODE):
@@ -123,10 +181,36 @@ class TagDir(Tagging):
 
 		@param mode: Mode with which the directories are to be created, if required
 		@type mode: int
+
+		@raise ValueError: Some of the directories do not exist and cannot be created, see L{isValidDirName}
 		"""
+		self.__checkDirNames(dirList)
 		self.__createActualDirs(dirList, mode)
 		Tagging.addTags(self, fileList, dirList)
 
+	def addDirsToExistingFiles(self, dirMap, replaceValues=False, mode=DEFAULT_DIR_MODE):
+		"""
+		Associates directories with files which exist, in a single update of the database.
+		Files which do not exist, like those deleted meanwhile, are left alone
+
+		@param dirMap: Dictionary mapping files to lists of directories to be associated with them
+		@type dirMap: C{dict}
+
+		@param replaceValues: If True value tags in dirMap replace those of the files with the same
+			name, see L{Tagging.tagElements}
+		@type replaceValues: bool
+
+		@param mode: Mode with which the directories are to be created, if required
+		@type mode: int
+
+		@raise ValueError: Some of the directories do not exist and cannot be created, see L{isValidDirName}
+		"""
+		dirs = list(set(itertools.chain(*dirMap.values())))
+		self.__checkDirNames(dirs)
+		self.__createActualDirs(dirs, mode)
+		replacedDirs = Tagging.tagElements(self, dirMap, replaceValues)
+		self.__delActualDirs([x for x in replacedDirs if not self.tagExists(x)])
+
 	def createDirs(self, dirs, mode=DEFAULT_DIR_MODE):
 		"""
 		Create Directories
@@ -136,10 +220,52 @@ class TagDir(Tagging):
 
 		@param mode: Mode with which the directories are to be created, if required
 		@type mode: int
+
+		@raise ValueError: Some of the directories cannot be created, see L{isValidDirName}
 		"""
+		self.__checkDirNames(dirs)
 		self.__createActualDirs(dirs, mode)
 		Tagging.addTags(self, newTagList=dirs)
 
+	def setImpliedDirs(self, dir, impliedDirs, mode=DEFAULT_DIR_MODE):
+		"""
+		Set the directories implied by a directory. Files in a directory are also in the
+		directories it implies, see L{Tagging.setImpliedTags}
+
+		@param dir: Directory implying the other directories
+		@type dir: str
+
+		@param impliedDirs: Directories implied by dir, replacing those set earlier
+		@type impliedDirs: List of str
+
+		@param mode: Mode with which the directories are to be created, if required
+		@type mode: int
+
+		@return: True if the directories were set, False if dir would imply itself
+		@rtype: bool
+
+		@raise ValueError: Some of the directories do not exist and cannot be created, see L{isValidDirName}
+		"""
+		dirs = [x for x in [dir] + impliedDirs if x != '']
+		self.__checkDirNames(dirs)
+		self.__createActualDirs(dirs, mode)
+		if Tagging.setImpliedTags(self, dir, impliedDirs):
+			return True
+
+		self.__delActualDirs([x for x in dirs if not self.tagExists(x)])
+		return False
+
+	def getImpliedDirs(self, dir):
+		"""
+		Get the directories implied directly by a directory
+
+		@param dir: Directory implying the other directories
+		@type dir: str
+
+		@rtype: List of str
+		"""
+		return Tagging.getImpliedTags(self, dir)
+
 	def delDirs(self, dirs):
 		"""
 		Delete Directories
@@ -161,18 +287,35 @@ class TagDir(Tagging):
 		@type dirs: List of str
 		"""
 
-		self.__delActualDirs(dirs)
 		Tagging.delTagsFromElements(self, dirs, files)
 
+		# Other files may still be in the directories
+		self.__delActualDirs([x for x in dirs if not self.tagExists(x)])
+
 	def delFiles(self, files, dirs=[]):
 		"""
 		Delete files
 
 		@param files: List of files to be used
 		@type files: List of instances of L{TagFile}
+
+		@param dirs: List of directories to delete the files from. Files are deleted from
+			all their directories if empty
+		@type dirs: List of str
 		"""
 
+		if len(files) == 0:
+			return
+
+		if len(dirs) == 0:
+			affectedDirs = self.getDirsForFiles(files)
+		else:
+			affectedDirs = dirs
+
 		Tagging.delElementsFromTags(self, files, tagList=dirs)
+
+		# Directories left without files are removed along with their tags
+		self.__delActualDirs([x for x in affectedDirs if not self.tagExists(x)])
 		
 	def getAllDirs(self):
 		"""
@@ -245,6 +388,54 @@ class TagDir(Tagging):
 
 		return Tagging.getTagsAndElementsForTags(self, dirList, beRestrictive, getCover)
 
+	def estimateFiles(self, dirList):
+		"""
+		Estimate the number of files contained in all the directories specified in dirList,
+		without getting the files. See L{Tagging.estimateElements}
+
+		@param dirList: List of directories to be used
+		@type dirList: List of str
+
+		@rtype: int
+		"""
+		return Tagging.estimateElements(self, dirList)
+
+	def getRelatedDirs(self, dirList, maxDirs=10):
+		"""
+		Get the directories whose files are most like the files of the given directories,
+		see L{Tagging.getRelatedTags}
+
+		@param dirList: List of directories to be used
+		@type dirList: List of str
+
+		@param maxDirs: Number of directories to return
+		@type maxDirs: int
+
+		@return: List of directories, most similar first
+		@rtype: List of str
+		"""
+		return [dir for (dir, similarity) in Tagging.getRelatedTags(self, dirList, maxDirs)]
+
+	def getRankedDirsAndFilesForDirs(self, dirList, maxDirs=None):
+		"""
+		Get the directories which best divide the files contained in all the directories specified in dirList,
+		and the files not contained in any of them
+
+		A directory containing half of the files is the best, as it narrows down the files the most
+		whichever way one goes.
+
+		@param dirList: List of directories to be used
+		@type dirList: List of str
+
+		@param maxDirs: Number of best directories to return. All the directories are returned if None
+		@type maxDirs: int
+
+		@return: A tuple of list of directories, best first, and list of files
+		@rtype: (List of str, List of instances of L{TagFile})
+		"""
+
+		return Tagging.getRankedTagsAndElementsForTags(self, dirList, maxDirs)
+
 	def getAllFiles(self):
 		"""
 		Get a list of all files
@@ -277,11 +468,181 @@ class TagDir(Tagging):
 		@return: True is fname is a directory, False otherwise
 		@rtype: bool
 		"""
-		if fname in self.getAllDirs():
+		return bool(self.tagExists(fname))
+
+	def isValidDirName(self, fname):
+		"""
+		Check whether the specified name can be the name of a directory
+
+		Names of existing directories are valid. A new directory cannot have the name of a
+		virtual directory, like L{SEARCH_DIR} or a page directory, nor a name which would be
+		taken as a query, like -live, jpg|png, year>=2003 or mus*.
+
+		@param fname: Name to be checked
+		@type fname: str
+
+		@return: True if fname can be the name of a directory, False otherwise
+		@rtype: bool
+		"""
+		if fname in ('', '.', '..') or os.path.sep in fname or self.isQueryParent(fname) or self.getPageNumber(fname):
+			return False
+
+		if self.isDir(fname):
 			return True
-		else:
+
+		if (fname.startswith(NOT) and len(fname) > len(NOT)) or OR in fname or \
+				fname.startswith(Tagging.SEARCH_TERM_PREFIX):
+			return False
+
+		return not Tagging.VALUE_TERM.match(fname) and not Tagging.PREFIX_TERM.match(fname)
+
+	def getInvalidDirs(self, dirs):
+		"""
+		Get the names which cannot be names of directories, see L{isValidDirName}
+
+		@param dirs: Names to be checked
+		@type dirs: List of str
+
+		@rtype: List of str
+		"""
+		return [x for x in dirs if not self.isValidDirName(x)]
+
+	def isQueryDir(self, fname):
+		"""
+		Check whether the specified name is a query selecting files, like year>=2003, instead of a directory
+
+		Alternatives like jpg|png and negations like -live are queries when every directory
+		or query in them exists.
+
+		@param fname: Name to be checked
+		@type fname: str
+
+		@return: True if fname is a query which selects some directory, False otherwise
+		@rtype: bool
+		"""
+		if self.isDir(fname):
 			return False
 
+		negated, atoms = parseComponent(fname, self.isDir)
+		if negated or len(atoms) > 1:
+			return len([x for x in atoms if not self.isDir(x) and not self.isQueryDir(x)]) == 0
+
+		# Saved queries exist even when they select no files
+		if fname.startswith(Tagging.SAVED_TERM_PREFIX):
+			return fname[len(Tagging.SAVED_TERM_PREFIX):] in Tagging.getSavedQueries(self)
+
+		if fname.startswith(Tagging.SEARCH_TERM_PREFIX):
+			return len(self.getFilesForDirs([fname])) > 0
+
+		return bool(Tagging.getTermTags(self, fname))
+
+	def getPageNumber(self, fname):
+		"""
+		Get the page number of a page directory
+
+		@param fname: Name to be checked
+		@type fname: str
+
+		@return: Page number if fname is the name of a page directory, 0 otherwise
+		@rtype: int
+		"""
+		if not fname.startswith(TagDir.PAGE_DIR_PREFIX):
+			return 0
+
+		number = fname[len(TagDir.PAGE_DIR_PREFIX):]
+		if not number.isdigit() or number.startswith('0'):
+			return 0
+
+		return int(number)
+
+	def getDirsInPath(self, path):
+		"""
+		Get the directories in a path. Page directories are not part of the directories,
+		a directory below L{PREFIX_DIR} is a prefix, one below L{SEARCH_DIR} is searched for
+		in the names of files and one below L{SAVED_DIR} is a saved query
+
+		@param path: Path of a directory
+		@type path: str
+
+		@return: List of directories
+		@rtype: List of str
+		"""
+		dirs = []
+		queryDir = None
+		for x in path.split(os.path.sep):
+			if x == '' or self.getPageNumber(x):
+				continue
+			elif self.isQueryParent(x):
+				queryDir = x
+			elif queryDir == TagDir.PREFIX_DIR:
+				dirs.append(x + '*')
+				queryDir = None
+			elif queryDir == TagDir.SEARCH_DIR:
+				dirs.append(Tagging.SEARCH_TERM_PREFIX + x)
+				queryDir = None
+			elif queryDir == TagDir.SAVED_DIR:
+				dirs.append(Tagging.SAVED_TERM_PREFIX + x)
+				queryDir = None
+			elif queryDir is not None:
+				dirs.append(self.getAttributeTerm(TagDir.ATTRIBUTE_DIRS[queryDir], x))
+				queryDir = None
+			else:
+				dirs.append(x)
+
+		return dirs
+
+	def isQueryParent(self, fname):
+		"""
+		Check whether the specified name is that of a directory whose subdirectories are queries,
+		like L{PREFIX_DIR}, L{SEARCH_DIR}, L{SAVED_DIR} and L{ATTRIBUTE_DIRS}
+
+		@param fname: Name to be checked
+		@type fname: str
+
+		@rtype: bool
+		"""
+		return fname in (TagDir.PREFIX_DIR, TagDir.SEARCH_DIR, TagDir.SAVED_DIR) or fname in TagDir.ATTRIBUTE_DIRS
+
+	def getAttributeTerm(self, attribute, value):
+		"""
+		Get the term selecting files by an attribute, from the name of a directory below one
+		of L{ATTRIBUTE_DIRS}
+
+		@param attribute: Attribute, 'size' or 'mtime'
+		@type attribute: str
+
+		@param value: Name of the directory, like '>100M' for size or 'last-7d' for mtime
+		@type value: str
+
+		@return: Term to be used as a directory. The term selects no files if value is not valid
+		@rtype: str
+		"""
+		op = None
+		if attribute == 'size':
+			match = TagDir.SIZE_VALUE.match(value)
+			if match:
+				op = match.group(1) or '='
+				value = int(float(match.group(2)) * TagDir.SIZE_UNITS[match.group(4).upper()])
+		elif attribute == 'mtime':
+			match = TagDir.RECENT_TIME_VALUE.match(value)
+			if match:
+				op = '>='
+				value = int(time.time()) - int(match.group(1)) * TagDir.TIME_UNITS[match.group(2)]
+			else:
+				match = TagDir.TIME_VALUE.match(value)
+				if match:
+					op = match.group(1)
+					try:
+						value = int(time.mktime(time.strptime(match.group(2), '%Y-%m-%d')))
+					except ValueError:
+						value = match.group(2)
+
+		if op is None:
+			# Not a valid value. Taken as a search for a name containing a slash, which selects no file
+			return '//=' + value
+
+		return '//%s%s%s' % (attribute, op, value)
+
 	def getActualLocation(self, dirs, filename):
 		filesInDir = Tagging.getElements(self, dirs)
 		matchingFiles = [x for x in filesInDir if x.name == filename]
@@ -289,7 +650,165 @@ class TagDir(Tagging):
 			return None
 		else:
 			return matchingFiles[0].location
-		
+
+	def getFilesForPaths(self, paths):
+		"""
+		Get the files at the given paths
+
+		@param paths: Paths of files. Directories in a path are the directories containing the file
+		@type paths: List of str
+
+		@return: A tuple of list of files found and list of paths for which no file was found
+		@rtype: (List of instances of L{TagFile}, List of str)
+		"""
+
+		pathMap = self.resolvePaths(paths)
+
+		files = [pathMap[x] for x in paths if x in pathMap]
+		unresolved = [x for x in paths if x not in pathMap]
+
+		return files, unresolved
+
+	def resolvePaths(self, paths):
+		"""
+		Map paths to the files at the paths
+
+		A few paths are looked up one by one. For many paths an index of all the files by
+		their names is built once, and each path is looked up in the index.
+
+		@param paths: Paths of files. Directories in a path are the directories containing the file
+		@type paths: List of str
+
+		@return: Dictionary mapping paths to files. Paths for which no file was found are left out
+		@rtype: C{dict}
+		"""
+
+		pathMap = {}
+
+		if len(paths) <= TagDir.PATH_INDEX_THRESHOLD:
+			for path in paths:
+				dirs = self.getDirsInPath(os.path.dirname(path))
+				filename = os.path.basename(path)
+				location = self.getActualLocation(dirs, filename)
+				if location:
+					pathMap[path] = TagFile(location, filename)
+
+			return pathMap
+
+		# Index of files and their directories by the name of the file. Directories implied
+		# by those of a file hold the file too
+		implied = {}
+		index = {}
+		for f, dirs in self.getTagsDict().items():
+			fileDirs = set(dirs)
+			for dir in dirs:
+				if dir not in implied:
+					implied[dir] = Tagging.getImpliedTags(self, dir, True)
+				fileDirs.update(implied[dir])
+
+			try:
+				index[f.name].append((f, fileDirs))
+			except KeyError:
+				index[f.name] = [(f, fileDirs)]
+
+		allDirs = set(self.getAllDirs())
+		for path in paths:
+			dirs = set(self.getDirsInPath(os.path.dirname(path)))
+			if not dirs.issubset(allDirs):
+				# Query directories like year>=2003 are not in the index, the query is run instead
+				location = self.getActualLocation(list(dirs), os.path.basename(path))
+				if location:
+					pathMap[path] = TagFile(location, os.path.basename(path))
+				continue
+
+			for f, fileDirs in index.get(os.path.basename(path), []):
+				if dirs.issubset(fileDirs):
+					pathMap[path] = f
+					break
+
+		return pathMap
+
+	def updatePaths(self, records, delete=False):
+		"""
+		Add or remove directories of the files at the given paths, in a single update of the database
+
+		@param records: List of tuples (path, dirs). The files at the paths are added to or
+			removed from the directories
+		@type records: List of (str, List of str)
+
+		@param delete: Remove the files from the directories if True, add them otherwise
+		@type delete: bool
+
+		@return: Paths for which no file was found
+		@rtype: List of str
+		"""
+
+		pathMap = self.resolvePaths([path for path, dirs in records])
+
+		# Group the files getting the same directories
+		groups = {}
+		unresolved = []
+		for path, dirs in records:
+			if path not in pathMap:
+				unresolved.append(path)
+				continue
+
+			key = tuple(sorted(set(dirs)))
+			try:
+				groups[key].append(pathMap[path])
+			except KeyError:
+				groups[key] = [pathMap[path]]
+
+		changes = [(files, list(dirs)) for dirs, files in groups.items()]
+
+		if delete:
+			self.bulkUpdate(delList=changes)
+		else:
+			self.bulkUpdate(addList=changes)
+
+		return unresolved
+
+	def bulkUpdate(self, addList=[], delList=[], mode=DEFAULT_DIR_MODE, attributeMap={}):
+		"""
+		Associate directories with files and remove files from directories, in a single update of the database
+
+		@param addList: List of tuples (files, dirs). The directories are associated with the files
+		@type addList: List of (List of instances of L{TagFile}, List of str)
+
+		@param delList: List of tuples (files, dirs). The files are removed from the directories
+		@type delList: List of (List of instances of L{TagFile}, List of str)
+
+		@param mode: Mode with which the directories are to be created, if required
+		@type mode: int
+
+		@param attributeMap: Attributes of the files, see L{Tagging.setAttributes}
+		@type attributeMap: C{dict}
+
+		@raise ValueError: Some of the directories to be associated do not exist and cannot be
+			created, see L{isValidDirName}
+		"""
+
+		self.__checkDirNames(list(set(itertools.chain(*[dirs for files, dirs in addList]))))
+
+		self.setWriteCaching()
+		try:
+			for files, dirs in addList:
+				self.__createActualDirs(dirs, mode)
+				Tagging.addTags(self, files, dirs)
+
+			for files, dirs in delList:
+				Tagging.delTagsFromElements(self, dirs, files)
+
+			Tagging.setAttributes(self, attributeMap)
+		finally:
+			self.doneWriteCaching()
+
+		# Other files may still be in the directories
+		removedDirs = set()
+		for files, dirs in delList:
+			removedDirs.update(dirs)
+		self.__delActualDirs([x for x in removedDirs if not self.tagExists(x)])
+
 def getLogger(name):
 	logging.basicConfig(level=logging.DEBUG,
 		format='%(asctime)s: %(levelname)s: %(name)s: %(message)s',
@@ -298,6 +817,77 @@ def getLogger(name):
 
 	return logging.getLogger(name)
 
+def getFileAttributes(name, st):
+	"""
+	getFileAttributes(name, st) -> Get the attributes of a file kept in the database
+
+	The attributes are 'size', 'mtime', 'ext' (extension in lower case, without the dot), 'mime'
+	(type guessed from the name, if any) and 'stat' (the result of stat as its tuple and a dictionary
+	of the fields in L{STAT_FIELDS}, see L{getStat}).
+
+	@param name: Name of the file
+	@type name: str
+
+	@param st: Result of stat of the backing file
+	@type st: posix.stat_result
+
+	@return: Dictionary of attributes and their values
+	@rtype: C{dict}
+	"""
+
+	attributes = {
+		'size' : st.st_size,
+		'mtime' : st.st_mtime,
+		'ext' : os.path.splitext(name)[1][1:].lower(),
+		'mime' : mimetypes.guess_type(name)[0],
+		'stat' : (tuple(st), dict([(x, getattr(st, x)) for x in STAT_FIELDS if hasattr(st, x)])),
+	}
+
+	return attributes
+
+def getStat(attributes):
+	"""
+	getStat(attributes) -> Get the result of stat kept in the attributes of a file
+
+	@param attributes: Attributes of the file, see L{getFileAttributes}
+	@type attributes: C{dict}
+
+	@return: Result of stat, None if it is not kept or is kept without all its fields
+	@rtype: posix.stat_result
+	"""
+
+	# Older versions kept only the tuple and the times
+	if 'stat' not in attributes or len(attributes['stat']) != 2:
+		return None
+
+	return os.stat_result(*attributes['stat'])
+
+def getDigest(path, blockSize=65536):
+	"""
+	getDigest(path) -> Get the md5 digest of the contents of a file
+
+	@param path: Path of the file
+	@type path: str
+
+	@param blockSize: Size of the blocks in which the file is read
+	@type blockSize: int
+
+	@return: Hex digest of the contents of the file
+	@rtype: str
+	"""
+
+	digest = md5.new()
+	f = open(path, 'rb')
+	try:
+		block = f.read(blockSize)
+		while block:
+			digest.update(block)
+			block = f.read(blockSize)
+	finally:
+		f.close()
+
+	return digest.hexdigest()
+
 def main():
 	from Tagging import Tagging
 	import os
@@ -26,7 +26,14 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 from dhtfs.GPStor import GPStor
+from dhtfs.Query import compileQuery, parseComponent, NOT, OR
 import os
+import re
+import heapq
+import bisect
+import random
+import zlib
+import threading
 
 class Tagging:
 	"""
@@ -36,23 +43,143 @@ class Tagging:
 
 	The class uses persistent store provided by L{GPStor}
 
+	Tags are stored as ids, the names of the tags are kept in a separate table.
+	The table is kept in a store of its own, next to the database. Renaming a tag only
+	changes its entry in the table, the rest of the database is not touched.
+
 	The format of the tag dictionary is as follows ::
 		dict = { 
 			'e2t' :	{
-					'element1': ['tag1', 'tag2', ...],
-					'element2': ['tag3', 'tag2', ...],
-					'element3': ['tag1', 'tag4', ...]
+					'element1': [1, 2, ...],
+					'element2': [3, 2, ...],
+					'element3': [1, 4, ...]
 				},
 			't2e' :	{
-					'tag1': ['element1', 'element2', 'element3', ...],
-					'tag4': ['element8', 'element3', 'element3', ...],
-					'tag7': ['element9', 'element5', 'element3', ...]
+					1: ['element1', 'element2', 'element3', ...],
+					4: ['element8', 'element3', 'element3', ...],
+					7: ['element9', 'element5', 'element3', ...]
 				},
+			'tags' : { 'tag1': 1, 'tag2': 2, ... },
+			'names' : { 1: 'tag1', 2: 'tag2', ... },
+			'nextTagId' : 8,
 		}
+
+	'tags', 'names' and 'nextTagId' are in the table of tag names. The names of deleted tags
+	are kept in 'names', so that readers never find an id without a name.
+
+	The database also keeps views, which are listings updated along with the tags
+	(see L{setViews}) ::
+			'views' : ['root', 'tags', 'search'],
+			'untagged' : set(['element4', ...]),
+			'cooc' : { 1: { 2: 15, 4: 3, ... }, ... },
+			'sole' : { 1: set(['element5', ...]), ... },
+			'grams' : { 'ele': set(['element1', ...]), ... },
+
+	'untagged' has the elements without tags, 'cooc' the number of elements shared by
+	each pair of tags and 'sole' the elements having a single tag, for each tag.
+	'grams' has the elements whose names contain each sequence of three characters,
+	see L{searchElements}.
+
+	The 'sketches' view keeps a MinHash signature of each tag, with the elements giving
+	the smallest value of each hash function, and an index of the bands of the signatures
+	for finding similar tags, see L{getRelatedTags} ::
+			'minhash' : { 1: ([1523, 87, ...], ['element3', 'element1', ...]), ... },
+			'lsh' : { (0, 1523, 87, 9120, 33): set([1, 4]), ... },
+
+	Elements can have attributes, like their size, kept in 'e2a'. Some of the attributes
+	are indexed, the values of each being kept sorted along with the elements having them ::
+			'e2a' : { 'element1': { 'size': 1024, 'mtime': 1136073600.0, ... }, ... },
+			'a2e' : { 'size': ([12, 1024, ...], ['element3', 'element1', ...]), ... },
+
+	'generation' is incremented every time the database is written. Results of queries
+	are cached till it changes.
+
+	Queries can be saved under a name. Their results are kept up to date as elements are
+	tagged, see L{saveQuery} ::
+			'saved' : { 'name1': (['tag1', '-tag2'], set(['element1', ...])), ... },
+
+	Tags can imply other tags, see L{setImpliedTags}. 'implies' has the tags implied by each
+	tag, 'ancestors' and 'descendants' the tags implied by each tag and the tags implying
+	each tag, directly or through other tags. 'implied' has the elements of each implied
+	tag along with those of all the tags implying it ::
+			'implies' : { 1: set([4]), 4: set([7]), ... },
+			'ancestors' : { 1: set([4, 7]), 4: set([7]), ... },
+			'descendants' : { 4: set([1]), 7: set([1, 4]), ... },
+			'implied' : { 4: set(['element1', ...]), 7: set(['element1', ...]), ... },
+
+	Tags of the form 'name:value', like 'year:2003', are value tags. The table of tag names
+	also keeps an index of their values, sorted separately for each name ::
+			'values' : { 'year': ([(0, 1999), (0, 2003), ...], [12, 5, ...]), ... },
+
+	The first list has the values, the second the ids of the tags with the values. Values
+	are kept as (type, value), numbers being of type 0, dates (2003-05-10) of type 1 and
+	any other value of type 2, so that values of a type sort together.
+
+	The names of all the tags are also kept sorted, for finding the tags starting with
+	a prefix ::
+			'sortedTags' : ['tag1', 'tag2', 'year:2003', ...],
+
+	Databases of older versions, which use tag names in 'e2t' and 't2e', are upgraded when
+	they are first used.
 	"""
 
 	DB_FILE = '.tag.db'
 
+	# The table of tag names is stored in the file named by the database file with this suffix
+	NAMES_SUFFIX = '.names'
+
+	# Keys of the tag dictionary which are kept in the table of tag names
+	NAME_KEYS = ['tags', 'names', 'nextTagId', 'values', 'sortedTags']
+
+	# Terms selecting value tags by their values, like 'year>=2003'. See L{getValueTags}
+	VALUE_TERM = re.compile(r'^([^<>=:]+)(>=|<=|>|<|=)(.*)$')
+	# Terms selecting the tags starting with a prefix, like 'mus*'. See L{getTagsWithPrefix}
+	PREFIX_TERM = re.compile(r'^([^*]+)\*$')
+	# Terms selecting the elements whose names contain some text start with this, like '/beat'.
+	# See L{searchElements}
+	SEARCH_TERM_PREFIX = '/'
+	# Terms selecting the elements by the value of an attribute, like '//size>1024'. See L{setAttributes}
+	ATTRIBUTE_TERM = re.compile(r'^//([^<>=]+)(>=|<=|>|<|=)(.*)$')
+	# Terms selecting the elements of a saved query start with this, like '//@name'. See L{saveQuery}
+	SAVED_TERM_PREFIX = '//@'
+
+	NUMBER_VALUE = re.compile(r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+	DATE_VALUE = re.compile(r'^\d{4}-\d{2}(-\d{2}([T ]\d{2}:\d{2}(:\d{2})?)?)?$')
+
+	# Views of the database kept up to date as tags are changed, see L{setViews}
+	#	'root' - Elements which are not tagged
+	#	'tags' - Number of elements shared by each pair of tags, and elements with a single tag
+	#	'search' - Elements by the sequences of three characters in their names
+	#	'sketches' - MinHash signatures of the tags
+	VIEWS = ['root', 'tags', 'search', 'sketches']
+
+	# Length of the sequences of characters by which the names of elements are indexed
+	GRAM_LENGTH = 3
+
+	# Number of results of queries kept, see L{getElements}
+	QUERY_CACHE_SIZE = 64
+
+	# Attributes of elements which are indexed, see L{setAttributes}
+	INDEXED_ATTRIBUTES = ['size', 'mtime', 'ext', 'mime']
+
+	# Number of hash functions in the MinHash signatures of tags, and number of bands the
+	# signatures are split into for finding similar tags. See L{getRelatedTags}
+	MINHASH_SIZE = 32
+	LSH_BANDS = 8
+
+	# The hash functions are (a * x + b) % MINHASH_PRIME, x being a checksum of the element.
+	# They are fixed, as the signatures are kept in the database
+	MINHASH_PRIME = (1 << 31) - 1
+	MINHASH_COEFFICIENTS = zip(random.Random(1).sample(xrange(1, MINHASH_PRIME), MINHASH_SIZE),
+			random.Random(2).sample(xrange(MINHASH_PRIME), MINHASH_SIZE))
+
+	# Listings of more elements than these are worked out from the elements in the signatures
+	# of the tags, when approximate is set. See L{getTagsAndElementsForTags}
+	APPROXIMATE_THRESHOLD = 50000
+
+	# Fewest elements from the signatures for a listing to be worked out from them
+	APPROXIMATE_MIN_SAMPLE = 8
+
 	def checkSetup(cls, db_path=None, db_file=None):
 		"""
 		Check if Tagging is setup in the given directory
@@ -99,13 +226,27 @@ class Tagging:
 
 		if GPStor.checkSetup(db_path=self.db_path, db_file=self.db_file):
 			self.tagDB = GPStor(db_path=self.db_path, db_file=self.db_file)
+			self.nameDB = GPStor(db_path=self.db_path, db_file=self.db_file + self.NAMES_SUFFIX)
 		else:
 			self.tagDB = None
+			self.nameDB = None
 
-		self.useWriteCache = False
-		self.tagDict = {}
+		# Database changed in memory between setWriteCaching and doneWriteCaching. It is
+		# private to the thread caching, other threads wait for the database till it is written
+		self.writeCache = threading.local()
 		self.logger = logger
 
+		# Results of queries, for the generation of the database they were got from
+		self.queryCache = {}
+		self.queryGeneration = None
+
+		# Saved queries with the ids of their tags, see L{saveQuery}
+		self.savedQueryCache = {}
+
+		# Whether listings of many elements are worked out from samples of the elements,
+		# see L{getTagsAndElementsForTags}. Exact listings are got when False
+		self.approximate = True
+
 	##### Helper functions
 	
 	def __removeValueFromTag(self, tag):
@@ -119,27 +260,978 @@ class Tagging:
 		(tag, value) = valueTag.split(':', 1)
 		return (tag, value)
 
+	def __newTagDict(self):
+		tagDict = { 'e2t' : {}, 't2e' : {}, 'e2a' : {}, 'a2e' : {}, 'tags' : {}, 'names' : {}, 'nextTagId' : 0, 'values' : {}, 'sortedTags' : [] }
+		self.__buildViews(tagDict, self.VIEWS)
+		return tagDict
+
+	##### Attributes of elements
+
+	def __indexAttribute(self, tagDict, element, attribute, value):
+		if attribute not in self.INDEXED_ATTRIBUTES:
+			return
+
+		keys, elements = tagDict['a2e'].setdefault(attribute, ([], []))
+		i = bisect.bisect_right(keys, value)
+		keys.insert(i, value)
+		elements.insert(i, element)
+
+	def __unindexAttribute(self, tagDict, element, attribute, value):
+		if attribute not in self.INDEXED_ATTRIBUTES:
+			return
+
+		keys, elements = tagDict['a2e'][attribute]
+		i = elements.index(element, bisect.bisect_left(keys, value))
+		del keys[i]
+		del elements[i]
+
+	def __setElementAttributes(self, tagDict, element, attributes):
+		# Attributes with the value None are removed
+		current = tagDict['e2a'].setdefault(element, {})
+		for attribute, value in attributes.items():
+			if attribute in current:
+				self.__unindexAttribute(tagDict, element, attribute, current.pop(attribute))
+			if value is not None:
+				current[attribute] = value
+				self.__indexAttribute(tagDict, element, attribute, value)
+
+		if len(current) == 0:
+			del tagDict['e2a'][element]
+
+		if tagDict.get('saved'):
+			self.__updateSavedQueries(tagDict, element)
+
+	def __delElementAttributes(self, tagDict, element):
+		attributes = tagDict['e2a'].pop(element, {})
+		for attribute, value in attributes.items():
+			self.__unindexAttribute(tagDict, element, attribute, value)
+		return attributes
+
+	def __buildAttributeIndexes(self, tagDict):
+		tagDict['a2e'] = {}
+		for element, attributes in tagDict['e2a'].items():
+			for attribute, value in attributes.items():
+				self.__indexAttribute(tagDict, element, attribute, value)
+
+	def __parseAttributeTerm(self, term):
+		# Attribute, operator and value of an attribute term, None if it is not a term
+		match = self.ATTRIBUTE_TERM.match(term)
+		if not match:
+			return None
+
+		(attribute, op, value) = match.groups()
+		if self.NUMBER_VALUE.match(value):
+			value = self.__getValueKey(value)[1]
+		return (attribute, op, value)
+
+	def __findAttributeElements(self, tagDict, term):
+		# Elements selected by an attribute term, None if it is not a term
+		parsed = self.__parseAttributeTerm(term)
+		if parsed is None:
+			return None
+
+		(attribute, op, value) = parsed
+		keys, elements = tagDict['a2e'].get(attribute, ([], []))
+		if op == '=':
+			return elements[bisect.bisect_left(keys, value):bisect.bisect_right(keys, value)]
+		elif op == '>':
+			return elements[bisect.bisect_right(keys, value):]
+		elif op == '>=':
+			return elements[bisect.bisect_left(keys, value):]
+		elif op == '<':
+			return elements[:bisect.bisect_left(keys, value)]
+		else:
+			return elements[:bisect.bisect_right(keys, value)]
+
+	##### Saved queries
+
+	def __getSavedQuery(self, tagDict, name):
+		# Saved query resolved to the ids of its tags. Resolving is repeated when tags
+		# are created, as terms in the query may select them.
+		version = (tagDict.get('generation', 0), tagDict['nextTagId'])
+		try:
+			cachedVersion, key = self.savedQueryCache[name]
+			if cachedVersion == version:
+				return key
+		except KeyError:
+			pass
+
+		key = self.__resolveQuery(tagDict, tagDict['saved'][name][0])
+		self.savedQueryCache[name] = (version, key)
+		return key
+
+	def __matchesAttributeTerm(self, tagDict, element, term):
+		(attribute, op, value) = self.__parseAttributeTerm(term)
+		if attribute not in self.INDEXED_ATTRIBUTES or attribute not in tagDict['e2a'].get(element, {}):
+			return False
+
+		actual = tagDict['e2a'][element][attribute]
+		if op == '=':
+			return actual == value
+		elif op == '>':
+			return actual > value
+		elif op == '>=':
+			return actual >= value
+		elif op == '<':
+			return actual < value
+		else:
+			return actual <= value
+
+	def __matchesAlternative(self, tagDict, element, tagIds, alternative):
+		(ids, elementTerms) = alternative
+		implied = tagDict.get('implied', {})
+		for tagId in ids:
+			if tagId in tagIds or (tagId in implied and element in implied[tagId]):
+				return True
+
+		for term in elementTerms:
+			if self.ATTRIBUTE_TERM.match(term):
+				if self.__matchesAttributeTerm(tagDict, element, term):
+					return True
+			elif term[len(self.SEARCH_TERM_PREFIX):].lower() in self.getElementName(element).lower():
+				return True
+
+		return False
+
+	def __updateSavedQueries(self, tagDict, element):
+		# Add the element to the results of the saved queries selecting it, and remove it
+		# from the others. Saved queries do not refer to other saved queries.
+		tagIds = tagDict['e2t'].get(element)
+		for name, (tagList, elements) in tagDict['saved'].items():
+			positives, negatives = self.__getSavedQuery(tagDict, name)
+			if tagIds is not None and \
+					len([x for x in positives if not self.__matchesAlternative(tagDict, element, tagIds, x)]) == 0 and \
+					not self.__matchesAlternative(tagDict, element, tagIds, negatives):
+				elements.add(element)
+			else:
+				elements.discard(element)
+
+	def __savedQueriesUseNames(self, saved, tags, names):
+		# Whether renaming tags may change saved queries: they name one of the tags, or have
+		# terms other than searches, which select tags by their names
+		for tagList, elements in saved.values():
+			positives, negatives = compileQuery(tagList, tags.has_key)
+			for atoms in positives + (negatives,):
+				for atom in atoms:
+					if atom in names or (atom not in tags and not atom.startswith(self.SEARCH_TERM_PREFIX)):
+						return True
+		return False
+
+	def __renameInSavedQueries(self, tagDict, oldTagName, newTagName):
+		# Saved queries naming a tag keep selecting its elements when it is renamed.
+		# To be called before the name of the tag is changed
+		isTag = tagDict['tags'].has_key
+		for name, (tagList, elements) in tagDict.get('saved', {}).items():
+			renamed = []
+			for component in tagList:
+				negated, atoms = parseComponent(component, isTag)
+				if oldTagName in atoms:
+					atoms = [x == oldTagName and newTagName or x for x in atoms]
+					component = (negated and NOT or '') + OR.join(atoms)
+				renamed.append(component)
+			tagDict['saved'][name] = (renamed, elements)
+
+	def __refreshSavedQueries(self, tagDict):
+		# Work out the results of all the saved queries again, when the names of tags change
+		self.savedQueryCache = {}
+		for name, (tagList, elements) in tagDict.get('saved', {}).items():
+			tagDict['saved'][name] = (tagList, self.__computeQuery(tagDict, self.__getSavedQuery(tagDict, name)))
+
+	##### Implications between tags
+
+	def __getPosting(self, tagDict, tagId):
+		# Elements of a tag, along with those of the tags implying it
+		implied = tagDict.get('implied')
+		if implied and tagId in implied:
+			return implied[tagId]
+		return tagDict['t2e'][tagId]
+
+	def __getViewCounts(self, tagDict, tagId):
+		# Number of elements of a tag in each of the other tags, as (counts, counts in the view).
+		# Tags implied by the tags in the view are not in it, their elements are counted here
+		viewCounts = tagDict['cooc'].get(tagId, {})
+		ancestors = tagDict.get('ancestors')
+		impliedIds = set([])
+		if ancestors:
+			for x in viewCounts.keys() + [tagId]:
+				impliedIds.update(ancestors.get(x, ()))
+			impliedIds.discard(tagId)
+
+		if len(impliedIds) == 0:
+			return viewCounts, viewCounts
+
+		counts = viewCounts.copy()
+		elements = tagDict['t2e'][tagId]
+		for x in impliedIds:
+			counts[x] = len(elements & self.__getPosting(tagDict, x))
+		return counts, viewCounts
+
+	def __impliesTag(self, tagDict, tagId, otherTagId):
+		# Whether a tag implies another one, directly or through other tags
+		implies = tagDict.get('implies', {})
+		seen = set([])
+		pending = [tagId]
+		while len(pending) > 0:
+			x = pending.pop()
+			if x == otherTagId:
+				return True
+			if x not in seen:
+				seen.add(x)
+				pending.extend(implies.get(x, ()))
+		return False
+
+	def __buildImplications(self, tagDict):
+		# Work out the transitive closure of the implications, and the elements of
+		# the implied tags. There are no cycles in the implications.
+		implies = tagDict.setdefault('implies', {})
+		for tagId in [x for x in implies if len(implies[x]) == 0]:
+			del implies[tagId]
+
+		ancestors = {}
+		descendants = {}
+		for tagId in implies:
+			found = set([])
+			pending = list(implies[tagId])
+			while len(pending) > 0:
+				x = pending.pop()
+				if x not in found:
+					found.add(x)
+					pending.extend(implies.get(x, ()))
+			ancestors[tagId] = found
+			for x in found:
+				descendants.setdefault(x, set([])).add(tagId)
+
+		t2e = tagDict['t2e']
+		implied = {}
+		for tagId, tagIds in descendants.iteritems():
+			elements = t2e[tagId].copy()
+			for x in tagIds:
+				elements.update(t2e[x])
+			implied[tagId] = elements
+
+		tagDict['ancestors'] = ancestors
+		tagDict['descendants'] = descendants
+		tagDict['implied'] = implied
+
+		# Results of saved queries change with the elements of implied tags
+		if tagDict.get('saved'):
+			self.__refreshSavedQueries(tagDict)
+
+	def __updateImplied(self, tagDict, element, changed):
+		# Keep the elements of the implied tags up to date, when tags of an element change
+		ancestors = tagDict['ancestors']
+		descendants = tagDict['descendants']
+		implied = tagDict['implied']
+
+		affected = set([])
+		for tagId in changed:
+			affected.update(ancestors.get(tagId, ()))
+			if tagId in implied:
+				affected.add(tagId)
+
+		tagIds = tagDict['e2t'].get(element, set([]))
+		for tagId in affected:
+			if tagId in tagIds or len(descendants[tagId] & tagIds) > 0:
+				implied[tagId].add(element)
+			else:
+				implied[tagId].discard(element)
+
+	def __mergeImplications(self, tagDict, oldTagId, newTagId):
+		# Tags implied by and implying a tag merged into another one are moved to
+		# the other tag, unless they would make it imply itself
+		implies = tagDict.get('implies', {})
+		for tagId in implies.get(oldTagId, ()):
+			if tagId != newTagId and not self.__impliesTag(tagDict, tagId, newTagId):
+				implies.setdefault(newTagId, set([])).add(tagId)
+
+		for tagId, tagIds in implies.items():
+			if oldTagId in tagIds and tagId != newTagId and not self.__impliesTag(tagDict, newTagId, tagId):
+				tagIds.add(newTagId)
+
+	def __dropImplications(self, tagDict, tagId):
+		implies = tagDict['implies']
+		implies.pop(tagId, None)
+		for tagIds in implies.itervalues():
+			tagIds.discard(tagId)
+		self.__buildImplications(tagDict)
+
+	##### Indexes of tag names and of values of value tags
+
+	def __getValueKey(self, value):
+		if self.NUMBER_VALUE.match(value):
+			try:
+				return (0, int(value))
+			except ValueError:
+				return (0, float(value))
+		elif self.DATE_VALUE.match(value):
+			return (1, value)
+		else:
+			return (2, value)
+
+	def __indexValueTag(self, tagDict, tag, tagId):
+		if not self.__isValueTag(tag):
+			return
+
+		(name, value) = self.__convertToTuple(tag)
+		keys, ids = tagDict['values'].setdefault(name, ([], []))
+		key = self.__getValueKey(value)
+		i = bisect.bisect_right(keys, key)
+		keys.insert(i, key)
+		ids.insert(i, tagId)
+
+	def __unindexValueTag(self, tagDict, tag, tagId):
+		if not self.__isValueTag(tag):
+			return
+
+		(name, value) = self.__convertToTuple(tag)
+		keys, ids = tagDict['values'][name]
+		key = self.__getValueKey(value)
+		i = bisect.bisect_left(keys, key)
+		while ids[i] != tagId:
+			i = i + 1
+		del keys[i]
+		del ids[i]
+
+		if len(keys) == 0:
+			del tagDict['values'][name]
+
+	def __indexTag(self, tagDict, tag, tagId):
+		bisect.insort(tagDict['sortedTags'], tag)
+		self.__indexValueTag(tagDict, tag, tagId)
+
+	def __unindexTag(self, tagDict, tag, tagId):
+		sortedTags = tagDict['sortedTags']
+		del sortedTags[bisect.bisect_left(sortedTags, tag)]
+		self.__unindexValueTag(tagDict, tag, tagId)
+
+	def __buildNameIndexes(self, tagDict):
+		tagDict['sortedTags'] = sorted(tagDict['tags'].keys())
+		tagDict['values'] = {}
+		for tag, tagId in tagDict['tags'].iteritems():
+			self.__indexValueTag(tagDict, tag, tagId)
+
+	def __findPrefixTags(self, tagDict, prefix):
+		sortedTags = tagDict['sortedTags']
+		start = bisect.bisect_left(sortedTags, prefix)
+		end = start
+		while end < len(sortedTags) and sortedTags[end].startswith(prefix):
+			end = end + 1
+		return sortedTags[start:end]
+
+	def __findTermTags(self, tagDict, term):
+		# Ids of the tags selected by a term, None if it is not a term
+		match = self.VALUE_TERM.match(term)
+		if not match:
+			match = self.PREFIX_TERM.match(term)
+			if not match:
+				return None
+
+			tags = tagDict['tags']
+			return [tags[x] for x in self.__findPrefixTags(tagDict, match.group(1))]
+
+		(name, op, value) = match.groups()
+		keys, ids = tagDict['values'].get(name, ([], []))
+
+		if op == '=' and value.endswith('*'):
+			# Prefix of the values which are not numbers
+			prefix = value[:-1]
+			found = []
+			for valueType in (1, 2):
+				i = bisect.bisect_left(keys, (valueType, prefix))
+				while i < len(keys) and keys[i][0] == valueType and keys[i][1].startswith(prefix):
+					found.append(ids[i])
+					i = i + 1
+			return found
+
+		# Values are only compared with values of the same type
+		key = self.__getValueKey(value)
+		if op == '=':
+			return ids[bisect.bisect_left(keys, key):bisect.bisect_right(keys, key)]
+		elif op == '>':
+			return ids[bisect.bisect_right(keys, key):bisect.bisect_left(keys, (key[0] + 1,))]
+		elif op == '>=':
+			return ids[bisect.bisect_left(keys, key):bisect.bisect_left(keys, (key[0] + 1,))]
+		elif op == '<':
+			return ids[bisect.bisect_left(keys, (key[0],)):bisect.bisect_left(keys, key)]
+		else:
+			return ids[bisect.bisect_left(keys, (key[0],)):bisect.bisect_right(keys, key)]
+
+	def __resolveAtoms(self, tagDict, atoms):
+		# Ids of the tags, and the searches and attribute terms, making up an alternative
+		# of a query. Atoms which are neither tags nor terms select nothing.
+		tags = tagDict['tags']
+		tagIds = set([])
+		elementTerms = set([])
+		for atom in atoms:
+			if atom in tags:
+				tagIds.add(tags[atom])
+			elif atom.startswith(self.SEARCH_TERM_PREFIX):
+				elementTerms.add(atom)
+			else:
+				tagIds.update(self.__findTermTags(tagDict, atom) or [])
+
+		return (tuple(sorted(tagIds)), tuple(sorted(elementTerms)))
+
+	def __getAlternativeElements(self, tagDict, alternative):
+		(tagIds, elementTerms) = alternative
+		if len(tagIds) == 1 and len(elementTerms) == 0:
+			return self.__getPosting(tagDict, tagIds[0])
+
+		elements = set([])
+		for tagId in tagIds:
+			elements.update(self.__getPosting(tagDict, tagId))
+		for term in elementTerms:
+			if term.startswith(self.SAVED_TERM_PREFIX):
+				found = tagDict.get('saved', {}).get(term[len(self.SAVED_TERM_PREFIX):], (None, ()))[1]
+			else:
+				found = self.__findAttributeElements(tagDict, term)
+				if found is None:
+					found = self.__searchElements(tagDict, term[len(self.SEARCH_TERM_PREFIX):])
+			elements.update(found)
+		return elements
+
+	def __evaluateQuery(self, tagDict, tagList):
+		# Set of the elements selected by all the components of a path, see L{Query}.
+		# The set belongs to the caller.
+		tags = tagDict['tags']
+		if len(tagList) == 1 and tagList[0] in tags:
+			return self.__getPosting(tagDict, tags[tagList[0]]).copy()
+
+		# Results of saved queries are kept up to date, they are never worked out here
+		saved = tagDict.get('saved', {})
+		if len(tagList) == 1 and tagList[0].startswith(self.SAVED_TERM_PREFIX) and \
+				tagList[0][len(self.SAVED_TERM_PREFIX):] in saved:
+			return saved[tagList[0][len(self.SAVED_TERM_PREFIX):]][1].copy()
+
+		# Results are cached by the ids of the tags in the query, so that renaming
+		# a tag does not change them. The cache is emptied when the database changes.
+		key = self.__resolveQuery(tagDict, tagList)
+
+		generation = tagDict.get('generation', 0)
+		if generation != self.queryGeneration or len(self.queryCache) >= self.QUERY_CACHE_SIZE:
+			self.queryCache = {}
+			self.queryGeneration = generation
+
+		try:
+			return self.queryCache[key].copy()
+		except KeyError:
+			pass
+
+		elements = self.__computeQuery(tagDict, key)
+		self.queryCache[key] = elements
+		return elements.copy()
+
+	def __resolveQuery(self, tagDict, tagList):
+		# Query with the ids of its tags, as (alternatives required, alternative excluded)
+		positives, negatives = compileQuery(tagList, tagDict['tags'].has_key)
+		return (tuple(sorted([self.__resolveAtoms(tagDict, x) for x in positives])),
+				self.__resolveAtoms(tagDict, negatives))
+
+	def __computeQuery(self, tagDict, key):
+		# Set of the elements selected by a resolved query, not using the cache.
+		# Smallest sets are intersected first, negations are applied to the result
+		postings = [self.__getAlternativeElements(tagDict, x) for x in key[0]]
+		postings.sort(key=len)
+		if len(postings) > 0:
+			elements = self.__intersectPostings(postings)
+		else:
+			elements = set(tagDict['e2t'])
+
+		if len(elements) > 0 and key[1] != ((), ()):
+			elements.difference_update(self.__getAlternativeElements(tagDict, key[1]))
+
+		return elements
+
+	def __intersectPostings(self, postings):
+		elements = postings[0].copy()
+		for posting in postings[1:]:
+			elements.intersection_update(posting)
+		return elements
+
+	##### Sketches of tags
+
+	def __getChecksum(self, element):
+		return (zlib.crc32(repr(element)) & 0xffffffff) % self.MINHASH_PRIME
+
+	def __getElementHashes(self, element):
+		x = self.__getChecksum(element)
+		p = self.MINHASH_PRIME
+		return [(a * x + b) % p for (a, b) in self.MINHASH_COEFFICIENTS]
+
+	def __getBandKeys(self, values):
+		# Keys of the buckets of a signature in the LSH index, one for each band
+		rows = self.MINHASH_SIZE / self.LSH_BANDS
+		return [(band,) + tuple(values[band * rows:(band + 1) * rows]) for band in range(self.LSH_BANDS)]
+
+	def __indexSketch(self, tagDict, tagId):
+		values = tagDict['minhash'][tagId][0]
+		if values[0] == self.MINHASH_PRIME:
+			# Tag without elements
+			return
+		lsh = tagDict['lsh']
+		for key in self.__getBandKeys(values):
+			lsh.setdefault(key, set([])).add(tagId)
+
+	def __unindexSketch(self, tagDict, tagId):
+		values = tagDict['minhash'][tagId][0]
+		if values[0] == self.MINHASH_PRIME:
+			return
+		lsh = tagDict['lsh']
+		for key in self.__getBandKeys(values):
+			lsh[key].discard(tagId)
+			if len(lsh[key]) == 0:
+				del lsh[key]
+
+	def __computeSketch(self, tagDict, tagId):
+		# Signature of a tag worked out from all its elements, one hash function at a time
+		elements = list(tagDict['t2e'][tagId])
+		checksums = [self.__getChecksum(x) for x in elements]
+		p = self.MINHASH_PRIME
+		if len(elements) == 0:
+			tagDict['minhash'][tagId] = ([p] * self.MINHASH_SIZE, [None] * self.MINHASH_SIZE)
+			return
+
+		values = []
+		minElements = []
+		for (a, b) in self.MINHASH_COEFFICIENTS:
+			hashes = [(a * x + b) % p for x in checksums]
+			value = min(hashes)
+			values.append(value)
+			minElements.append(elements[hashes.index(value)])
+		tagDict['minhash'][tagId] = (values, minElements)
+
+	def __addToSketch(self, tagDict, tagId, element, hashes):
+		minhash = tagDict['minhash']
+		if tagId not in minhash:
+			minhash[tagId] = ([self.MINHASH_PRIME] * self.MINHASH_SIZE, [None] * self.MINHASH_SIZE)
+
+		values, elements = minhash[tagId]
+		changed = [i for i in range(self.MINHASH_SIZE) if hashes[i] < values[i]]
+		if len(changed) == 0:
+			return
+
+		self.__unindexSketch(tagDict, tagId)
+		for i in changed:
+			values[i] = hashes[i]
+			elements[i] = element
+		self.__indexSketch(tagDict, tagId)
+
+	def __removeFromSketch(self, tagDict, tagId, element):
+		# A signature losing one of its elements is worked out again when the database
+		# is written, see L{__refreshSketches}
+		for x in tagDict['minhash'].get(tagId, ((), ()))[1]:
+			if x is not None and x == element:
+				tagDict.setdefault('staleSketches', set([])).add(tagId)
+				return
+
+	def __refreshSketches(self, tagDict):
+		for tagId in tagDict.pop('staleSketches', ()):
+			if tagId in tagDict['t2e']:
+				self.__unindexSketch(tagDict, tagId)
+				self.__computeSketch(tagDict, tagId)
+				self.__indexSketch(tagDict, tagId)
+
+	def __dropSketch(self, tagDict, tagId):
+		if tagId in tagDict['minhash']:
+			self.__unindexSketch(tagDict, tagId)
+			del tagDict['minhash'][tagId]
+		tagDict.get('staleSketches', set([])).discard(tagId)
+
+	def __getSignature(self, tagDict, tagIds):
+		# Signature of the union of the elements of some tags, along with the tags implying them
+		minhash = tagDict['minhash']
+		descendants = tagDict.get('descendants', {})
+		values = [self.MINHASH_PRIME] * self.MINHASH_SIZE
+		for tagId in set(tagIds).union(*[descendants.get(x, ()) for x in tagIds]):
+			if tagId in minhash:
+				values = map(min, values, minhash[tagId][0])
+		return values
+
+	def __estimateIntersection(self, tagDict, tagIds):
+		# Number of elements having all the tags. The fraction of hash functions whose
+		# smallest value is the same for all the tags estimates the fraction of the elements
+		# of any of the tags which have all of them
+		signatures = [self.__getSignature(tagDict, [x]) for x in tagIds]
+		union = map(min, *signatures)
+		same = len([i for i in range(self.MINHASH_SIZE)
+				if len([x for x in signatures if x[i] != union[i]]) == 0])
+
+		# The smallest of n random values below MINHASH_PRIME is about MINHASH_PRIME / (n + 1),
+		# which estimates the number of elements of any of the tags
+		sizes = [len(self.__getPosting(tagDict, x)) for x in tagIds]
+		unionSize = (self.MINHASH_SIZE - 1) * float(self.MINHASH_PRIME) / max(sum(union), 1)
+		unionSize = min(max(unionSize, max(sizes)), sum(sizes))
+
+		return int(round(min(unionSize * same / self.MINHASH_SIZE, min(sizes))))
+
+	def __sampleElements(self, tagDict, tagIds, elements):
+		# Elements of a set which are in the signatures of some tags. Each hash function
+		# picks an element of a tag at random, those in the set are a sample of the set.
+		# None if the sample is too small
+		minhash = tagDict['minhash']
+		descendants = tagDict.get('descendants', {})
+		sample = set([])
+		for tagId in set(tagIds).union(*[descendants.get(x, ()) for x in tagIds]):
+			for x in minhash.get(tagId, ((), ()))[1]:
+				if x is not None and x in elements:
+					sample.add(x)
+
+		if len(sample) < self.APPROXIMATE_MIN_SAMPLE:
+			return None
+		return sample
+
+	##### Views
+
+	def __buildViews(self, tagDict, views):
+		for key in ['untagged', 'cooc', 'sole', 'grams', 'minhash', 'lsh', 'staleSketches']:
+			tagDict.pop(key, None)
+		tagDict['views'] = [x for x in self.VIEWS if x in views]
+
+		if 'root' in views:
+			tagDict['untagged'] = set([e for (e, tagIds) in tagDict['e2t'].iteritems() if len(tagIds) == 0])
+
+		if 'tags' in views:
+			cooc = {}
+			sole = {}
+			for element, tagIds in tagDict['e2t'].iteritems():
+				if len(tagIds) == 1:
+					for tagId in tagIds:
+						sole.setdefault(tagId, set([])).add(element)
+					continue
+
+				for tagId in tagIds:
+					counts = cooc.setdefault(tagId, {})
+					for otherTagId in tagIds:
+						if otherTagId != tagId:
+							counts[otherTagId] = counts.get(otherTagId, 0) + 1
+
+			tagDict['cooc'] = cooc
+			tagDict['sole'] = sole
+
+		if 'search' in views:
+			tagDict['grams'] = {}
+			for element in tagDict['e2t']:
+				self.__indexElementName(tagDict, element)
+
+		if 'sketches' in views:
+			tagDict['minhash'] = {}
+			tagDict['lsh'] = {}
+			for tagId in tagDict['t2e']:
+				self.__computeSketch(tagDict, tagId)
+				self.__indexSketch(tagDict, tagId)
+
+	def __getGrams(self, text):
+		n = self.GRAM_LENGTH
+		return set([text[i:i + n] for i in range(len(text) - n + 1)])
+
+	def __indexElementName(self, tagDict, element):
+		grams = tagDict['grams']
+		for gram in self.__getGrams(self.getElementName(element).lower()):
+			try:
+				grams[gram].add(element)
+			except KeyError:
+				grams[gram] = set([element])
+
+	def __unindexElementName(self, tagDict, element):
+		grams = tagDict['grams']
+		for gram in self.__getGrams(self.getElementName(element).lower()):
+			grams[gram].discard(element)
+			if len(grams[gram]) == 0:
+				del grams[gram]
+
+	def __searchElements(self, tagDict, text):
+		# Elements whose names contain the text, ignoring case. Candidates are found from
+		# the sequences of characters of the text, and checked against the text.
+		text = text.lower()
+		grams = self.__getGrams(text)
+		if 'grams' in tagDict and len(grams) > 0:
+			postings = [tagDict['grams'].get(x, set([])) for x in grams]
+			postings.sort(key=len)
+			candidates = self.__intersectPostings(postings)
+		else:
+			candidates = tagDict['e2t']
+
+		return set([x for x in candidates if text in self.getElementName(x).lower()])
+
+	def __incCooc(self, cooc, tagId, otherTagId):
+		counts = cooc.setdefault(tagId, {})
+		counts[otherTagId] = counts.get(otherTagId, 0) + 1
+
+	def __decCooc(self, cooc, tagId, otherTagId):
+		counts = cooc[tagId]
+		counts[otherTagId] = counts[otherTagId] - 1
+		if counts[otherTagId] == 0:
+			del counts[otherTagId]
+			if len(counts) == 0:
+				del cooc[tagId]
+
+	def __updateTagViews(self, tagDict, element, old, added, removed):
+		# Tags of the element change from old to (old - removed) | added
+		cooc = tagDict['cooc']
+		sole = tagDict['sole']
+
+		if len(old) == 1:
+			for tagId in old:
+				sole[tagId].discard(element)
+				if len(sole[tagId]) == 0:
+					del sole[tagId]
+
+		kept = old - removed
+		for tagId in removed:
+			for otherTagId in old:
+				if otherTagId != tagId:
+					self.__decCooc(cooc, tagId, otherTagId)
+					if otherTagId in kept:
+						self.__decCooc(cooc, otherTagId, tagId)
+
+		new = kept | added
+		for tagId in added:
+			for otherTagId in new:
+				if otherTagId != tagId:
+					self.__incCooc(cooc, tagId, otherTagId)
+					if otherTagId in kept:
+						self.__incCooc(cooc, otherTagId, tagId)
+
+		if len(new) == 1:
+			for tagId in new:
+				sole.setdefault(tagId, set([])).add(element)
+
+	def __changeElement(self, tagDict, element, added=(), removed=(), drop=False):
+		# Add and remove tags of an element, keeping t2e and the views up to date.
+		# If drop is True the element is deleted when it is left without tags.
+		e2t = tagDict['e2t']
+		t2e = tagDict['t2e']
+
+		old = e2t.get(element)
+		new = old is None
+		if new:
+			old = set([])
+			e2t[element] = old
+
+		added = set(added).difference(old)
+		removed = old.intersection(removed)
+
+		if 'cooc' in tagDict:
+			self.__updateTagViews(tagDict, element, old, added, removed)
+
+		for tagId in removed:
+			t2e[tagId].discard(element)
+		for tagId in added:
+			t2e[tagId].add(element)
+
+		old.difference_update(removed)
+		old.update(added)
+
+		if len(old) == 0 and drop:
+			del e2t[element]
+
+		if 'untagged' in tagDict:
+			if len(old) == 0 and not drop:
+				tagDict['untagged'].add(element)
+			else:
+				tagDict['untagged'].discard(element)
+
+		if 'grams' in tagDict:
+			if new and element in e2t:
+				self.__indexElementName(tagDict, element)
+			elif not new and element not in e2t:
+				self.__unindexElementName(tagDict, element)
+
+		if not new and element not in e2t and element in tagDict['e2a']:
+			self.__delElementAttributes(tagDict, element)
+
+		if 'minhash' in tagDict:
+			if len(added) > 0:
+				hashes = self.__getElementHashes(element)
+				for tagId in added:
+					self.__addToSketch(tagDict, tagId, element, hashes)
+			for tagId in removed:
+				self.__removeFromSketch(tagDict, tagId, element)
+
+		if tagDict.get('implied'):
+			self.__updateImplied(tagDict, element, added | removed)
+
+		if tagDict.get('saved'):
+			self.__updateSavedQueries(tagDict, element)
+
+	def __pruneTags(self, tagDict, tagIds, keepImplications=True):
+		# Delete the tags which are left without elements. Tags implying or implied by
+		# other tags are kept, unless keepImplications is False
+		implies = tagDict.get('implies', {})
+		implied = tagDict.get('implied', {})
+		for tagId in tagIds:
+			if tagId in tagDict['t2e'] and len(tagDict['t2e'][tagId]) == 0:
+				if keepImplications and (tagId in implies or tagId in implied):
+					continue
+				self.__delTag(tagDict, tagId)
+
+	def __upgradeTagDict(self, tagDict):
+		# Databases of older versions use tag names in 'e2t' and 't2e'.
+		# Give the tags ids, the dictionary is changed in place.
+		if 'tags' in tagDict:
+			if 'sortedTags' not in tagDict:
+				self.__buildNameIndexes(tagDict)
+			return
+
+		tags = {}
+		names = {}
+		t2e = {}
+		for tag, elements in tagDict['t2e'].items():
+			tags[tag] = len(names)
+			names[len(names)] = tag
+			t2e[tags[tag]] = elements
+
+		e2t = {}
+		for element, elementTags in tagDict['e2t'].items():
+			for tag in elementTags:
+				if tag not in tags:
+					tags[tag] = len(names)
+					names[len(names)] = tag
+					t2e[tags[tag]] = set([])
+				t2e[tags[tag]].add(element)
+			e2t[element] = set([tags[x] for x in elementTags])
+
+		tagDict['e2t'] = e2t
+		tagDict['t2e'] = t2e
+		tagDict['tags'] = tags
+		tagDict['names'] = names
+		tagDict['nextTagId'] = len(names)
+		tagDict.setdefault('e2a', {})
+		self.__buildNameIndexes(tagDict)
+
+	def __getTagIds(self, tagDict, tagList):
+		# Ids of the given tags, tags which do not exist are left out
+		tags = tagDict['tags']
+		return [tags[x] for x in tagList if x in tags]
+
+	def __getTagNames(self, tagDict, tagIds):
+		names = tagDict['names']
+		return [names[x] for x in tagIds]
+
+	def __addTag(self, tagDict, tag):
+		# Get the id of a tag, creating the tag if required
+		try:
+			return tagDict['tags'][tag]
+		except KeyError:
+			tagId = tagDict['nextTagId']
+			tagDict['nextTagId'] = tagId + 1
+			tagDict['tags'][tag] = tagId
+			tagDict['names'][tagId] = tag
+			tagDict['t2e'][tagId] = set([])
+			self.__indexTag(tagDict, tag, tagId)
+			return tagId
+
+	def __delTag(self, tagDict, tagId):
+		tag = tagDict['names'][tagId]
+		if tagId in tagDict.get('implies', {}) or tagId in tagDict.get('implied', {}):
+			self.__dropImplications(tagDict, tagId)
+		if 'minhash' in tagDict:
+			self.__dropSketch(tagDict, tagId)
+		del tagDict['t2e'][tagId]
+		del tagDict['tags'][tag]
+		self.__unindexTag(tagDict, tag, tagId)
+
+	def __joinTagDict(self, tagDict, nameDict):
+		joined = dict(tagDict)
+		joined.update(nameDict)
+		return joined
+
+	def __splitTagDict(self, tagDict):
+		elementDict = dict([(k, v) for (k, v) in tagDict.items() if k not in self.NAME_KEYS])
+		nameDict = dict([(k, tagDict[k]) for k in self.NAME_KEYS])
+		return elementDict, nameDict
+
+	def __getTagDictRO(self):
+		# The table of names is read after the rest of the database, and written
+		# before it. So it has the names of all the tags in the database.
+		err, tagDict = self.tagDB.getDataRO()
+		if err != 0:
+			return err, {}
+
+		err, nameDict = self.nameDB.getDataRO()
+		if err != 0 or 'views' not in tagDict or 'a2e' not in tagDict or 'sortedTags' not in nameDict:
+			# Database of an older version. Upgrade it once, instead of on every read
+			err, tagDict = self.__getTagDictRW()
+			if err != 0:
+				return err, {}
+			self.__writeTagDict(tagDict)
+			return err, tagDict
+
+		return err, self.__joinTagDict(tagDict, nameDict)
+
 	##### Functions for implementing write cache
 	
+	def __getBothDictsRW(self):
+		err, tagDict = self.tagDB.getDataRW()
+		if err != 0:
+			self.tagDB.releaseData()
+			return err, tagDict
+
+		err, nameDict = self.nameDB.getDataRW()
+		if err != 0:
+			# Database of an older version, without the table of names
+			nameDict = {}
+
+		try:
+			tagDict = self.__joinTagDict(tagDict, nameDict)
+			self.__upgradeTagDict(tagDict)
+			if 'views' not in tagDict:
+				self.__buildViews(tagDict, self.VIEWS)
+			if 'a2e' not in tagDict:
+				self.__buildAttributeIndexes(tagDict)
+		except:
+			self.__releaseBothDicts()
+			raise
+		return 0, tagDict
+
+	def __writeBothDicts(self, tagDict):
+		try:
+			if 'staleSketches' in tagDict:
+				self.__refreshSketches(tagDict)
+			tagDict['generation'] = tagDict.get('generation', 0) + 1
+			elementDict, nameDict = self.__splitTagDict(tagDict)
+			self.nameDB.writeData(nameDict)
+		except:
+			self.__releaseBothDicts()
+			raise
+		self.tagDB.writeData(elementDict)
+
+	def __releaseBothDicts(self):
+		# Locks which are not held are left alone
+		self.nameDB.releaseData()
+		self.tagDB.releaseData()
+
+	def __useWriteCache(self):
+		return getattr(self.writeCache, 'tagDict', None) is not None
+
 	def __getTagDictRW(self):
-		if self.useWriteCache:
-			return 0, self.tagDict
+		if self.__useWriteCache():
+			return 0, self.writeCache.tagDict
 		else:
-			return self.tagDB.getDataRW()
+			return self.__getBothDictsRW()
 	
 	def __writeTagDict(self, tagDict):
-		if self.useWriteCache:
-			self.tagDict = tagDict
+		if self.__useWriteCache():
+			self.writeCache.tagDict = tagDict
 		else:
-			self.tagDB.writeData(tagDict)
+			self.__writeBothDicts(tagDict)
+
+	def __releaseTagDict(self):
+		# Give up the database got by __getTagDictRW when a change fails
+		if not self.__useWriteCache():
+			self.__releaseBothDicts()
 
 	def setWriteCaching(self):
-		self.useWriteCache = True
-		err, self.tagDict = self.tagDB.getDataRW()
+		# The database stays locked till doneWriteCaching
+		err, tagDict = self.__getBothDictsRW()
+		if err == 0:
+			self.writeCache.tagDict = tagDict
 
 	def doneWriteCaching(self):
-		self.useWriteCache = False	
-		self.tagDB.writeData(self.tagDict)
+		if self.__useWriteCache():
+			tagDict = self.writeCache.tagDict
+			self.writeCache.tagDict = None
+			self.__writeBothDicts(tagDict)
 
 	##### Book keeping operations
 
@@ -155,8 +1247,52 @@ class Tagging:
 			return
 
 		self.tagDB = GPStor(db_path=self.db_path, db_file=self.db_file)
+		self.nameDB = GPStor(db_path=self.db_path, db_file=self.db_file + self.NAMES_SUFFIX)
+
+		# The contents of a new database cannot be read, lock it without reading
+		tagDict = self.__newTagDict()
 		self.tagDB.getDataRW()
-		self.tagDB.writeData({ 'e2t' : {}, 't2e' : {}, 'e2a' : {} })
+		self.nameDB.getDataRW()
+		self.__writeBothDicts(tagDict)
+
+	def setViews(self, views=VIEWS):
+		"""
+		T.setViews(views) -> Choose the views kept up to date in the database
+
+		Views make listing the elements which are not tagged, and the tags and elements of a
+		single tag, independent of the size of the database. They are updated with every
+		change of tags, which makes changes slower. They are stored in the database, so
+		they are available as soon as the database is opened.
+
+		The views are built from the database when they are set.
+
+		@param views: Names of the views, from L{VIEWS}. Defaults to all the views
+		@type views: List of str
+		"""
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return
+
+		try:
+			self.__buildViews(tagDict, views)
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def getViews(self):
+		"""
+		T.getViews() -> Get the names of the views kept up to date in the database
+
+		@rtype: List of str
+		"""
+
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return []
+
+		return list(tagDict['views'])
 
 	###### Add, Delete, Rename tags
 
@@ -178,28 +1314,71 @@ class Tagging:
 		err, tagDict = self.__getTagDictRW()
 		if err != 0:
 			return
-		
-		# Remove blank tags
-		newTagList = [x for x in newTagList if x != '']
 
-		# Create element to tag mapping
-		for element in elementList:
-			try:
-				tagDict['e2t'][element].update(newTagList)
-			except KeyError:
-				tagDict['e2t'][element] = set(newTagList)
+		try:
+			# Remove blank tags
+			newTagList = [x for x in newTagList if x != '']
+			tagIds = [self.__addTag(tagDict, tag) for tag in newTagList]
 
-		# Create tag to element mapping
-		# Do not store the value part of the tag in the tag to element mapping
+			for element in elementList:
+				self.__changeElement(tagDict, element, added=tagIds)
 
-		for tag in newTagList:
-			try:
-				tagDict['t2e'][tag].update(elementList)
-			except KeyError:
-				tagDict['t2e'][tag] = set(elementList)
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def tagElements(self, tagMap, replaceValues=False):
+		"""
+		T.tagElements(tagMap, replaceValues) -> Associate tags with elements which exist, in a single update of the database
+
+		Elements which do not exist, like those deleted after the tags were worked out,
+		are left alone.
+
+		@param tagMap: Dictionary mapping elements to lists of tags to associate with them
+		@type tagMap: C{dict}
+
+		@param replaceValues: If True the value tags given replace the value tags of the elements
+			with the same name, e.g. 'size:small' replaces 'size:tiny'
+		@type replaceValues: bool
+
+		@return: Tags which were replaced and are left without elements, and so deleted
+		@rtype: List of str
+		"""
+
+		if len(tagMap) == 0:
+			return []
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return []
+
+		try:
+			names = tagDict['names']
+			deleted = []
+			for element, tags in tagMap.items():
+				if element not in tagDict['e2t']:
+					continue
+
+				tags = [x for x in tags if x != '']
+				tagIds = [self.__addTag(tagDict, tag) for tag in tags]
+
+				removed = []
+				if replaceValues:
+					valueNames = set([self.__removeValueFromTag(x) for x in tags if self.__isValueTag(x)])
+					removed = [x for x in tagDict['e2t'][element] if x not in tagIds and
+							self.__isValueTag(names[x]) and self.__removeValueFromTag(names[x]) in valueNames]
+
+				self.__changeElement(tagDict, element, added=tagIds, removed=removed)
+				deleted.extend([names[x] for x in removed if len(tagDict['t2e'][x]) == 0])
+				self.__pruneTags(tagDict, removed)
+
+			self.__writeTagDict(tagDict)
+			return deleted
+		except:
+			self.__releaseTagDict()
+			raise
 
-		self.__writeTagDict(tagDict)
-	
 	# delete Elements
 	def delElementsFromTags(self, elementList, tagList = []):
 		"""
@@ -210,37 +1389,36 @@ class Tagging:
 
 		@param tagList: List of tags to delete from elements. Defaults to an empty list. Empty list means all tags.
 		@type tagList: List
+
+		Elements left without tags and tags left without elements are removed.
 		"""
 
 		err, tagDict = self.__getTagDictRW()
 		if err != 0:
 			return
 
-		if len(tagList) == 0:
-			for tag in tagDict['t2e'].keys():
-				tagDict['t2e'][tag].difference_update(elementList)
-
-			for element in elementList:
-				try:
-					del tagDict['e2t'][element]
-				except KeyError:
-					pass
-		else:
-			for tag in tagList:
-				try:
-					tagDict['t2e'][tag].difference_update(elementList)
-				except KeyError:
-					pass
-
-			for element in elementList:
-				try:
-					tagDict['e2t'][element].difference_update(tagList)
-					if len(tagDict['e2t'][element]) == 0:
-						del tagDict['e2t'][element]
-				except KeyError:
-					pass
-
-		self.__writeTagDict(tagDict)
+		try:
+			e2t = tagDict['e2t']
+
+			if len(tagList) == 0:
+				# Only the tags of the elements are affected
+				affectedTagIds = set([])
+				for element in elementList:
+					if element in e2t:
+						tagIds = list(e2t[element])
+						affectedTagIds.update(tagIds)
+						self.__changeElement(tagDict, element, removed=tagIds, drop=True)
+			else:
+				affectedTagIds = self.__getTagIds(tagDict, tagList)
+				for element in elementList:
+					if element in e2t:
+						self.__changeElement(tagDict, element, removed=affectedTagIds, drop=True)
+
+			self.__pruneTags(tagDict, affectedTagIds)
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
 	
 	# delete tags from the DB
 	def delTagsFromElements(self, tagList, elementList = []):
@@ -252,41 +1430,46 @@ class Tagging:
 
 		@param tagList: List of tags to delete from elements.
 		@type tagList: List
+
+		Tags left without elements are removed. Elements left without tags are kept, they
+		are elements which are not tagged. Tags deleted from all the elements are removed
+		along with their implications, see L{setImpliedTags}.
 		"""
 		err, tagDict = self.__getTagDictRW()
 		if err != 0:
 			return
-		
-		if len(elementList) == 0:
-			for element in tagDict['e2t'].keys():
-				tagDict['e2t'][element].difference_update(tagList)
-
-			for tag in tagList:
-				try:
-					del tagDict['t2e'][tag]
-				except KeyError:
-					pass
-		else:
+
+		try:
+			e2t = tagDict['e2t']
+			t2e = tagDict['t2e']
+			tagIds = self.__getTagIds(tagDict, tagList)
+
+			allElements = len(elementList) == 0
+			if allElements:
+				# Only the elements with the tags are affected
+				elementList = set([])
+				for tagId in tagIds:
+					elementList.update(t2e[tagId])
+
 			for element in elementList:
-				try:
-					tagDict['e2t'][element].difference_update(tagList)
-				except KeyError:
-					pass
-
-			for tag in tagList:
-				try:
-					tagDict['t2e'][tag].difference_update(elementList)
-					if len(tagDict['t2e'][tag]) == 0:
-						del tagDict['t2e'][tag]
-				except KeyError:
-					pass
-
-		self.__writeTagDict(tagDict)
+				if element in e2t:
+					self.__changeElement(tagDict, element, removed=tagIds)
+
+			self.__pruneTags(tagDict, tagIds, keepImplications=not allElements)
+
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
 	
 	def renameTag(self, oldTagName, newTagName):
 		"""
 		T.renameTag(oldTagName, newTagName) -> rename a tag. Tag all the elements that were tagged with the old tag with newTagName
 
+		Only the name of the tag is changed if there is no tag named newTagName, irrespective
+		of the number of elements tagged with it. Otherwise the elements of the old tag are
+		added to the existing tag.
+
 		@param oldTagName: Old tag name
 		@type oldTagName: string
 
@@ -294,10 +1477,314 @@ class Tagging:
 		@type newTagName: string
 		"""
 
-		elementList = self.getElements(tagList=[oldTagName])
+		if not self.__useWriteCache():
+			err, nameDict = self.nameDB.getDataRO()
+			if err != 0 or 'sortedTags' not in nameDict:
+				# Upgrade the database of an older version
+				self.__getTagDictRO()
+
+			# The rest of the database is always locked before the table of names. It is only
+			# read here, the results of saved queries in it may change with the name
+			err, elementDict = self.tagDB.getDataRW()
+			if err != 0:
+				self.tagDB.releaseData()
+				return
+
+			err, nameDict = self.nameDB.getDataRW()
+			if err != 0:
+				self.nameDB.releaseData()
+				self.tagDB.releaseData()
+				return
+
+			try:
+				tags = nameDict['tags']
+				if oldTagName not in tags or oldTagName == newTagName or newTagName == '':
+					# Nothing to be done
+					self.__releaseBothDicts()
+					return
+
+				if newTagName not in tags and \
+						not self.__savedQueriesUseNames(elementDict.get('saved', {}), tags, [oldTagName, newTagName]):
+					# Only the table of names needs to be changed
+					tagId = tags.pop(oldTagName)
+					tags[newTagName] = tagId
+					nameDict['names'][tagId] = newTagName
+					self.__unindexTag(nameDict, oldTagName, tagId)
+					self.__indexTag(nameDict, newTagName, tagId)
+					self.nameDB.writeData(nameDict)
+					self.tagDB.releaseData()
+					return
+			except:
+				self.__releaseBothDicts()
+				raise
+
+			# The old tag is to be merged into the existing one, or saved queries updated
+			self.__releaseBothDicts()
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return
+
+		try:
+			oldTagId = tagDict['tags'].get(oldTagName)
+			newTagId = tagDict['tags'].get(newTagName)
+
+			if oldTagId is None or oldTagId == newTagId or newTagName == '':
+				pass
+			elif newTagId is None:
+				self.__renameInSavedQueries(tagDict, oldTagName, newTagName)
+				del tagDict['tags'][oldTagName]
+				tagDict['tags'][newTagName] = oldTagId
+				tagDict['names'][oldTagId] = newTagName
+				self.__unindexTag(tagDict, oldTagName, oldTagId)
+				self.__indexTag(tagDict, newTagName, oldTagId)
+			else:
+				# Merge the old tag into the existing one
+				self.__renameInSavedQueries(tagDict, oldTagName, newTagName)
+				for element in list(tagDict['t2e'][oldTagId]):
+					self.__changeElement(tagDict, element, added=[newTagId], removed=[oldTagId])
+				self.__mergeImplications(tagDict, oldTagId, newTagId)
+				self.__delTag(tagDict, oldTagId)
+
+			if tagDict.get('saved'):
+				self.__refreshSavedQueries(tagDict)
+
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def replaceElements(self, elementMap):
+		"""
+		T.replaceElements(elementMap) -> Replace elements by other elements. The replacing elements get the tags of the replaced ones
+
+		All the replacements are done in a single update of the database
+
+		@param elementMap: Dictionary mapping the elements to be replaced to the elements replacing them
+		@type elementMap: C{dict}
+		"""
+
+		if len(elementMap) == 0:
+			return
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return
+
+		try:
+			for oldElement, newElement in elementMap.items():
+				if oldElement not in tagDict['e2t']:
+					continue
+
+				tagIds = list(tagDict['e2t'][oldElement])
+				attributes = self.__delElementAttributes(tagDict, oldElement)
+				self.__changeElement(tagDict, oldElement, removed=tagIds, drop=True)
+				self.__changeElement(tagDict, newElement, added=tagIds)
+
+				if len(attributes) > 0:
+					self.__setElementAttributes(tagDict, newElement, attributes)
+
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def setAttributes(self, attributeMap):
+		"""
+		T.setAttributes(attributeMap) -> Set attributes of elements
+
+		Attributes are values, like the size of an element, kept along with the element and
+		deleted with it. Attributes in L{INDEXED_ATTRIBUTES} are indexed, and elements can be
+		selected by their values with terms like '//size>1024' in tagList, see L{getElements}.
+		Values of an attribute are to be of the same type for all the elements.
+
+		All the attributes are set in a single update of the database. Attributes of elements
+		which do not exist are not set.
+
+		@param attributeMap: Dictionary mapping elements to dictionaries of attributes and their
+			values. Attributes whose value is None are removed
+		@type attributeMap: C{dict}
+		"""
+
+		if len(attributeMap) == 0:
+			return
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return
+
+		try:
+			for element, attributes in attributeMap.items():
+				if element in tagDict['e2t']:
+					self.__setElementAttributes(tagDict, element, attributes)
+
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def getAttributes(self, element):
+		"""
+		T.getAttributes(element) -> Get the attributes of an element
+
+		@param element: Element whose attributes are to be got
+		@type element: Object
+
+		@return: Dictionary of attributes and their values, empty if the element has none
+		@rtype: C{dict}
+		"""
+
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return {}
+
+		return dict(tagDict['e2a'].get(element, {}))
+
+	def saveQuery(self, name, tagList):
+		"""
+		T.saveQuery(name, tagList) -> Save a query under a name
+
+		The elements selected by the query are kept with it, and are kept up to date every
+		time elements are tagged, so that getting them does not run the query. They are
+		selected with the term '//@name' in tagList, see L{getElements}. A query saved
+		earlier under the name is replaced. Tags named in the query are followed when
+		they are renamed.
+
+		@param name: Name of the query
+		@type name: str
 
-		self.delTagsFromElements(elementList=[], tagList=[oldTagName])
-		self.addTags(elementList, [newTagName])
+		@param tagList: Query, like the tagList of L{getElements}. It cannot refer to saved queries
+		@type tagList: List
+
+		@return: True if the query was saved, False otherwise
+		@rtype: bool
+		"""
+
+		if name == '' or len([x for x in tagList if self.SAVED_TERM_PREFIX in x]) > 0:
+			return False
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return False
+
+		try:
+			elements = self.__computeQuery(tagDict, self.__resolveQuery(tagDict, tagList))
+			tagDict.setdefault('saved', {})[name] = (list(tagList), elements)
+			self.savedQueryCache.pop(name, None)
+
+			self.__writeTagDict(tagDict)
+			return True
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def deleteQuery(self, name):
+		"""
+		T.deleteQuery(name) -> Delete a saved query
+
+		@param name: Name of the query
+		@type name: str
+		"""
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return
+
+		try:
+			tagDict.get('saved', {}).pop(name, None)
+			self.savedQueryCache.pop(name, None)
+
+			self.__writeTagDict(tagDict)
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def setImpliedTags(self, tag, impliedTags):
+		"""
+		T.setImpliedTags(tag, impliedTags) -> Set the tags implied by a tag
+
+		Elements of a tag are also elements of the tags it implies, and of the tags implied
+		by those in turn, without being tagged with them. If 'jazz' implies 'music' and
+		'music' implies 'media', getElements(['media']) has the elements tagged with any of
+		the three. The elements of each implied tag are kept up to date as elements are
+		tagged and as implications change, so queries do not go through the implications.
+		Tags which do not exist are created.
+
+		@param tag: Tag implying the other tags
+		@type tag: str
+
+		@param impliedTags: Tags implied by tag directly, replacing those set earlier. An empty
+			list removes the implications of tag
+		@type impliedTags: List
+
+		@return: True if the implications were set, False if tag would imply itself
+		@rtype: bool
+		"""
+
+		if tag == '':
+			return False
+
+		impliedTags = [x for x in impliedTags if x != '']
+
+		err, tagDict = self.__getTagDictRW()
+		if err != 0:
+			return False
+
+		try:
+			# Only tags which exist can imply the tag
+			tags = tagDict['tags']
+			if tag in impliedTags or (tag in tags and
+					len([x for x in impliedTags if x in tags and self.__impliesTag(tagDict, tags[x], tags[tag])]) > 0):
+				self.__writeTagDict(tagDict)
+				return False
+
+			tagId = self.__addTag(tagDict, tag)
+			tagIds = set([self.__addTag(tagDict, x) for x in impliedTags])
+			tagDict.setdefault('implies', {})[tagId] = tagIds
+			self.__buildImplications(tagDict)
+
+			self.__writeTagDict(tagDict)
+			return True
+		except:
+			self.__releaseTagDict()
+			raise
+
+	def getImpliedTags(self, tag, transitive=False):
+		"""
+		T.getImpliedTags(tag, transitive) -> Get the tags implied by a tag, see L{setImpliedTags}
+
+		@param tag: Tag implying the other tags
+		@type tag: str
+
+		@param transitive: If True also get the tags implied through other tags
+		@type transitive: bool
+
+		@rtype: C{list}
+		"""
+
+		err, tagDict = self.__getTagDictRO()
+		if err != 0 or tag not in tagDict['tags']:
+			return []
+
+		if transitive:
+			tagIds = tagDict.get('ancestors', {}).get(tagDict['tags'][tag], ())
+		else:
+			tagIds = tagDict.get('implies', {}).get(tagDict['tags'][tag], ())
+		return sorted(self.__getTagNames(tagDict, tagIds))
+
+	def getSavedQueries(self):
+		"""
+		T.getSavedQueries() -> Get the saved queries
+
+		@return: Dictionary mapping names of the queries to the queries
+		@rtype: C{dict}
+		"""
+
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return {}
+
+		return dict([(name, list(tagList)) for (name, (tagList, elements)) in tagDict.get('saved', {}).items()])
 
 	####### Get tagging information
 
@@ -317,11 +1804,13 @@ class Tagging:
 		@rtype: C{dict}
 		"""
 		
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return {}
 
-		return tagDict['e2t'].copy()
+		names = tagDict['names']
+		return dict([(element, set([names[x] for x in tagIds]))
+				for element, tagIds in tagDict['e2t'].iteritems()])
 			
 	# Get a python dictionary which contains list of elements for each tag
 	def getElementsDict(self):
@@ -338,11 +1827,12 @@ class Tagging:
 		@return: Dictionary of element to tag mapping
 		@rtype: C{dict}
 		"""
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return {}
 
-		return tagDict['t2e'].copy()
+		names = tagDict['names']
+		return dict([(names[tagId], elements) for tagId, elements in tagDict['t2e'].iteritems()])
 
 	# Get all the tags associated with the given elements
 	def getTagsForElements(self, elementList=[], filterList=[], filter=None):
@@ -363,19 +1853,17 @@ class Tagging:
 		@return: List of tags
 		@rtype: C{list}
 		"""
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return []
 
 		if len(elementList) == 0:
-			return tagDict['t2e'].keys()
+			return tagDict['tags'].keys()
 
 		# Each element is associated with a list of tags
 		# Get an union of all the tags associated with the elements
 		# in the list
 		#
-		# Do not use the value part of the tag
-		#
 		# s1.update Updates a set with the union of itself and another
 		s1 = tagDict['e2t'].get(elementList[0], set([])).copy()
 
@@ -385,6 +1873,8 @@ class Tagging:
 			except KeyError:
 				pass
 
+		s1 = set(self.__getTagNames(tagDict, s1))
+
 		if filter == 'in':
 			s1.intersection_update(filterList)
 		elif filter == 'not_in':
@@ -451,6 +1941,11 @@ class Tagging:
 			with the given set of tags, it would be useful to find tags that would restrict
 			the set set of elements further.
 
+			When there are more than L{APPROXIMATE_THRESHOLD} elements and approximate is set,
+			the tags are found from the elements picked by the MinHash signatures of the given
+			tags, instead of from all the elements. Tags of few of the elements may then be
+			left out, their elements are returned along with the elements of no tag.
+
 			Defaults to False
 
 		@type beRestrictive: bool
@@ -470,55 +1965,266 @@ class Tagging:
 		@rtype: C{(List, List)}
 		"""
 
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return [], []
 
+		e2t = tagDict['e2t']
+		t2e = tagDict['t2e']
+		cooc = tagDict.get('cooc')
+		implied = tagDict.get('implied', {})
+		tagIds = self.__getTagIds(tagDict, tagList)
+		sample = None
+
+		# Listings of the root and of single tags are got from the views, when they are kept.
+		# The views do not have the elements of tags implying a tag.
 		if len(tagList) == 0:
-			retTagList = tagDict['t2e'].keys()
-			intersection_set = set(tagDict['e2t'].keys())
+			retTagList = t2e.keys()
+			useView = 'untagged' in tagDict
+			intersection_set = None
+			intersection_set_len = len(e2t)
+		elif len(tagIds) == 1 and len(tagList) == 1 and cooc is not None and tagIds[0] not in implied:
+			counts, viewCounts = self.__getViewCounts(tagDict, tagIds[0])
+			retTagList = counts.keys()
+			useView = True
+			intersection_set = None
+			intersection_set_len = len(t2e[tagIds[0]])
 		else:
-			intersection_set = tagDict['t2e'].get(tagList[0], set([])).copy()
+			useView = False
+			intersection_set = self.__evaluateQuery(tagDict, tagList)
 
-			for tag in tagList[1:]:
-				try:
-					intersection_set.intersection_update(tagDict['t2e'][tag])
-				except KeyError:
-					intersection_set.clear()
+			# Tags restricting many elements are found from a sample of the elements
+			if beRestrictive and self.approximate and 'minhash' in tagDict and \
+					len(intersection_set) > self.APPROXIMATE_THRESHOLD:
+				sample = self.__sampleElements(tagDict, tagIds, intersection_set)
 
 			retTagSet = set([])
-			for e in intersection_set:
-				retTagSet.update(tagDict['e2t'][e])
+			for e in sample or intersection_set:
+				retTagSet.update(e2t[e])
+
+			# Tags implied by the tags of the elements
+			ancestors = tagDict.get('ancestors')
+			if ancestors:
+				for tagId in list(retTagSet):
+					retTagSet.update(ancestors.get(tagId, ()))
 				
-			retTagSet.difference_update(tagList)
+			retTagSet.difference_update(tagIds)
 			retTagList = list(retTagSet)
+			intersection_set_len = len(intersection_set)
 
 		if beRestrictive:
 			if len(tagList) != 0:
-				intersection_set_len = len(intersection_set)
-				retTagList = [x for x in retTagList
-						if len(tagDict['t2e'][x] & intersection_set) < intersection_set_len]
+				if useView:
+					retTagList = [x for x in retTagList if counts[x] < intersection_set_len]
+
+					# Elements of the tags in the view left out, which have all the elements,
+					# may not be in any of the returned tags. The view does not have them.
+					useView = len([x for x in viewCounts if counts[x] < intersection_set_len]) == len(viewCounts)
+				elif sample is not None:
+					# Tags having all the elements of the sample are taken to have all the elements
+					retTagList = [x for x in retTagList
+							if len(sample - self.__getPosting(tagDict, x)) > 0]
+				else:
+					retTagList = [x for x in retTagList
+							if len(self.__getPosting(tagDict, x) & intersection_set) < intersection_set_len]
 		elif getCover:
 			l = retTagList
-			l.sort(key = lambda x: len(tagDict['t2e'][x]), reverse = True)
+			l.sort(key = lambda x: len(self.__getPosting(tagDict, x)), reverse = True)
 			cover = []
+			if cooc is not None:
+				emptyTags = set([x for x in l if len(self.__getPosting(tagDict, x)) == 0])
 			while len(l) > 1:
 				biggestSet = l[0]
 				otherSets = l[1:]
-				l = [x for x in otherSets if not tagDict['t2e'][biggestSet] > tagDict['t2e'][x]]
+				if cooc is not None:
+					# Tags whose elements are a proper subset of those of biggestSet,
+					# found from the number of elements they share. The elements of
+					# implied tags are not counted in the view.
+					n = len(self.__getPosting(tagDict, biggestSet))
+					subsets = set([x for (x, count) in cooc.get(biggestSet, {}).iteritems()
+							if count == len(t2e[x]) and count < n and x not in implied])
+
+					# Implied tags are compared by their elements
+					subsets.update([x for x in otherSets if (x in implied or biggestSet in implied) and
+							self.__getPosting(tagDict, biggestSet) > self.__getPosting(tagDict, x)])
+					if n > 0:
+						subsets.update(emptyTags)
+					l = [x for x in otherSets if x not in subsets]
+				else:
+					l = [x for x in otherSets
+							if not self.__getPosting(tagDict, biggestSet) > self.__getPosting(tagDict, x)]
 				cover.append(biggestSet)
 
 			retTagList = cover + l
 
-		remainingElements = intersection_set
+		if (getCover or beRestrictive) and intersection_set_len > 20:
+			if useView and len(tagList) == 0:
+				# Elements which are not in any tag
+				remainingElements = tagDict['untagged']
+			elif useView and set(retTagList).isdisjoint(tagDict.get('ancestors', {}).get(tagIds[0], ())):
+				# Elements which are only in this tag
+				remainingElements = tagDict['sole'].get(tagIds[0], set([]))
+			elif useView:
+				# Elements which are only in this tag are in the tags implied by it
+				remainingElements = set([])
+			else:
+				if intersection_set is None and len(tagList) == 0:
+					intersection_set = set(e2t.keys())
+				elif intersection_set is None:
+					intersection_set = t2e[tagIds[0]].copy()
+				remainingElements = intersection_set
+				for tagId in retTagList:
+					remainingElements.difference_update(self.__getPosting(tagDict, tagId))
+		elif intersection_set is None and len(tagList) == 0:
+			remainingElements = e2t.keys()
+		elif intersection_set is None:
+			remainingElements = t2e[tagIds[0]]
+		else:
+			remainingElements = intersection_set
+
+		return self.__getTagNames(tagDict, retTagList), list(remainingElements)
+
+	def getRankedTagsAndElementsForTags(self, tagList=[], maxTags=None):
+		"""
+		T.getRankedTagsAndElementsForTags() -> Get the tags which best divide the elements associated with the given tags
+
+		The tags considered are those returned by L{getTagsAndElementsForTags} with beRestrictive.
+		Each tag is scored by how evenly it divides the elements associated with the given tags,
+		a tag with half of the elements being the best. The tags and the elements are found
+		in a single pass over the elements, or from the views when they are kept.
+
+		@param tagList: List of tags for which the associated Elements and Tags are to be fetched.
+			Defaults to all the tags in this tagging instance
+		@type tagList: List
+
+		@param maxTags: Number of best tags to return. All the tags are returned if None
+		@type maxTags: int
+
+		@return: Tuple (List of Tags, List of Elements). Tags are ordered best first. Elements
+			are those not associated with any of the returned tags, or all the elements
+			associated with the given tags if they are 20 or less.
+		@rtype: C{(List, List)}
+		"""
+
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return [], []
+
+		e2t = tagDict['e2t']
+		t2e = tagDict['t2e']
+		cooc = tagDict.get('cooc')
+		implied = tagDict.get('implied', {})
+		ancestors = tagDict.get('ancestors')
+		tagIds = self.__getTagIds(tagDict, tagList)
 
-		if (getCover or beRestrictive) and len(remainingElements) > 20:
-			for tag in retTagList:
-				remainingElements.difference_update(tagDict['t2e'][tag])
+		# Count the elements of each tag, among the elements associated with the given tags
+		elements = None
+		if len(tagList) == 0:
+			n = len(e2t)
+			counts = dict([(tagId, len(self.__getPosting(tagDict, tagId))) for tagId in t2e])
+			elements = None
+			useView = 'untagged' in tagDict
+		elif len(tagIds) == 1 and len(tagList) == 1 and cooc is not None and tagIds[0] not in implied:
+			n = len(t2e[tagIds[0]])
+			counts, viewCounts = self.__getViewCounts(tagDict, tagIds[0])
+			useView = True
+		else:
+			elements = self.__evaluateQuery(tagDict, tagList)
+
+			n = len(elements)
+			counts = {}
+			for e in elements:
+				elementTagIds = e2t[e]
+				if ancestors:
+					# Tags implied by the tags of the element
+					elementTagIds = elementTagIds.union(*[ancestors[x] for x in elementTagIds if x in ancestors])
+				for tagId in elementTagIds:
+					counts[tagId] = counts.get(tagId, 0) + 1
+			for tagId in tagIds:
+				counts.pop(tagId, None)
+			useView = False
 
-		return retTagList, list(remainingElements)
+		if len(tagList) == 0:
+			candidates = counts.keys()
+		else:
+			# Tags with all the elements do not divide them
+			candidates = [x for x in counts if counts[x] < n]
+			useView = useView and len([x for x in viewCounts if counts[x] < n]) == len(viewCounts)
+
+		def score(tagId):
+			return (min(counts[tagId], n - counts[tagId]), counts[tagId])
+
+		if maxTags is not None and len(candidates) > maxTags:
+			retTagList = heapq.nlargest(maxTags, candidates, key=score)
+			useView = False
+		else:
+			retTagList = sorted(candidates, key=score, reverse=True)
+
+		if elements is None and (n <= 20 or not useView):
+			if len(tagList) == 0:
+				elements = e2t.keys()
+			else:
+				elements = t2e[tagIds[0]]
+
+		if n <= 20:
+			remainingElements = elements
+		elif useView and len(tagList) == 0:
+			remainingElements = tagDict['untagged']
+		elif useView:
+			remainingElements = tagDict['sole'].get(tagIds[0], set([]))
+		else:
+			remainingElements = set(elements).difference(*[self.__getPosting(tagDict, x) for x in retTagList])
+
+		return self.__getTagNames(tagDict, retTagList), list(remainingElements)
 		
 	# Get tags associated with all the elements
+	def getRelatedTags(self, tagList=[], maxTags=10):
+		"""
+		T.getRelatedTags(tagList, maxTags) -> Get the tags whose elements are most like the elements of the given tags
+
+		Tags are compared by the Jaccard similarity of their elements, the number of elements
+		they share divided by the number of elements in either, estimated from their MinHash
+		signatures. Only the tags sharing a band of their signature with the signature of the
+		given tags are compared, they are found from an index of the bands. Tags with a similarity
+		below about a half are rarely found. The signatures are kept in the 'sketches' view,
+		no tags are found when it is not kept.
+
+		@param tagList: Tags whose elements are compared, as a single set of elements
+		@type tagList: List
+
+		@param maxTags: Number of tags to return
+		@type maxTags: int
+
+		@return: List of tuples (tag, similarity), most similar first
+		@rtype: C{list}
+		"""
+
+		err, tagDict = self.__getTagDictRO()
+		if err != 0 or 'minhash' not in tagDict:
+			return []
+
+		tagIds = self.__getTagIds(tagDict, tagList)
+		values = self.__getSignature(tagDict, tagIds)
+		if values[0] == self.MINHASH_PRIME:
+			return []
+
+		candidates = set([])
+		lsh = tagDict['lsh']
+		for key in self.__getBandKeys(values):
+			candidates.update(lsh.get(key, ()))
+		candidates.difference_update(tagIds)
+
+		# The fraction of hash functions giving the same smallest value estimates the similarity
+		minhash = tagDict['minhash']
+		similarities = []
+		for tagId in candidates:
+			same = len([i for i in range(self.MINHASH_SIZE) if minhash[tagId][0][i] == values[i]])
+			similarities.append((float(same) / self.MINHASH_SIZE, tagId))
+		similarities = heapq.nlargest(maxTags, similarities)
+
+		names = tagDict['names']
+		return [(names[x], similarity) for (similarity, x) in similarities]
+
 	def getCommonTags(self, elementList=[]):
 		"""
 		T.getCommonTags() -> Get tags which are associated with all the given elements
@@ -531,7 +2237,7 @@ class Tagging:
 		"""
 		if len(elementList) == 0:
 			return []
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return []
 
@@ -544,7 +2250,7 @@ class Tagging:
 				s1.clear()
 				break
 
-		return list(s1)
+		return self.__getTagNames(tagDict, s1)
 
 	# get frequency of the specified tag
 	def getTagsFrequency(self, tagList = [], sortOrder=None):
@@ -561,7 +2267,7 @@ class Tagging:
 		@return: List of Tuples of the form (tag, frequency)
 		@rtype: C{list}
 		"""
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return []
 
@@ -570,7 +2276,10 @@ class Tagging:
 
 		retList = []
 		for tag in tagList:
-			freq = len(tagDict['t2e'].get(tag, []))
+			try:
+				freq = len(self.__getPosting(tagDict, tagDict['tags'][tag]))
+			except KeyError:
+				freq = 0
 			retList.append((tag, freq))
 
 		if sortOrder:
@@ -578,10 +2287,59 @@ class Tagging:
 			
 		return retList
 
+	def estimateElements(self, tagList=[]):
+		"""
+		T.estimateElements(tagList) -> Estimate the number of elements selected by tagList, without selecting them
+
+		The number is exact for no tags, for a single tag, and for two tags when the 'tags' view
+		is kept. For more tags it is estimated from the MinHash signatures of the tags, when the
+		'sketches' view is kept. Otherwise, and for terms, alternatives and negations, the elements
+		are selected and counted, and the result is cached for getting them, see L{getElements}.
+
+		@param tagList: List of tags, like the tagList of L{getElements}
+		@type tagList: List
+
+		@return: Number of elements
+		@rtype: int
+		"""
+
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return 0
+
+		if len(tagList) == 0:
+			return len(tagDict['e2t'])
+
+		tags = tagDict['tags']
+		if len([x for x in tagList if x not in tags]) == 0:
+			tagIds = list(set(self.__getTagIds(tagDict, tagList)))
+			implied = tagDict.get('implied', {})
+			cooc = tagDict.get('cooc')
+			if len([x for x in tagIds if x in implied]) > 0:
+				# The view does not count the elements of tags implying a tag
+				cooc = None
+
+			if len(tagIds) == 1:
+				return len(self.__getPosting(tagDict, tagIds[0]))
+			elif len(tagIds) == 2 and cooc is not None:
+				return cooc.get(tagIds[0], {}).get(tagIds[1], 0)
+			elif 'minhash' in tagDict:
+				estimate = self.__estimateIntersection(tagDict, tagIds)
+				if cooc is not None:
+					# Elements having all the tags are among those shared by any two of them
+					estimate = min([estimate] + [cooc.get(x, {}).get(y, 0) for x in tagIds for y in tagIds if x < y])
+				return estimate
+
+		return len(self.__evaluateQuery(tagDict, tagList))
+
 	def getElements(self, tagList=[], elementList=[]):
 		"""
 		T.getElements(tagList, elementList) -> Get a subset of elements from elementList such that the elements are tagged with tags from tagList
 
+		Besides tags, tagList may have terms (see L{getTermTags}, L{searchElements}, L{setAttributes}
+		and L{saveQuery}), alternatives like 'jpg|png' and negations like '-live' (see
+		L{Query.parseComponent}). Results are cached till the database is changed.
+
 		@param elementList: List of elements. Defaults to empty list
 		@type elementList: List
 
@@ -592,7 +2350,7 @@ class Tagging:
 		@rtype: C{list}
 		"""
 
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return []
 
@@ -602,21 +2360,12 @@ class Tagging:
 			else:
 				return tagDict['e2t'].keys()
 
-		# Initialize a set with list of elements
-		s1 = tagDict['t2e'].get(tagList[0], set([])).copy()
-		try:
-
-			# For each tag in the tag list, get elements asociated with the tag
-			# the existing set of elements will be intersected with elements associated
-			# with the current tag
-			for tag in tagList[1:]:
-				s1.intersection_update(tagDict['t2e'][tag])
-
-			if len(elementList) > 0:
-				s1.intersection_update(set(elementList))
+		# For each component of the tag list, get elements asociated with it
+		# the sets of elements are intersected, smallest first
+		s1 = self.__evaluateQuery(tagDict, tagList)
 
-		except KeyError:
-			s1.clear()
+		if len(elementList) > 0:
+			s1.intersection_update(set(elementList))
 
 		# s1 now contains those elements which are associated with all the tags
 		# in the tag list
@@ -635,11 +2384,11 @@ class Tagging:
 		@return: True is element exists, False otherwise
 		@rtype: C{bool}
 		"""
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return ""
 			
-		if element in tagDict['e2t'].keys():
+		if element in tagDict['e2t']:
 			return True
 		else:
 			return False
@@ -654,15 +2403,124 @@ class Tagging:
 		@return: True if Tag exists, False otherwise
 		@rtype: C{bool}
 		"""
-		err, tagDict = self.tagDB.getDataRO()
+		err, tagDict = self.__getTagDictRO()
 		if err != 0:
 			return ""
 			
-		if tag in tagDict['t2e'].keys():
+		if tag in tagDict['tags']:
 			return True
 		else:
 			return False
 
+	def getValueTags(self, term):
+		"""
+		T.getValueTags(term) -> Get the value tags selected by a term
+
+		A term is the name of value tags followed by an operator and a value, like 'year>=2003'.
+		The operators are '<', '<=', '>', '>=' and '='. Values are compared as numbers, as dates
+		like 2003-05-10, or else as strings, and only with values of the same kind. A value
+		ending with '*' after '=' selects the dates and strings starting with the rest of the value.
+
+		The tags are looked up in a sorted index of the values, without going through all
+		the tags.
+
+		@param term: Term to be matched
+		@type term: str
+
+		@return: List of tags in the order of their values. None if term is not a term
+		@rtype: C{list}
+		"""
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return None
+
+		match = self.VALUE_TERM.match(term)
+		if not match:
+			return None
+
+		return self.__getTagNames(tagDict, self.__findTermTags(tagDict, term))
+
+	def getElementName(self, element):
+		"""
+		T.getElementName(element) -> Get the name of an element, by which it is searched
+
+		@param element: Element whose name is to be got
+		@type element: Object
+
+		@return: The 'name' attribute of the element if it has one, the element otherwise
+		@rtype: str
+		"""
+		return getattr(element, 'name', element)
+
+	def searchElements(self, text, tagList=[]):
+		"""
+		T.searchElements(text, tagList) -> Get the elements whose names contain some text
+
+		Case is ignored. When the 'search' view is kept the elements are found from an index
+		of the sequences of three characters in their names, otherwise all the names are
+		searched. The search term made of L{SEARCH_TERM_PREFIX} followed by the text, like
+		'/beat', can be given in tagList to the other functions.
+
+		@param text: Text to be searched for
+		@type text: str
+
+		@param tagList: Only the elements tagged with all these tags are returned
+		@type tagList: List
+
+		@return: List of elements
+		@rtype: C{list}
+		"""
+		return self.getElements(tagList + [self.SEARCH_TERM_PREFIX + text])
+
+	def getTermTags(self, term):
+		"""
+		T.getTermTags(term) -> Get the tags selected by a term
+
+		A term is either a value term, see L{getValueTags}, or a prefix followed by '*',
+		see L{getTagsWithPrefix}.
+
+		@param term: Term to be matched
+		@type term: str
+
+		@return: List of tags. None if term is not a term
+		@rtype: C{list}
+		"""
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return None
+
+		tagIds = self.__findTermTags(tagDict, term)
+		if tagIds is None:
+			return None
+
+		return self.__getTagNames(tagDict, tagIds)
+
+	def getTagsWithPrefix(self, prefix, maxTags=None):
+		"""
+		T.getTagsWithPrefix(prefix, maxTags) -> Get the tags whose names start with a prefix
+
+		The tags are looked up in a sorted index of the names of the tags, without going
+		through all the tags. A term made of a prefix followed by '*', like 'mus*', selects
+		the elements of all these tags.
+
+		@param prefix: Prefix of the names
+		@type prefix: str
+
+		@param maxTags: Number of tags to return, all the tags are returned if None
+		@type maxTags: int
+
+		@return: List of tags, sorted by name
+		@rtype: C{list}
+		"""
+		err, tagDict = self.__getTagDictRO()
+		if err != 0:
+			return []
+
+		tags = self.__findPrefixTags(tagDict, prefix)
+		if maxTags is not None:
+			tags = tags[:maxTags]
+		return tags
+
 def main():
 		tagging = Tagging("/tmp")
 		tagging.initDB(forceInit=True)
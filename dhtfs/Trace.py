@@ -0,0 +1,211 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import errno
+import threading
+import types
+import cPickle
+
+TRACE_MAGIC = 'dhtfs-trace'
+TRACE_VERSION = 1
+
+def getErrno(result):
+	"""
+	getErrno(result) -> Error returned by a filesystem operation, 0 on success
+	"""
+
+	if type(result) is types.IntType and result < 0:
+		return -result
+	return 0
+
+def readTrace(path):
+	"""
+	readTrace(path) -> Generator of the records in a trace file
+
+	Each record is a tuple (operation, handle, arguments, start, elapsed, error).
+	handle identifies the open file for file operations and is None otherwise.
+	start is the time in seconds since the trace was started.
+
+	@param path: Path of the trace file
+	@type path: str
+
+	@rtype: Generator of tuples
+	"""
+
+	f = open(path, 'rb')
+	try:
+		header = cPickle.load(f)
+		if header[0] != TRACE_MAGIC or header[1] != TRACE_VERSION:
+			raise ValueError("%s is not a dhtfs trace" % path)
+
+		while True:
+			try:
+				yield cPickle.load(f)
+			except EOFError:
+				break
+	finally:
+		f.close()
+
+class Tracer(object):
+	"""
+	Records the filesystem operations made on a dhtfs file system to a trace file
+
+	The tracer provides wrappers for the operations of Dhtfs and of its file class.
+	Records are pickled one after another to the trace file and can be read back
+	with readTrace.
+
+	Typical usage of this class would be as follows:
+
+	Example
+	=======
+	from Trace import Tracer
+
+	tracer = Tracer('/tmp/dhtfs.trace')
+	server.wrapOperations(tracer.wrap, tracer.wrapFileOp)
+	...
+	tracer.close()
+	"""
+
+	def __init__(self, path, logger=None):
+		"""
+		Tracer(path, logger) -> instance of class Tracer
+
+		@param path: Path of the trace file, it is overwritten if it exists
+		@type path: str
+
+		@param logger: Logger to log errors in writing the trace
+		@type logger: logging.Logger
+		"""
+
+		self.path = path
+		self.logger = logger
+		self.lock = threading.Lock()
+		self.nextHandle = 1
+		self.file = open(path, 'wb')
+		self.startTime = time.time()
+		cPickle.dump((TRACE_MAGIC, TRACE_VERSION, self.startTime), self.file, cPickle.HIGHEST_PROTOCOL)
+
+	def close(self):
+		"""
+		T.close() -> Stop recording and close the trace file
+		"""
+
+		self.lock.acquire()
+		try:
+			if self.file:
+				self.file.close()
+				self.file = None
+		finally:
+			self.lock.release()
+
+	def __record(self, op, handle, args, start, elapsed, err):
+		self.lock.acquire()
+		try:
+			if not self.file:
+				return
+			try:
+				cPickle.dump((op, handle, args, start - self.startTime, elapsed, err),
+						self.file, cPickle.HIGHEST_PROTOCOL)
+			except:
+				if self.logger:
+					self.logger.exception("Could not record %s to trace %s" % (op, self.path))
+		finally:
+			self.lock.release()
+
+	def __call(self, op, handle, fn, args, recordedArgs):
+		start = time.time()
+		try:
+			result = fn(*args)
+			if op == 'readdir':
+				# The listing is produced lazily, time all of it
+				result = list(result)
+		except (OSError, IOError), e:
+			self.__record(op, handle, recordedArgs, start, time.time() - start, e.errno or errno.EIO)
+			raise
+		except:
+			self.__record(op, handle, recordedArgs, start, time.time() - start, errno.EIO)
+			raise
+
+		self.__record(op, handle, recordedArgs, start, time.time() - start, getErrno(result))
+		return result
+
+	def wrap(self, op, fn):
+		"""
+		T.wrap(op, fn) -> Function recording each call of the filesystem operation fn
+
+		@param op: Name of the operation
+		@type op: str
+
+		@param fn: Bound method implementing the operation
+		@type fn: callable
+
+		@rtype: function
+		"""
+
+		def traced(*args):
+			return self.__call(op, None, fn, args, args)
+
+		return traced
+
+	def wrapFileOp(self, op, fn):
+		"""
+		T.wrapFileOp(op, fn) -> Function recording each call of the file operation fn
+
+		The open of a file is recorded as operation 'open' with arguments
+		(path, flags, mode...). Other file operations are recorded with the handle
+		assigned when the file was opened. Only the size of the data is recorded for writes.
+
+		@param op: Name of the operation, 'open' for the constructor of the file class
+		@type op: str
+
+		@param fn: Function implementing the operation, taking the file object as first argument
+		@type fn: function
+
+		@rtype: function
+		"""
+
+		def traced(fileObject, *args):
+			if op == 'open':
+				self.lock.acquire()
+				try:
+					handle = self.nextHandle
+					self.nextHandle = self.nextHandle + 1
+				finally:
+					self.lock.release()
+				fileObject.traceHandle = handle
+			else:
+				handle = getattr(fileObject, 'traceHandle', None)
+
+			recordedArgs = args
+			if op == 'write':
+				recordedArgs = (len(args[0]),) + args[1:]
+
+			return self.__call(op, handle, fn, (fileObject,) + args, recordedArgs)
+
+		return traced
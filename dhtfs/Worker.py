@@ -0,0 +1,147 @@
+# Copyright (c) 2006, Mayuresh Phadke
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+# 	    documentation and/or other materials provided with the distribution.
+#         * Neither the name of 'QualEx Systems' nor the names of its
+# 	    contributors may be used to endorse or promote products derived from
+# 	    this software without specific prior written permission.
+# 
+#         THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import Queue
+import time
+
+class Worker(threading.Thread):
+	"""
+	Thread which processes items queued to it, in the background
+
+	Each item put in the queue of the worker is passed to the handler.
+	Exceptions raised by the handler are logged and the worker moves on to the next item.
+
+	Typical usage of this class would be as follows:
+
+	Example
+	=======
+	from Worker import Worker
+
+	def handler(item):
+		print item
+
+	w = Worker('printer', handler)
+	w.start()
+	w.put('hello')
+	w.stop()
+	"""
+
+	# Item which asks the worker to stop
+	STOP = object()
+
+	def __init__(self, name, handler, logger=None, queue=None, batch=False):
+		"""
+		Worker(name, handler, logger, queue, batch) -> instance of class Worker
+
+		@param name: Name of the worker thread
+		@type name: str
+
+		@param handler: Function called with each item queued to the worker
+		@type handler: callable
+
+		@param logger: Logger to log errors in the handler
+		@type logger: logging.Logger
+
+		@param queue: Queue from which items are taken. Workers sharing a queue form a pool,
+			each item is processed by one of them. A new queue is created if not specified.
+		@type queue: Queue.Queue
+
+		@param batch: If True the handler is called with a list of all the items queued
+			by the time it is called, instead of with each item
+		@type batch: bool
+		"""
+
+		threading.Thread.__init__(self, name=name)
+
+		# Do not keep the process alive for the sake of the worker
+		self.setDaemon(True)
+
+		if queue is None:
+			queue = Queue.Queue()
+
+		self.queue = queue
+		self.handler = handler
+		self.logger = logger
+		self.batch = batch
+		self.processed = 0
+		self.failed = 0
+
+		# Time at which the worker started taking items
+		self.started = None
+
+	def put(self, item):
+		"""
+		W.put(item) -> Queue an item to be processed by the worker
+
+		@param item: Item to be processed
+		@type item: object
+		"""
+
+		self.queue.put(item)
+
+	def stop(self):
+		"""
+		W.stop() -> Ask the worker to stop after the items already queued are processed
+
+		For a pool, stop is to be called once for each worker in the pool
+		"""
+
+		self.queue.put(Worker.STOP)
+
+	def run(self):
+		self.started = time.time()
+
+		while True:
+			items = [self.queue.get()]
+
+			# Take the items which have been queued meanwhile, up to a request to stop
+			while self.batch and items[-1] is not Worker.STOP:
+				try:
+					items.append(self.queue.get_nowait())
+				except Queue.Empty:
+					break
+
+			stop = items[-1] is Worker.STOP
+			if stop:
+				items.pop()
+
+			if len(items) > 0:
+				try:
+					if self.batch:
+						self.handler(items)
+					else:
+						self.handler(items[0])
+				except:
+					self.failed = self.failed + len(items)
+					if self.logger:
+						self.logger.exception("%s: Failed to process %s" % (self.getName(), items))
+
+				self.processed = self.processed + len(items)
+
+			if stop:
+				break
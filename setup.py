@@ -30,7 +30,8 @@ from distutils.core import setup
 setup(	name = 'dhtfs',
 	version = '0.2.0',
 	packages = ['dhtfs'],
-	scripts = ['scripts/addTags', 'scripts/mkfs.dhtfs', 'scripts/mount.dhtfs', 'scripts/delTags'],
+	scripts = ['scripts/addTags', 'scripts/mkfs.dhtfs', 'scripts/mount.dhtfs', 'scripts/delTags',
+			'scripts/migrate.dhtfs', 'scripts/import.dhtfs'],
 	author = 'Mayuresh Phadke',
 	author_email = 'mayuresh_phadke@qualexsystems.com',
 	description = 'Tagging filesystem providing dynamic directory hierarchy using tags',